@@ -3,7 +3,16 @@ import uuid
 import logging
 from config import conf
 
+# Read (or generated) once per process
+_agent_id = None
+
 def get_agent_id():
+    global _agent_id
+    if _agent_id is None:
+        _agent_id = load_agent_id()
+    return _agent_id
+
+def load_agent_id():
     id_file = conf.get("agent_id_file")
     
     # 1. Read existing ID
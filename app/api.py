@@ -1,27 +1,156 @@
-import requests
+import json
+import zlib
 import logging
 from config import conf
+import delta
+
+# `requests` and `zstandard` are imported on first upload, not at startup:
+# together they are most of the agent's import time
+
+CHUNK_SIZE = 64 * 1024
+# Fallback order when the server answers 415 Unsupported Media Type
+ENCODINGS = ("zstd", "gzip", "identity")
+
+# Server's scheduling hint from the last response: seconds to wait
+# before the next check-in (0 = keep our own schedule)
+next_checkin_after = 0
+
+def zstd_module():
+    """The zstandard module, or None if it is not installed."""
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+class BodyStream:
+    """
+    Streams `body` as compressed JSON without ever building the whole
+    JSON string: JSONEncoder.iterencode() pieces go straight into the
+    compressor, and compressed output is yielded in CHUNK_SIZE blocks.
+    Counts raw and sent bytes for logging.
+    """
+
+    def __init__(self, body, encoding):
+        self.body = body
+        self.encoding = encoding
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    def _compressor(self):
+        if self.encoding == "zstd":
+            return zstd_module().ZstdCompressor(level=3).compressobj()
+        if self.encoding == "gzip":
+            return zlib.compressobj(6, zlib.DEFLATED, 31)
+        return None
+
+    def __iter__(self):
+        compressor = self._compressor()
+        pieces, size = [], 0
+        for piece in json.JSONEncoder(separators=(",", ":")).iterencode(self.body):
+            pieces.append(piece)
+            size += len(piece)
+            if size >= CHUNK_SIZE:
+                chunk = self._encode(pieces, compressor)
+                pieces, size = [], 0
+                if chunk:
+                    yield chunk
+        chunk = self._encode(pieces, compressor)
+        if compressor:
+            tail = compressor.flush()
+            self.sent_bytes += len(tail)
+            chunk += tail
+        if chunk:
+            yield chunk
+
+    def _encode(self, pieces, compressor):
+        data = "".join(pieces).encode("utf-8")
+        self.raw_bytes += len(data)
+        if compressor:
+            data = compressor.compress(data)
+        self.sent_bytes += len(data)
+        return data
+
+def read_schedule_hint(resp):
+    global next_checkin_after
+    try:
+        next_checkin_after = max(0, float(resp.json().get("next_checkin_after", 0)))
+    except Exception:
+        next_checkin_after = 0
+    if next_checkin_after:
+        logging.info(f"Server asked to check in again after {int(next_checkin_after)}s")
+
+def upload_encoding():
+    encoding = conf.get("upload_encoding") or "gzip"
+    if encoding == "zstd" and zstd_module() is None:
+        logging.warning("zstandard not installed, uploading gzip instead")
+        return "gzip"
+    return encoding if encoding in ENCODINGS else "gzip"
+
+def post(body, encoding):
+    """POSTs one upload body. Returns the HTTP status, or None."""
+    import requests
 
-def upload_payload(payload):
     url = conf.get("server_url")
     headers = {
         "Content-Type": "application/json",
-        "Authorization": f"Bearer {conf.get('api_key')}"
+        "Authorization": f"Bearer {conf.get('api_key')}",
+        "X-Agent-Id": str(body.get("agent_id")),
+        # Lets the server refuse a stale delta before reading the body
+        "X-Base-Snapshot": body.get("base_hash") or "none",
+        # Lets a queueing server check our next delta before this one is stored
+        "X-Snapshot-Hash": body.get("snapshot_hash") or ""
     }
-    
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+
     try:
-        logging.info(f"Uploading scan data ({len(str(payload))} bytes) to {url}...")
-        resp = requests.post(url, json=payload, headers=headers, timeout=30)
-        
+        stream = BodyStream(body, encoding)
+        logging.info(f"Uploading {body.get('type')} scan data ({encoding}) to {url}...")
+        resp = requests.post(url, data=iter(stream), headers=headers, timeout=30)
+        logging.info(f"Sent {stream.sent_bytes} bytes ({stream.raw_bytes} bytes of JSON)")
+        read_schedule_hint(resp)
+
         if resp.status_code == 200:
             logging.info("✅ Upload Success")
-            return True
+        elif resp.status_code == 202:
+            logging.info("✅ Upload Accepted (queued by server)")
         elif resp.status_code == 401:
             logging.critical("❌ Auth Failed: Check API Key")
-        else:
+        elif resp.status_code == 503:
+            logging.warning("⚠️ Server busy, upload will be retried")
+        elif resp.status_code not in (409, 415):
             logging.warning(f"⚠️ Upload Failed: Server returned {resp.status_code}")
-            
+        return resp.status_code
+
     except Exception as e:
         logging.error(f"❌ Connection Error: {e}")
-        
-    return False
\ No newline at end of file
+
+    return None
+
+def send(body):
+    encoding = upload_encoding()
+    status = post(body, encoding)
+    # Older servers may not decode zstd (or anything): step down
+    while status == 415 and encoding != "identity":
+        encoding = ENCODINGS[ENCODINGS.index(encoding) + 1]
+        logging.warning(f"Server cannot decode this upload, retrying with {encoding}")
+        conf.data["upload_encoding"] = encoding
+        status = post(body, encoding)
+    return status
+
+def upload_payload(payload):
+    # Only what changed since the server last acknowledged a snapshot
+    body, state = delta.build_upload(payload)
+    status = send(body)
+
+    if status == 409:
+        logging.warning("🔁 Server snapshot differs, resyncing with a full upload")
+        delta.clear_snapshot()
+        body, state = delta.build_upload(payload)
+        status = send(body)
+
+    if status in (200, 202):
+        delta.save_snapshot(*state)
+        return True
+    return False
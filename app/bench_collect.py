@@ -0,0 +1,100 @@
+"""
+Benchmark: collection cycle wall time and CPU with one osqueryi process
+per query (the previous collectors), one shared OsquerySession without
+deadlines, and the agent's collection (main.collect: collectors run
+concurrently, one osqueryi and deadline each).
+
+    python app/bench_collect.py                      # fake osqueryi
+    python app/bench_collect.py --osqueryi /usr/bin/osqueryi
+    python app/bench_collect.py --rounds 5 --startup-ms 300
+    python app/bench_collect.py --slow rpm_packages:20 --timeout 5
+
+CPU is user + system time of this process and all its children.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import main
+from config import conf
+from osquery import OsquerySession
+from collectors import os_info, hardware, network, services, software
+
+COLLECTORS = (os_info, hardware, network, services, software)
+
+def fake_osqueryi():
+    """Writes an executable wrapper around fake_osqueryi.py."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_osqueryi.py")
+    wrapper = os.path.join(tempfile.mkdtemp(prefix="vscanner_bench_"), "osqueryi")
+    with open(wrapper, "w") as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" "$@"\n')
+    os.chmod(wrapper, 0o755)
+    return wrapper
+
+def cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def per_query(binary):
+    # The old path: `osqueryi --json <sql>` once per query
+    session = OsquerySession(binary)
+    for collector in COLLECTORS:
+        collector.register_queries(session)
+    session.results = {}
+    for name, sql, _ in session.queries:
+        res = subprocess.run([binary, "--json", sql], capture_output=True, text=True)
+        session.results[name] = json.loads(res.stdout) if res.stdout.strip() else []
+    return len(session.queries), len(software.get_software_inventory(session))
+
+def shared(binary):
+    session = OsquerySession(binary)
+    for collector in COLLECTORS:
+        collector.register_queries(session)
+    session.run()
+    return 1, len(software.get_software_inventory(session))
+
+def collect(binary, timeout=None):
+    conf.data["osquery_bin"] = binary
+    main.init_runtime()
+    main.CHANGES.last.clear()
+    sections, status, _ = main.collect(timeout)
+    partial = [name for name, state in status.items() if state != "ok"]
+    if partial:
+        print(f"   (partial: {', '.join(partial)})")
+    # One osqueryi per collector that ran
+    return sum(1 for state in status.values() if state != "unchanged"), len(sections["inventory"])
+
+def run(label, fn, binary, rounds):
+    started, cpu = time.perf_counter(), cpu_seconds()
+    for _ in range(rounds):
+        processes, rows = fn(binary)
+    wall = (time.perf_counter() - started) / rounds
+    cpu = (cpu_seconds() - cpu) / rounds
+    print(f"   {label:<10} {processes:>2} osqueryi, {rows:>6} rows   wall {wall:6.2f}s   cpu {cpu:6.2f}s")
+    return wall, cpu
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark osquery collection")
+    parser.add_argument("--osqueryi", help="Real osqueryi binary (default: fake stand-in)")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--startup-ms", type=int, default=150, help="Fake osqueryi startup CPU cost")
+    parser.add_argument("--slow", default="", help="Fake slow tables, e.g. rpm_packages:20")
+    parser.add_argument("--timeout", type=float, help="Per-collector timeout for the collect run")
+    args = parser.parse_args()
+
+    os.environ["FAKE_OSQUERYI_STARTUP_MS"] = str(args.startup_ms)
+    os.environ["FAKE_OSQUERYI_SLOW"] = args.slow
+    binary = args.osqueryi or fake_osqueryi()
+
+    print(f"--- ⏱️ Collection cycle ({args.rounds} rounds, {binary}) ---")
+    before = run("per-query", per_query, binary, args.rounds)
+    after = run("session", shared, binary, args.rounds)
+    agent = run("collect", lambda b: collect(b, args.timeout), binary, args.rounds)
+    print(f"\n✅ Session: wall {before[0] / after[0]:.1f}x faster, CPU {before[1] / after[1]:.1f}x lower")
+    print(f"✅ Collect: wall {before[0] / agent[0]:.1f}x faster, CPU {before[1] / agent[1]:.1f}x lower")
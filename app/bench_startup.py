@@ -0,0 +1,82 @@
+"""
+Benchmark: agent import time, cold start and resident memory.
+
+Each round starts a fresh interpreter that imports `main` and resolves
+the agent id (everything the service does before its first cycle), and
+reports wall time and peak RSS. `-X importtime` lists the slowest
+imports on that path. The HTTP stack is only imported on first upload;
+its cost is reported separately.
+
+    python app/bench_startup.py
+    python app/bench_startup.py --rounds 20
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+COLD_START = """
+import json, os, resource, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {app_dir!r})
+import main
+from config import conf
+conf.data["agent_id_file"] = {id_file!r}
+main.agent_id.get_agent_id()
+main.agent_id.get_agent_id()
+elapsed = time.perf_counter() - started
+rss_kb, modules, eager = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, len(sys.modules), "requests" in sys.modules
+started = time.perf_counter()
+import requests
+upload = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "rss_kb": rss_kb, "modules": modules, "requests": eager,
+                  "upload_import": upload, "upload_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}}))
+"""
+
+def cold_start(id_file):
+    code = COLD_START.format(app_dir=APP_DIR, id_file=id_file)
+    res = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return json.loads(res.stdout.strip().splitlines()[-1])
+
+def slowest_imports(count):
+    """(cumulative us for `import main`, its `count` slowest direct imports)"""
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {APP_DIR!r}); import main"],
+                         capture_output=True, text=True)
+    children = []
+    for line in res.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        cumulative, name = int(parts[1]), parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 0:
+            if name.strip() == "main":
+                return cumulative, sorted(children, reverse=True)[:count]
+            children = []  # children are listed before their parent
+        elif depth == 1:
+            children.append((cumulative, name.strip()))
+    return 0, []
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark agent startup")
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    id_file = os.path.join(tempfile.mkdtemp(prefix="vscanner_bench_"), "agent_id")
+    runs = [cold_start(id_file) for _ in range(args.rounds)]
+    total, top = slowest_imports(8)
+
+    print(f"--- ⏱️ Agent startup ({args.rounds} rounds) ---")
+    print(f"   cold start  {statistics.median(r['seconds'] for r in runs) * 1000:7.1f} ms (median)")
+    print(f"   peak RSS    {statistics.median(r['rss_kb'] for r in runs) / 1024:7.1f} MB")
+    print(f"   modules     {runs[0]['modules']:7d}   (requests loaded: {runs[0]['requests']})")
+    print(f"   first upload +{statistics.median(r['upload_import'] for r in runs) * 1000:6.1f} ms, "
+          f"{statistics.median(r['upload_rss_kb'] for r in runs) / 1024:.1f} MB peak RSS (importing requests)")
+    print(f"\n   import main {total / 1000:7.1f} ms, slowest direct imports:")
+    for us, name in top:
+        print(f"   {us / 1000:9.1f} ms  {name}")
@@ -0,0 +1,90 @@
+import glob
+import hashlib
+import logging
+import os
+import platform
+import time
+
+OS_TYPE = platform.system()
+
+# Cheap signals per payload section: if none of these changed, neither did
+# the section. Files and dirs are compared by (mtime, size). Sections
+# without signals are always collected: hardware and asset_summary report
+# free disk space and uptime, which change without touching any file.
+SIGNALS = {}
+if OS_TYPE == "Linux":
+    SIGNALS = {
+        "inventory": [
+            "/var/lib/dpkg/status",
+            "/var/lib/rpm/Packages",
+            "/var/lib/rpm/rpmdb.sqlite",
+            "/var/lib/snapd/state.json",
+            "/usr/lib/python3*/site-packages",
+            "/usr/lib/python3/dist-packages",
+            "/usr/local/lib/python3*/site-packages",
+            "/usr/local/lib/python3*/dist-packages",
+            "/root/.local/lib/python3*/site-packages",
+            "/home/*/.local/lib/python3*/site-packages",
+            "/root/.config/google-chrome/*/Extensions",
+            "/home/*/.config/google-chrome/*/Extensions",
+            "/home/*/.config/chromium/*/Extensions",
+        ],
+    }
+
+class ChangeDetector:
+    """
+    Remembers each skippable section's last data with the signature of its
+    change signals, and hands the data back while the signature holds.
+    Sections are recollected at least every `max_age` seconds, in case a
+    change went through a path the signals do not cover.
+    """
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self.last = {}
+        self.checks = 0
+        self.skips = 0
+        self.saved = 0.0
+        self.cycle_saved = 0.0
+
+    def signature(self, section):
+        patterns = SIGNALS.get(section)
+        if not patterns:
+            return None
+        h = hashlib.sha256()
+        for pattern in patterns:
+            for path in sorted(glob.glob(pattern)):
+                try:
+                    st = os.stat(path)
+                    h.update(f"{path}:{st.st_mtime_ns}:{st.st_size}".encode())
+                except OSError:
+                    continue
+        return h.hexdigest()
+
+    def cached(self, section, signature):
+        """The section's last data if nothing changed since, else None."""
+        if signature is None:
+            return None
+        self.checks += 1
+        entry = self.last.get(section)
+        if not entry:
+            return None
+        last_signature, data, collected_at, duration = entry
+        if last_signature != signature or time.time() - collected_at > self.max_age:
+            return None
+        self.skips += 1
+        self.saved += duration
+        self.cycle_saved += duration
+        return data
+
+    def record(self, section, signature, data, duration):
+        if signature is not None:
+            self.last[section] = (signature, data, time.time(), duration)
+
+    def report(self, skipped):
+        """Logs this cycle's skips and the running totals."""
+        rate = self.skips / self.checks if self.checks else 0
+        logging.info(f"Change detection: skipped {len(skipped)} collectors this cycle "
+                     f"({', '.join(skipped) or 'none'}, ~{self.cycle_saved:.1f}s saved); "
+                     f"overall skip rate {rate:.0%}, ~{self.saved:.0f}s saved")
+        self.cycle_saved = 0.0
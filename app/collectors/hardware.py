@@ -1,10 +1,12 @@
-import json
-import subprocess
-from config import conf
+from osquery import ensure_session
 
-OSQUERY = conf.get("osquery_bin")
+def register_queries(session):
+    session.add("hardware.system", "SELECT cpu_brand, cpu_physical_cores, physical_memory FROM system_info;")
+    # We filter for physical disks (ext4, xfs, ntfs) to avoid /proc noise
+    session.add("hardware.mounts", "SELECT device, path, type, total_space, free_space FROM mounts WHERE type IN ('ext4', 'xfs', 'ntfs', 'vfat', 'apfs');")
 
-def get_hardware_data():
+def get_hardware_data(session=None):
+    session = ensure_session(session, register_queries)
     data = {
         "cpu": {},
         "ram_gb": 0,
@@ -13,9 +15,7 @@ def get_hardware_data():
 
     # 1. CPU & RAM
     try:
-        cmd = "SELECT cpu_brand, cpu_physical_cores, physical_memory FROM system_info;"
-        res = subprocess.run([OSQUERY, "--json", cmd], capture_output=True)
-        row = json.loads(res.stdout)[0]
+        row = session.rows("hardware.system")[0]
         data['cpu'] = {
             "model": row.get('cpu_brand'),
             "cores": row.get('cpu_physical_cores')
@@ -26,12 +26,8 @@ def get_hardware_data():
     except: pass
 
     # 2. Volumes (Disk Space)
-    # We filter for physical disks (ext4, xfs, ntfs) to avoid /proc noise
     try:
-        cmd = "SELECT device, path, type, total_space, free_space FROM mounts WHERE type IN ('ext4', 'xfs', 'ntfs', 'vfat', 'apfs');"
-        res = subprocess.run([OSQUERY, "--json", cmd], capture_output=True)
-        mounts = json.loads(res.stdout)
-        for m in mounts:
+        for m in session.rows("hardware.mounts"):
             # Convert bytes to GB
             total = int(m.get('total_space', 0))
             free = int(m.get('free_space', 0))
@@ -40,4 +36,4 @@ def get_hardware_data():
             data['volumes'].append(m)
     except: pass
 
-    return data
\ No newline at end of file
+    return data
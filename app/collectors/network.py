@@ -1,10 +1,23 @@
-import json
-import subprocess
-from config import conf
+from osquery import ensure_session
 
-OSQUERY = conf.get("osquery_bin")
+def register_queries(session):
+    # 1. Interfaces & MAC
+    session.add("network.interfaces", "SELECT interface, address, mac FROM interface_details WHERE address NOT LIKE '127.%' AND address NOT LIKE '::1';")
+    # 2. Default Gateway
+    session.add("network.gateway", "SELECT gateway FROM routes WHERE destination = '0.0.0.0' LIMIT 1;")
+    # 3. DNS Servers
+    session.add("network.dns", "SELECT DISTINCT address FROM dns_resolvers;")
+    # 4. Open Ports (Crucial for Security)
+    # Joins listening_ports with processes to show WHAT is listening
+    session.add("network.open_ports", """
+        SELECT lp.port, lp.protocol, lp.address, p.name as service_name
+        FROM listening_ports lp
+        LEFT JOIN processes p ON lp.pid = p.pid
+        WHERE lp.address NOT LIKE '127.%' AND lp.address NOT LIKE '::1';
+        """)
 
-def get_network_data():
+def get_network_data(session=None):
+    session = ensure_session(session, register_queries)
     data = {
         "interfaces": [],
         "dns": [],
@@ -12,40 +25,22 @@ def get_network_data():
         "open_ports": []
     }
 
-    # 1. Interfaces & MAC
     try:
-        cmd = "SELECT interface, address, mac FROM interface_details WHERE address NOT LIKE '127.%' AND address NOT LIKE '::1';"
-        res = subprocess.run([OSQUERY, "--json", cmd], capture_output=True)
-        data['interfaces'] = json.loads(res.stdout)
+        data['interfaces'] = session.rows("network.interfaces")
     except: pass
 
-    # 2. Default Gateway
     try:
-        cmd = "SELECT gateway FROM routes WHERE destination = '0.0.0.0' LIMIT 1;"
-        res = subprocess.run([OSQUERY, "--json", cmd], capture_output=True)
-        routes = json.loads(res.stdout)
+        routes = session.rows("network.gateway")
         if routes:
             data['gateway'] = routes[0]['gateway']
     except: pass
 
-    # 3. DNS Servers
     try:
-        cmd = "SELECT DISTINCT address FROM dns_resolvers;"
-        res = subprocess.run([OSQUERY, "--json", cmd], capture_output=True)
-        data['dns'] = [x['address'] for x in json.loads(res.stdout)]
+        data['dns'] = [x['address'] for x in session.rows("network.dns")]
     except: pass
 
-    # 4. Open Ports (Crucial for Security)
-    # Joins listening_ports with processes to show WHAT is listening
     try:
-        cmd = """
-        SELECT lp.port, lp.protocol, lp.address, p.name as service_name
-        FROM listening_ports lp
-        LEFT JOIN processes p ON lp.pid = p.pid
-        WHERE lp.address NOT LIKE '127.%' AND lp.address NOT LIKE '::1';
-        """
-        res = subprocess.run([OSQUERY, "--json", cmd], capture_output=True)
-        data['open_ports'] = json.loads(res.stdout)
+        data['open_ports'] = session.rows("network.open_ports")
     except: pass
 
-    return data
\ No newline at end of file
+    return data
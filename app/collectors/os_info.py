@@ -1,11 +1,14 @@
-import json
-import subprocess
 import time
-from config import conf
+from osquery import ensure_session
 
-OSQUERY = conf.get("osquery_bin")
+def register_queries(session):
+    session.add("os_info.hostname", "SELECT hostname FROM system_info;")
+    session.add("os_info.os_version", "SELECT name, version FROM os_version;")
+    session.add("os_info.uptime", "SELECT uptime FROM uptime;")
+    session.add("os_info.last_login", "SELECT user, time, host FROM last ORDER BY time DESC LIMIT 1;")
 
-def get_os_data():
+def get_os_data(session=None):
+    session = ensure_session(session, register_queries)
     data = {
         "hostname": "unknown",
         "os_name": "unknown",
@@ -17,22 +20,19 @@ def get_os_data():
 
     # 1. Hostname
     try:
-        res = subprocess.run([OSQUERY, "--json", "SELECT hostname FROM system_info;"], capture_output=True)
-        data['hostname'] = json.loads(res.stdout)[0]['hostname']
+        data['hostname'] = session.rows("os_info.hostname")[0]['hostname']
     except: pass
 
     # 2. OS Version
     try:
-        res = subprocess.run([OSQUERY, "--json", "SELECT name, version FROM os_version;"], capture_output=True)
-        row = json.loads(res.stdout)[0]
+        row = session.rows("os_info.os_version")[0]
         data['os_name'] = row['name']
         data['os_version'] = row['version']
     except: pass
 
     # 3. Uptime & Last Boot
     try:
-        res = subprocess.run([OSQUERY, "--json", "SELECT uptime FROM uptime;"], capture_output=True)
-        uptime = int(json.loads(res.stdout)[0]['uptime'])
+        uptime = int(session.rows("os_info.uptime")[0]['uptime'])
         data['uptime_seconds'] = uptime
         # Calculate boot time
         boot_ts = time.time() - uptime
@@ -42,9 +42,7 @@ def get_os_data():
     # 4. Last User Login
     try:
         # Get the most recent login
-        cmd = "SELECT user, time, host FROM last ORDER BY time DESC LIMIT 1;"
-        res = subprocess.run([OSQUERY, "--json", cmd], capture_output=True)
-        logins = json.loads(res.stdout)
+        logins = session.rows("os_info.last_login")
         if logins:
             data['last_login'] = logins[0]
             # Convert Unix timestamp to readable
@@ -52,4 +50,4 @@ def get_os_data():
                 data['last_login']['time_str'] = time.ctime(int(data['last_login']['time']))
     except: pass
 
-    return data
\ No newline at end of file
+    return data
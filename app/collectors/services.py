@@ -1,15 +1,9 @@
-import json
-import subprocess
 import platform
-from config import conf
+from osquery import ensure_session
 
-OSQUERY = conf.get("osquery_bin")
 OS_TYPE = platform.system()
 
-def get_services():
-    services = []
-    query = ""
-
+def register_queries(session):
     # 1. Select Query based on OS
     if OS_TYPE == "Windows":
         # Windows Service Table
@@ -20,12 +14,16 @@ def get_services():
     else:
         # Linux Systemd (Default)
         query = "SELECT name, description, active_state FROM systemd_units WHERE id LIKE '%.service' AND active_state = 'active';"
+    session.add("services", query)
+
+def get_services(session=None):
+    session = ensure_session(session, register_queries)
+    services = []
 
     # 2. Execute
     try:
-        res = subprocess.run([OSQUERY, "--json", query], capture_output=True)
-        services = json.loads(res.stdout)
-    except: 
+        services = session.rows("services")
+    except:
         pass
-        
-    return services
\ No newline at end of file
+
+    return services
@@ -1,13 +1,9 @@
-import json
-import subprocess
 import platform
-from config import conf
+from osquery import ensure_session
 
-OSQUERY = conf.get("osquery_bin")
 OS_TYPE = platform.system()
 
-def get_software_inventory():
-    inventory = []
+def get_queries():
     queries = []
 
     # 1. Select Queries based on OS
@@ -17,14 +13,14 @@ def get_software_inventory():
             {"type": "win_app", "sql": "SELECT name, version, publisher as source, 'msi' as manager FROM programs;"},
             {"type": "choco", "sql": "SELECT name, version, summary as source, 'chocolatey' as manager FROM chocolatey_packages;"}
         ]
-        
+
     elif OS_TYPE == "Darwin":
         # macOS Apps + Brew
         queries = [
             {"type": "app", "sql": "SELECT bundle_name as name, bundle_version as version, 'dmg' as manager FROM apps;"},
             {"type": "brew", "sql": "SELECT name, version, 'homebrew' as manager FROM homebrew_packages;"}
         ]
-        
+
     else:
         # Linux (Debian/Redhat)
         queries = [
@@ -38,16 +34,24 @@ def get_software_inventory():
     queries.append({"type": "pip", "sql": "SELECT name, version, 'pip' as manager FROM python_packages;"})
     queries.append({"type": "chrome_ext", "sql": "SELECT name, version, 'chrome_extension' as manager FROM chrome_extensions;"})
 
-    # 3. Execute Loop
-    for q in queries:
+    return queries
+
+def register_queries(session):
+    for q in get_queries():
+        session.add(f"software.{q['type']}", q['sql'])
+
+def get_software_inventory(session=None):
+    session = ensure_session(session, register_queries)
+    inventory = []
+
+    # 3. Collect Results
+    for q in get_queries():
         try:
-            res = subprocess.run([OSQUERY, "--json", q['sql']], capture_output=True)
-            if res.returncode == 0:
-                items = json.loads(res.stdout)
-                # Normalize data (ensure 'source' exists)
-                for i in items:
-                    if not i.get('source'): i['source'] = i['name']
-                inventory.extend(items)
+            items = session.rows(f"software.{q['type']}")
+            # Normalize data (ensure 'source' exists)
+            for i in items:
+                if not i.get('source'): i['source'] = i['name']
+            inventory.extend(items)
         except: pass
 
-    return inventory
\ No newline at end of file
+    return inventory
@@ -12,6 +12,8 @@ if OS_TYPE == "Windows":
     CONFIG_FILE = os.path.join(BASE_DIR, "config.json")
     LOG_FILE = os.path.join(BASE_DIR, "logs", "agent.log")
     AGENT_ID_FILE = os.path.join(BASE_DIR, "agent_id")
+    SNAPSHOT_FILE = os.path.join(BASE_DIR, "snapshot.json.gz")
+    SPOOL_DIR = os.path.join(BASE_DIR, "spool")
     DEFAULT_BIN = r"C:\Program Files\osquery\osqueryi.exe"
 else:
     # Linux & macOS
@@ -19,30 +21,50 @@ else:
     CONFIG_FILE = os.path.join(BASE_DIR, "config.json")
     LOG_FILE = "/var/log/vscanner/agent.log"
     AGENT_ID_FILE = os.path.join(BASE_DIR, "agent_id")
+    SNAPSHOT_FILE = os.path.join(BASE_DIR, "snapshot.json.gz")
+    SPOOL_DIR = os.path.join(BASE_DIR, "spool")
     DEFAULT_BIN = "/usr/bin/osqueryi"
 
-# Ensure directories exist
-os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
-os.makedirs(BASE_DIR, exist_ok=True)
-
 DEFAULT_CONFIG = {
     "server_url": "http://localhost:5000/api/upload_scan",
     "api_key": "CHANGE_ME",
     "scan_interval": 14400,
+    "startup_splay": 300,
+    "collector_timeout": 300,
+    "unchanged_max_age": 86400,
+    "upload_encoding": "gzip",
     "osquery_bin": DEFAULT_BIN,
-    "agent_id_file": AGENT_ID_FILE
+    "agent_id_file": AGENT_ID_FILE,
+    "snapshot_file": SNAPSHOT_FILE,
+    "spool_dir": SPOOL_DIR,
+    "spool_max_bytes": 50 * 1024 * 1024,
+    "spool_max_age": 7 * 86400,
+    "retry_base": 30,
+    "retry_max": 3600
 }
 
 class Config:
+    """
+    Agent settings: DEFAULT_CONFIG overlaid with CONFIG_FILE. The file is
+    read once, on first access, not at import time; whoever writes a path
+    (log, spool, snapshot, agent id) creates its directory then.
+    """
+
     def __init__(self):
-        self.data = DEFAULT_CONFIG.copy()
-        self.load()
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self.load()
+        return self._data
 
     def load(self):
+        self._data = DEFAULT_CONFIG.copy()
         if os.path.exists(CONFIG_FILE):
             try:
                 with open(CONFIG_FILE, 'r') as f:
-                    self.data.update(json.load(f))
+                    self._data.update(json.load(f))
             except: pass
 
     def get(self, key):
@@ -0,0 +1,141 @@
+import copy
+import gzip
+import hashlib
+import json
+import logging
+import os
+from config import conf
+
+# Lists uploaded item by item, and the fields identifying one item.
+# Everything else is compared (and sent) as a whole section.
+# Keep in sync with cloud/delta.py (pinned by tests/test_delta.py)
+ITEM_KEYS = {
+    "inventory": ("manager", "name", "architecture", "version"),
+    "services": ("name",),
+    "network.open_ports": ("protocol", "port", "address"),
+}
+# Per-upload envelope, not part of the snapshot
+ENVELOPE = ("agent_id", "timestamp")
+
+def item_key(path, item):
+    return json.dumps([item.get(field) for field in ITEM_KEYS[path]])
+
+def _pop_path(state, path):
+    *parents, leaf = path.split(".")
+    for part in parents:
+        state = state.get(part)
+        if not isinstance(state, dict):
+            return None
+    return state.pop(leaf, None)
+
+def split_state(payload):
+    """
+    Splits a payload into (sections, items): `items` maps each ITEM_KEYS
+    path to {key: item}, `sections` is everything else with those lists
+    taken out (so `network` holds interfaces/dns/gateway only).
+    """
+    sections = {k: copy.deepcopy(v) for k, v in payload.items() if k not in ENVELOPE}
+    items = {}
+    for path in ITEM_KEYS:
+        rows = _pop_path(sections, path) or []
+        items[path] = {item_key(path, item): item for item in rows if isinstance(item, dict)}
+    return sections, items
+
+def snapshot_hash(sections, items):
+    """Order-independent hash of a split state."""
+    canonical = {"sections": sections, "items": {path: sorted(rows.items()) for path, rows in items.items()}}
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+# ==========================================
+# LOCAL SNAPSHOT (last payload the server acknowledged)
+# ==========================================
+def load_snapshot():
+    path = conf.get("snapshot_file")
+    if not os.path.exists(path):
+        return None
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            snap = json.load(f)
+        sections, items = snap["sections"], snap["items"]
+        if snapshot_hash(sections, items) != snap["hash"]:
+            raise ValueError("hash mismatch")
+        return snap["hash"], sections, items
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable snapshot: {e}")
+        return None
+
+def save_snapshot(sections, items):
+    path = conf.get("snapshot_file")
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump({"hash": snapshot_hash(sections, items), "sections": sections, "items": items}, f)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.error(f"Failed to save snapshot: {e}")
+
+def clear_snapshot():
+    try:
+        os.remove(conf.get("snapshot_file"))
+    except FileNotFoundError:
+        pass
+
+# ==========================================
+# DELTA
+# ==========================================
+def diff(base_sections, base_items, sections, items):
+    changed_sections = {k: v for k, v in sections.items() if base_sections.get(k) != v}
+    for k in base_sections:
+        if k not in sections:
+            changed_sections[k] = None
+
+    changed_items = {}
+    for path, rows in items.items():
+        old = base_items.get(path, {})
+        added = [item for key, item in rows.items() if key not in old]
+        changed = [item for key, item in rows.items() if key in old and old[key] != item]
+        removed = [json.loads(key) for key in old if key not in rows]
+        if added or changed or removed:
+            changed_items[path] = {"added": added, "changed": changed, "removed": removed}
+    return changed_sections, changed_items
+
+def build_upload(payload):
+    """
+    Returns (body, (sections, items)): a delta against the last
+    acknowledged snapshot, or the full payload if there is none. The
+    second value is what to save_snapshot() once the server accepts it.
+    """
+    sections, items = split_state(payload)
+    snap = load_snapshot()
+
+    if snap:
+        base_hash, base_sections, base_items = snap
+        # A collector that timed out or failed keeps its last good data,
+        # instead of showing up as everything removed. Its lists were split
+        # out of `sections`, so they are carried over from base_items.
+        for name, state in (payload.get("collection_status") or {}).items():
+            if state not in ("partial", "error"):
+                continue
+            if name in base_sections:
+                sections[name] = base_sections[name]
+            for path in ITEM_KEYS:
+                if path.split(".")[0] == name and path in base_items:
+                    items[path] = base_items[path]
+
+    new_hash = snapshot_hash(sections, items)
+    if not snap:
+        body = dict(payload, type="full", snapshot_hash=new_hash)
+        return body, (sections, items)
+
+    changed_sections, changed_items = diff(base_sections, base_items, sections, items)
+    body = {
+        "type": "delta",
+        "agent_id": payload.get("agent_id"),
+        "timestamp": payload.get("timestamp"),
+        "base_hash": base_hash,
+        "snapshot_hash": new_hash,
+        "sections": changed_sections,
+        "items": changed_items,
+    }
+    return body, (sections, items)
@@ -0,0 +1,91 @@
+"""
+Stand-in for `osqueryi --json`, for benchmarking the collectors on
+machines without osquery.
+
+Burns a configurable amount of CPU at startup (like osqueryi loading its
+table plugins), then answers either the query given on the command line
+or every statement read from stdin with synthetic rows:
+
+    python app/fake_osqueryi.py --json "SELECT name, version FROM deb_packages;"
+    echo "SELECT hostname FROM system_info;" | python app/fake_osqueryi.py --json
+
+Like the real shell, queries returning no rows print nothing, and output
+into a pipe is block-buffered (a terminal gets it line by line).
+"""
+import json
+import os
+import re
+import sys
+import time
+
+STARTUP_MS = int(os.environ.get("FAKE_OSQUERYI_STARTUP_MS", "150"))
+PACKAGES = int(os.environ.get("FAKE_OSQUERYI_PACKAGES", "1500"))
+# "rpm_packages:30,chrome_extensions:5" -> seconds each of those tables takes
+SLOW_TABLES = {table: float(seconds) for table, _, seconds in
+               (item.partition(":") for item in os.environ.get("FAKE_OSQUERYI_SLOW", "").split(",") if item)}
+
+TABLE_ROWS = {
+    "deb_packages": PACKAGES,
+    "rpm_packages": 0,
+    "python_packages": PACKAGES // 8,
+    "systemd_units": 60,
+    "listening_ports": 12,
+    "chrome_extensions": 0,
+}
+NUMERIC = ("memory", "space", "uptime", "time", "port", "cores", "pid")
+
+_SELECT = re.compile(r"^\s*SELECT\s+(?:DISTINCT\s+)?(.*?)(?:\s+FROM\s+(\w+)(.*))?;?\s*$", re.IGNORECASE | re.DOTALL)
+
+def startup():
+    deadline = time.process_time() + STARTUP_MS / 1000
+    while time.process_time() < deadline:
+        pass
+
+def columns(select_list):
+    """Returns [(column, literal value or None)] for a select list."""
+    cols = []
+    for expr in select_list.split(","):
+        parts = expr.strip().split()
+        literal = parts[0].strip("'") if parts[0].startswith("'") else None
+        cols.append((parts[-1].split(".")[-1], literal))
+    return cols
+
+def answer(sql):
+    m = _SELECT.match(sql)
+    if not m:
+        return []
+    select_list, table, rest = m.groups()
+    if table is None:
+        # SELECT 'literal' AS alias;
+        literal, _, alias = select_list.partition(" AS ")
+        return [{alias.strip(): literal.strip().strip("'")}]
+
+    time.sleep(SLOW_TABLES.get(table, 0))
+    count = TABLE_ROWS.get(table, 3)
+    if re.search(r"LIMIT\s+1\b", rest or "", re.IGNORECASE):
+        count = 1
+    rows = []
+    for i in range(count):
+        row = {}
+        for col, literal in columns(select_list):
+            if literal is not None:
+                row[col] = literal
+            else:
+                row[col] = str(1024 + i) if any(n in col for n in NUMERIC) else f"{col}-{i}"
+        rows.append(row)
+    return rows
+
+def emit(sql):
+    rows = answer(sql)
+    if rows:
+        sys.stdout.write(json.dumps(rows, indent=2) + "\n")
+
+if __name__ == "__main__":
+    startup()
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if args:
+        emit(args[0])
+    else:
+        for line in sys.stdin:
+            if line.strip():
+                emit(line.strip())
@@ -8,15 +8,86 @@ from config import conf
 from logger import setup_logging
 import agent_id
 import api
+import schedule
+from osquery import OsquerySession
+from spool import Spool, Backoff
+from changes import ChangeDetector
 
 # Import Collectors
 from collectors import os_info, hardware, network, services, software
 
+# Payloads whose upload failed, retried with backoff between scans
+SPOOL = None
+BACKOFF = None
+# Skips collectors whose inputs (package DBs, boot id, ...) did not change
+CHANGES = None
+
+def init_runtime():
+    """Builds the spool, backoff and change detector from the config, once.
+    Deferred to first use so importing the agent does not read config.json."""
+    global SPOOL, BACKOFF, CHANGES
+    if SPOOL is None:
+        SPOOL = Spool(conf.get("spool_dir"), conf.get("spool_max_bytes"), conf.get("spool_max_age"))
+        BACKOFF = Backoff(conf.get("retry_base"), conf.get("retry_max"))
+        CHANGES = ChangeDetector(conf.get("unchanged_max_age"))
+
 def check_root():
     if os.geteuid() != 0:
         print("❌ CRITICAL: Agent must run as root.")
         sys.exit(1)
 
+# Payload section -> (collector module, getter)
+COLLECTORS = {
+    "asset_summary": (os_info, os_info.get_os_data),
+    "hardware": (hardware, hardware.get_hardware_data),
+    "network": (network, network.get_network_data),
+    "services": (services, services.get_services),
+    "inventory": (software, software.get_software_inventory),
+}
+
+def collect(timeout):
+    """
+    Runs every collector concurrently, each as a group of one session
+    (its own osqueryi process) with its own `timeout` deadline, so a cycle
+    takes as long as the slowest one. A collector that runs out of time
+    keeps the queries it finished. Collectors whose change signals are
+    unchanged are skipped and their last data reused.
+
+    Returns (sections, status, unchanged): status maps section ->
+    ok/partial/error/unchanged, unchanged maps skipped section -> signature.
+    """
+    init_runtime()
+    sections, status, unchanged, signatures = {}, {}, {}, {}
+    session = OsquerySession()
+    for name, (module, getter) in COLLECTORS.items():
+        signatures[name] = CHANGES.signature(name)
+        data = CHANGES.cached(name, signatures[name])
+        if data is not None:
+            sections[name], status[name] = data, "unchanged"
+            unchanged[name] = signatures[name]
+            continue
+        session.group(name)
+        module.register_queries(session)
+    session.run(timeout=timeout)
+
+    for name, (module, getter) in COLLECTORS.items():
+        if name in sections:
+            continue
+        try:
+            sections[name], status[name] = getter(session), session.status.get(name, "ok")
+            if status[name] == "ok":
+                CHANGES.record(name, signatures[name], sections[name], session.durations.get(name, 0))
+        except Exception as e:
+            logging.error(f"Collector '{name}' failed: {e}")
+            # An empty session yields the collector's default (empty) data
+            sections[name], status[name] = getter(OsquerySession()), "error"
+
+    partial = [name for name, state in status.items() if state not in ("ok", "unchanged")]
+    if partial:
+        logging.warning(f"Partial collection: {', '.join(partial)}")
+    CHANGES.report(list(unchanged))
+    return sections, status, unchanged
+
 def run_agent_cycle():
     logging.info("--- Starting Collection Cycle ---")
     start_time = time.time()
@@ -25,40 +96,78 @@ def run_agent_cycle():
     aid = agent_id.get_agent_id()
 
     # 2. Run Collectors
+    sections, status, unchanged = collect(conf.get("collector_timeout"))
     payload = {
         "agent_id": aid,
         "timestamp": start_time,
-        "asset_summary": os_info.get_os_data(),
-        "hardware": hardware.get_hardware_data(),
-        "network": network.get_network_data(),
-        "services": services.get_services(),
-        "inventory": software.get_software_inventory()
+        **sections,
+        "collection_status": status,
+        "unchanged_since": unchanged
     }
 
     logging.info(f"Collection complete. Found {len(payload['inventory'])} software items.")
 
-    # 3. Upload
-    api.upload_payload(payload)
+    # 3. Upload (a fresh payload supersedes anything still spooled)
+    if api.upload_payload(payload):
+        SPOOL.clear()
+        BACKOFF.reset()
+    else:
+        SPOOL.push(payload)
 
     return start_time
 
+def replay_spool():
+    """Sends the newest spooled payload; older ones are coalesced into it."""
+    init_runtime()
+    payload = SPOOL.latest()
+    if payload is None:
+        return True
+    if api.upload_payload(payload):
+        logging.info("✅ Spool replayed")
+        SPOOL.clear()
+        BACKOFF.reset()
+        return True
+    return False
+
 def main():
     # Boot Sequence
     check_root()
     setup_logging()
-    
-    logging.info(f"🚀 VScanner Agent v2.0 Started. ID: {agent_id.get_agent_id()}")
+    init_runtime()
+
+    aid = agent_id.get_agent_id()
+    logging.info(f"🚀 VScanner Agent v2.0 Started. ID: {aid}")
     logging.info(f"Server: {conf.get('server_url')}")
 
+    # Agents installed together must not scan in lockstep: each one keeps
+    # a fixed, id-derived slot within the interval
+    interval = conf.get("scan_interval")
+    offset = schedule.phase_offset(aid, interval)
+    startup_delay = schedule.phase_offset(aid, conf.get("startup_splay"))
+    logging.info(f"Scan slot: +{offset}s every {interval}s, first scan in {startup_delay}s")
+    time.sleep(startup_delay)
+
     while True:
         try:
             cycle_start = run_agent_cycle()
-            
+
+            # Next slot, or later if the server asked us to back off
+            next_due = schedule.next_scan(time.time(), interval, offset,
+                                          not_before=cycle_start + api.next_checkin_after)
+
+            # Retry spooled data with backoff until the next scan is due
+            while len(SPOOL):
+                remaining = next_due - time.time()
+                if remaining <= 0:
+                    break
+                delay = min(BACKOFF.next_delay(), remaining)
+                logging.info(f"Retrying spooled upload in {int(delay)} seconds...")
+                time.sleep(delay)
+                replay_spool()
+
             # Calculate Sleep
-            interval = conf.get("scan_interval")
-            elapsed = time.time() - cycle_start
-            sleep_time = max(0, interval - elapsed)
-            
+            sleep_time = max(0, next_due - time.time())
+
             logging.info(f"Sleeping for {int(sleep_time)} seconds...")
             time.sleep(sleep_time)
 
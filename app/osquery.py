@@ -0,0 +1,252 @@
+import codecs
+import json
+import logging
+import os
+import queue
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import conf
+
+try:
+    import pty
+    import tty
+except ImportError:  # Windows
+    pty = None
+
+# Every query is followed by this one, so its results can be told apart
+# in osqueryi's output (queries returning no rows print nothing at all)
+MARKER = "__vscanner_marker"
+
+class OsquerySession:
+    """
+    Runs a batch of named queries through osqueryi.
+
+    Collectors add() their queries up front, run() feeds them to
+    `osqueryi --json` over stdin, and rows(name) returns the parsed results.
+    One process per group of queries instead of one per query.
+
+    Queries can be split into groups (one per collector, see group()).
+    Each group gets its own osqueryi process and deadline, and all groups
+    run at once, so a run takes as long as the slowest group. A group that
+    overruns its deadline is killed and marked partial. Results are read
+    as osqueryi prints them, so a killed group keeps the queries it
+    finished.
+    """
+
+    def __init__(self, binary=None):
+        self.binary = binary or conf.get("osquery_bin")
+        self.queries = []
+        self.results = None
+        self.current_group = None
+        # group -> ok/partial/error, and seconds each finished group took
+        self.status = {}
+        self.durations = {}
+        self.timed_out = False
+        self.error = None
+
+    def group(self, name):
+        """Queries added from now on belong to group `name`."""
+        self.current_group = name
+
+    def add(self, name, sql):
+        # osqueryi reads one statement per line
+        sql = " ".join(sql.split()).rstrip(";")
+        self.queries.append((name, sql, self.current_group))
+        self.results = None
+
+    def script(self, queries=None):
+        lines = []
+        for name, sql, _ in self.queries if queries is None else queries:
+            lines.append(f"{sql};")
+            lines.append(f"SELECT '{name}' AS {MARKER};")
+        return "\n".join(lines) + "\n"
+
+    def groups(self):
+        """[(group, [(name, sql, group), ...])] in the order they were added."""
+        groups = {}
+        for query in self.queries:
+            groups.setdefault(query[2], []).append(query)
+        return list(groups.items())
+
+    def run(self, timeout=None):
+        """Runs all queries, each group in its own osqueryi process, all
+        groups at once. A group still running after `timeout` seconds is
+        cut short: only its finished queries have rows, and timed_out is
+        set."""
+        self.results = {name: [] for name, _, _ in self.queries}
+        self.status, self.durations = {}, {}
+        self.timed_out = False
+        self.error = None
+        groups = self.groups()
+        if len(groups) == 1:
+            self._run_group(*groups[0], timeout)
+        elif groups:
+            with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+                for future in [pool.submit(self._run_group, group, queries, timeout) for group, queries in groups]:
+                    future.result()
+        return self.results
+
+    def _run_group(self, group, queries, timeout):
+        started = time.monotonic()
+        try:
+            proc, chunks = self._start(queries)
+        except Exception as e:
+            self.error = e
+            logging.error(f"osqueryi failed: {e}")
+            self.status[group] = "error"
+            return
+        self.status[group] = self._collect(proc, chunks, group, queries, timeout, started)
+        self.durations[group] = time.monotonic() - started
+
+    def _start(self, queries):
+        """Starts osqueryi on `queries`; returns (process, queue of output
+        chunks ending with None)."""
+        chunks = queue.Queue()
+        if pty:
+            # osqueryi block-buffers its output into a pipe, so results would
+            # only show up when it exits. On a terminal it writes each line.
+            master, slave = pty.openpty()
+            tty.setraw(slave)
+            try:
+                proc = subprocess.Popen([self.binary, "--json"], stdin=subprocess.PIPE,
+                                        stdout=slave, stderr=subprocess.DEVNULL)
+            except Exception:
+                os.close(master)
+                raise
+            finally:
+                os.close(slave)
+            source = master
+        else:
+            # Pipes only: results arrive whenever osqueryi flushes
+            proc = subprocess.Popen([self.binary, "--json"], stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            source = proc.stdout.fileno()
+        threading.Thread(target=_read_chunks, args=(source, chunks, bool(pty)), daemon=True).start()
+        try:
+            proc.stdin.write(self.script(queries).encode())
+            proc.stdin.close()
+        except OSError:
+            pass  # osqueryi already exited; _collect sees the end of output
+        return proc, chunks
+
+    def _collect(self, proc, chunks, group, queries, timeout, started):
+        """Reads one group's results as osqueryi prints them. Returns the
+        group's status: ok, partial (timed out) or error (osqueryi died)."""
+        parser = OutputParser()
+        waiting = {name for name, _, _ in queries}
+        try:
+            while waiting:
+                try:
+                    wait = None if timeout is None else max(0, started + timeout - time.monotonic())
+                    chunk = chunks.get(timeout=wait)
+                except queue.Empty:
+                    self.timed_out = True
+                    logging.warning(f"osqueryi timed out on '{group}' after {timeout}s, keeping partial results")
+                    return "partial"
+                done = parser.close() if chunk is None else parser.feed(chunk)
+                for name in done:
+                    if name in waiting:
+                        self.results[name] = parser.results[name]
+                        waiting.discard(name)
+                if chunk is None and waiting:
+                    self.error = RuntimeError(f"osqueryi exited with status {proc.wait()}")
+                    logging.error(f"osqueryi exited during '{group}', keeping partial results")
+                    return "error"
+            return "ok"
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+
+    def rows(self, name):
+        if self.results is None:
+            self.run()
+        return self.results.get(name, [])
+
+def _read_chunks(fd, chunks, is_pty):
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    try:
+        while True:
+            try:
+                data = os.read(fd, 65536)
+            except OSError:
+                break  # EIO: the pty's other end closed
+            if not data:
+                break
+            chunks.put(decoder.decode(data))
+    finally:
+        if is_pty:
+            os.close(fd)
+        chunks.put(None)
+
+class OutputParser:
+    """
+    Splits osqueryi's concatenated JSON arrays back into {name: rows}, as
+    the output arrives. Arrays are printed one row per line and closed by
+    a line of its own, so that line is where a complete array can be
+    decoded (row values never contain raw newlines).
+    """
+
+    def __init__(self):
+        self.results = {}
+        self.pending = []
+        self.lines = []
+        self.tail = ""
+
+    def feed(self, text):
+        """Adds output; returns the names of the queries it completed."""
+        lines = (self.tail + text).split("\n")
+        self.tail = lines.pop()
+        done = []
+        for line in lines:
+            self.lines.append(line)
+            line = line.strip()
+            if line.endswith("]") and (line == "]" or line.startswith("[")):
+                done += self._decode("\n".join(self.lines))
+                self.lines = []
+        return done
+
+    def close(self):
+        """Decodes whatever is left at the end of the output."""
+        text = "\n".join(self.lines + [self.tail])
+        self.lines, self.tail = [], ""
+        return self._decode(text)
+
+    def _decode(self, output):
+        done = []
+        decoder = json.JSONDecoder()
+        pos = 0
+        while True:
+            # Skip whitespace and any non-JSON noise between arrays
+            pos = output.find("[", pos)
+            if pos < 0:
+                break
+            try:
+                rows, pos = decoder.raw_decode(output, pos)
+            except ValueError:
+                pos += 1
+                continue
+            if len(rows) == 1 and isinstance(rows[0], dict) and MARKER in rows[0]:
+                self.results[rows[0][MARKER]] = self.pending
+                self.pending = []
+                done.append(rows[0][MARKER])
+            else:
+                self.pending.extend(rows)
+        return done
+
+def parse_output(output):
+    """Splits osqueryi's complete output into {name: rows}."""
+    parser = OutputParser()
+    parser.feed(output)
+    parser.close()
+    return parser.results
+
+def ensure_session(session, register_queries):
+    """Returns `session`, or a fresh one holding the caller's queries
+    (for collectors called on their own)."""
+    if session is None:
+        session = OsquerySession()
+        register_queries(session)
+    return session
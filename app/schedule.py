@@ -0,0 +1,20 @@
+import hashlib
+
+def phase_offset(agent_id, interval):
+    """Deterministic offset in [0, interval) derived from the agent id, so
+    agents installed together still scan at different times."""
+    digest = hashlib.sha256(str(agent_id).encode()).digest()
+    return int.from_bytes(digest[:8], "big") % max(1, int(interval))
+
+def next_run(after, interval, offset):
+    """First time >= `after` on this agent's slot grid (epoch + offset + k * interval)."""
+    interval = max(1, int(interval))
+    slot = after - (after - offset) % interval
+    return slot if slot >= after else slot + interval
+
+def next_scan(now, interval, offset, not_before=0):
+    """
+    When to scan next: the next slot after `now`, or, if the server asked
+    us to back off (`not_before`), the first slot after that.
+    """
+    return next_run(max(now + 1, not_before), interval, offset)
@@ -0,0 +1,89 @@
+import gzip
+import json
+import logging
+import os
+import random
+import time
+
+class Spool:
+    """
+    On-disk queue of payloads whose upload failed, kept gzip'd so an
+    outage never loses a cycle's data (and survives agent restarts).
+
+    Every payload is a complete state, so replay only needs the newest
+    one: it is sent as a single delta against the last acknowledged
+    snapshot and everything older is dropped once it is accepted.
+    """
+
+    def __init__(self, directory, max_bytes, max_age):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def entries(self):
+        """Spooled files, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith(".json.gz"))
+        return [os.path.join(self.directory, n) for n in names]
+
+    def __len__(self):
+        return len(self.entries())
+
+    def push(self, payload):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{time.time_ns():020d}.json.gz")
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(payload, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+        self.evict()
+        logging.info(f"📥 Spooled payload ({len(self)} queued)")
+
+    def latest(self):
+        """Newest readable payload, or None. Unreadable files are dropped."""
+        for path in reversed(self.entries()):
+            try:
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    return json.load(f)
+            except (OSError, EOFError, ValueError) as e:
+                logging.warning(f"Dropping corrupt spool file {path}: {e}")
+                os.remove(path)
+        return None
+
+    def evict(self):
+        """Drops files older than max_age, then the oldest ones while the
+        spool is over max_bytes. The newest payload is always kept."""
+        entries = self.entries()
+        now = time.time()
+        for path in entries[:-1]:
+            if now - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+        entries = self.entries()
+        total = sum(os.path.getsize(p) for p in entries)
+        for path in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            total -= os.path.getsize(path)
+            os.remove(path)
+
+    def clear(self):
+        for path in self.entries():
+            os.remove(path)
+
+class Backoff:
+    """Exponential backoff with full jitter, so agents recovering from the
+    same outage spread their retries instead of arriving together."""
+
+    def __init__(self, base, cap):
+        self.base = base
+        self.cap = cap
+        self.failures = 0
+
+    def next_delay(self):
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** self.failures))
+        self.failures += 1
+        return delay
+
+    def reset(self):
+        self.failures = 0
@@ -0,0 +1,382 @@
+"""
+Asset Store: what each agent last reported, in SQLite (WAL mode).
+
+One row per agent in `assets`, keyed by the agent_id it sends, with its
+packages, services and open ports in normalised, indexed tables. Fleet
+questions ("which hosts run openssl 3.0.2?", "who listens on 23/tcp?")
+are index lookups. Uploads are written in batches, one transaction per
+batch; readers never block writers in WAL mode.
+
+Packages are interned: each distinct (name, version, manager,
+architecture, source) is stored once in `package_ids`. A host's
+inventory is a sorted set of those ids, packed as little-endian u32 and
+stored once per distinct content in `package_sets` (keyed by its
+hash), so hosts built from the same image share one set. `set_members`
+lists each set's ids once, for package -> hosts lookups.
+
+    python cloud/asset_store.py cloud_data/assets.db --package openssl [--version 3.0.2]
+    python cloud/asset_store.py cloud_data/assets.db --port 22
+    python cloud/asset_store.py cloud_data/assets.db --import cloud_data/state/*.json
+    python cloud/asset_store.py cloud_data/assets.db --stats
+"""
+import argparse
+import hashlib
+import json
+import sqlite3
+import struct
+import threading
+import time
+
+from versions import package_key
+
+# PRAGMA user_version of the current layout (1: one packages row per host)
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    agent_id TEXT PRIMARY KEY,
+    hostname TEXT,
+    os_name TEXT,
+    os_version TEXT,
+    remote_addr TEXT,
+    reported_at REAL,             -- agent timestamp of the upload
+    stored_at REAL,
+    details TEXT,                 -- JSON: remaining sections (hardware, network, status...)
+    package_set TEXT              -- package_sets.hash of its inventory
+);
+CREATE TABLE IF NOT EXISTS package_ids (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    version TEXT,
+    manager TEXT,
+    architecture TEXT,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS package_sets (
+    hash TEXT PRIMARY KEY,        -- sha256 of `ids`
+    size INTEGER,
+    ids BLOB                      -- sorted package_ids.id, packed <u32
+);
+CREATE TABLE IF NOT EXISTS set_members (
+    set_hash TEXT NOT NULL,
+    package_id INTEGER NOT NULL,
+    PRIMARY KEY (set_hash, package_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS services (
+    agent_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    description TEXT,
+    active_state TEXT
+);
+CREATE TABLE IF NOT EXISTS open_ports (
+    agent_id TEXT NOT NULL,
+    protocol TEXT,
+    port INTEGER,
+    address TEXT,
+    service_name TEXT
+);
+-- IFNULL: NULL columns never collide in a UNIQUE index
+CREATE UNIQUE INDEX IF NOT EXISTS idx_package_ids_tuple
+    ON package_ids(name, IFNULL(version, ''), IFNULL(manager, ''), IFNULL(architecture, ''), IFNULL(source, ''));
+CREATE INDEX IF NOT EXISTS idx_package_ids_name_version ON package_ids(name, version);
+CREATE INDEX IF NOT EXISTS idx_set_members_package ON set_members(package_id);
+CREATE INDEX IF NOT EXISTS idx_assets_package_set ON assets(package_set);
+CREATE INDEX IF NOT EXISTS idx_services_name ON services(name);
+CREATE INDEX IF NOT EXISTS idx_services_agent ON services(agent_id);
+CREATE INDEX IF NOT EXISTS idx_ports_port ON open_ports(port, protocol);
+CREATE INDEX IF NOT EXISTS idx_ports_agent ON open_ports(agent_id);
+CREATE INDEX IF NOT EXISTS idx_assets_hostname ON assets(hostname);
+"""
+
+PACKAGE_FIELDS = ("name", "version", "manager", "architecture", "source")
+# SQLite's default limit on bound parameters per statement
+MAX_PARAMS = 900
+
+# Sections stored in their own tables or columns, not in assets.details
+NORMALISED = ("agent_id", "timestamp", "inventory", "services", "device")
+
+def package_tuple(pkg):
+    # Text like the columns, or a numeric version would not match its row
+    return tuple(v if v is None or type(v) is str else str(v) for v in map(pkg.get, PACKAGE_FIELDS))
+
+def pack_ids(ids):
+    """Sorted, de-duplicated ids as a <u32 blob."""
+    ids = sorted(set(ids))
+    return struct.pack(f"<{len(ids)}I", *ids)
+
+def unpack_ids(blob):
+    return struct.unpack(f"<{len(blob) // 4}I", blob)
+
+def _port(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+class AssetStore:
+    """
+    Thread-safe: each thread gets its own connection. Writers queue on
+    SQLite's lock (busy_timeout), readers see the last committed batch.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        # Package tuple -> id for committed ids; writes are serialised
+        # so a cached id is never one a rolled back batch inserted
+        self.write_lock = threading.Lock()
+        self.ids = {}
+        conn = self.conn()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        has_packages = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'packages'").fetchone()
+        if has_packages and version < 2:
+            conn.execute("ALTER TABLE assets ADD COLUMN package_set TEXT")
+        conn.executescript(SCHEMA)
+        if has_packages and version < 2:
+            self._migrate_packages()
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.ids = {tuple(row[1:]): row[0] for row in conn.execute(f"SELECT id, {', '.join(PACKAGE_FIELDS)} FROM package_ids")}
+
+    def conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _migrate_packages(self):
+        """v1 -> v2: per-host package rows into interned sets."""
+        conn = self.conn()
+        agents = [r[0] for r in conn.execute("SELECT DISTINCT agent_id FROM packages")]
+        with self.write_lock, conn:
+            new_ids = {}
+            for agent_id in agents:
+                rows = conn.execute(f"SELECT {', '.join(PACKAGE_FIELDS)} FROM packages WHERE agent_id = ?", (agent_id,))
+                set_hash = self._intern_set(conn, [tuple(r) for r in rows], new_ids)
+                conn.execute("UPDATE assets SET package_set = ? WHERE agent_id = ?", (set_hash, agent_id))
+            conn.execute("DROP TABLE packages")
+        self.ids.update(new_ids)
+
+    def _package_id(self, conn, key, new_ids):
+        pid = self.ids.get(key) or new_ids.get(key)
+        if pid is None:
+            row = conn.execute("SELECT id FROM package_ids WHERE name = ? AND IFNULL(version, '') = IFNULL(?, '') "
+                               "AND IFNULL(manager, '') = IFNULL(?, '') AND IFNULL(architecture, '') = IFNULL(?, '') "
+                               "AND IFNULL(source, '') = IFNULL(?, '')", key).fetchone()
+            pid = row[0] if row else conn.execute("INSERT INTO package_ids (name, version, manager, architecture, source) "
+                                                  "VALUES (?, ?, ?, ?, ?)", key).lastrowid
+            new_ids[key] = pid
+        return pid
+
+    def _intern_set(self, conn, keys, new_ids):
+        """Interns package tuples and their set. Returns the set hash."""
+        blob = pack_ids(self._package_id(conn, key, new_ids) for key in keys)
+        set_hash = hashlib.sha256(blob).hexdigest()
+        if conn.execute("SELECT 1 FROM package_sets WHERE hash = ?", (set_hash,)).fetchone() is None:
+            conn.execute("INSERT INTO package_sets VALUES (?, ?, ?)", (set_hash, len(blob) // 4, blob))
+            conn.executemany("INSERT INTO set_members VALUES (?, ?)", [(set_hash, pid) for pid in unpack_ids(blob)])
+        return set_hash
+
+    def _release_set(self, conn, set_hash):
+        """Drops a set no asset references any more."""
+        if set_hash and conn.execute("SELECT 1 FROM assets WHERE package_set = ? LIMIT 1", (set_hash,)).fetchone() is None:
+            conn.execute("DELETE FROM set_members WHERE set_hash = ?", (set_hash,))
+            conn.execute("DELETE FROM package_sets WHERE hash = ?", (set_hash,))
+
+    def save(self, payloads, remote_addrs=None):
+        """
+        Replaces the stored data of every agent in `payloads` (agent_id ->
+        full payload, as rebuilt by delta.apply_upload) in one transaction.
+        """
+        remote_addrs = remote_addrs or {}
+        now = time.time()
+        conn = self.conn()
+        with self.write_lock:
+            new_ids = {}
+            with conn:
+                self._save(conn, payloads, remote_addrs, now, new_ids)
+            self.ids.update(new_ids)
+
+    def _save(self, conn, payloads, remote_addrs, now, new_ids):
+        for agent_id, payload in payloads.items():
+            summary = payload.get("asset_summary") or {}
+            device = payload.get("device") or {}
+            details = {k: v for k, v in payload.items() if k not in NORMALISED}
+            network = details.get("network")
+            if isinstance(network, dict):
+                details["network"] = {k: v for k, v in network.items() if k != "open_ports"}
+                ports = network.get("open_ports") or []
+            else:
+                ports = []
+
+            set_hash = self._intern_set(conn, [package_tuple(p) for p in payload.get("inventory") or []
+                                               if isinstance(p, dict) and p.get("name")], new_ids)
+            old = conn.execute("SELECT package_set FROM assets WHERE agent_id = ?", (agent_id,)).fetchone()
+
+            conn.execute("INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+                agent_id,
+                summary.get("hostname") or device.get("hostname"),
+                summary.get("os_name") or device.get("os"),
+                summary.get("os_version"),
+                remote_addrs.get(agent_id) or device.get("ip"),
+                payload.get("timestamp"),
+                now,
+                json.dumps(details, separators=(",", ":")),
+                set_hash,
+            ))
+            if old and old[0] != set_hash:
+                self._release_set(conn, old[0])
+            for table in ("services", "open_ports"):
+                conn.execute(f"DELETE FROM {table} WHERE agent_id = ?", (agent_id,))
+            conn.executemany("INSERT INTO services VALUES (?, ?, ?, ?)", [
+                (agent_id, s.get("name"), s.get("description"), s.get("active_state"))
+                for s in payload.get("services") or [] if isinstance(s, dict) and s.get("name")
+            ])
+            conn.executemany("INSERT INTO open_ports VALUES (?, ?, ?, ?, ?)", [
+                (agent_id, p.get("protocol"), _port(p.get("port")), p.get("address"), p.get("service_name"))
+                for p in ports if isinstance(p, dict)
+            ])
+
+    def delete(self, agent_id):
+        conn = self.conn()
+        with self.write_lock, conn:
+            old = conn.execute("SELECT package_set FROM assets WHERE agent_id = ?", (agent_id,)).fetchone()
+            for table in ("services", "open_ports", "assets"):
+                conn.execute(f"DELETE FROM {table} WHERE agent_id = ?", (agent_id,))
+            if old:
+                self._release_set(conn, old[0])
+
+    # --- Fleet queries ---
+
+    def hosts_with_package(self, name, version=None, below=None):
+        """[(agent_id, hostname, version, manager)] of hosts carrying `name`.
+        With `below`, only those whose version sorts before it by their
+        package manager's own ordering (e.g. not yet on the fixed release)."""
+        sql = ("SELECT a.agent_id, a.hostname, p.version, p.manager FROM package_ids p "
+               "JOIN set_members m ON m.package_id = p.id "
+               "JOIN assets a ON a.package_set = m.set_hash WHERE p.name = ?")
+        args = [name]
+        if version is not None:
+            sql += " AND p.version = ?"
+            args.append(version)
+        rows = self.conn().execute(sql + " ORDER BY a.hostname", args).fetchall()
+        if below is not None:
+            rows = [row for row in rows if row[2] and package_key(row[2], row[3]) < package_key(below, row[3])]
+        return rows
+
+    def hosts_with_port(self, port, protocol=None):
+        """[(agent_id, hostname, protocol, address, service_name)] listening on `port`."""
+        sql = ("SELECT o.agent_id, a.hostname, o.protocol, o.address, o.service_name FROM open_ports o "
+               "JOIN assets a ON a.agent_id = o.agent_id WHERE o.port = ?")
+        args = [int(port)]
+        if protocol is not None:
+            sql += " AND o.protocol = ?"
+            args.append(protocol)
+        rows = self.conn().execute(sql + " ORDER BY a.hostname", args).fetchall()
+        if below is not None:
+            rows = [row for row in rows if row[2] and package_key(row[2], row[3]) < package_key(below, row[3])]
+        return rows
+
+    def hosts_with_service(self, name):
+        """[(agent_id, hostname, active_state)] running service `name`."""
+        return self.conn().execute(
+            "SELECT s.agent_id, a.hostname, s.active_state FROM services s "
+            "JOIN assets a ON a.agent_id = s.agent_id WHERE s.name = ? ORDER BY a.hostname", (name,)).fetchall()
+
+    def inventory(self, agent_id):
+        """The agent's stored packages, as dicts like the uploaded inventory."""
+        row = self.conn().execute("SELECT s.ids FROM assets a JOIN package_sets s ON s.hash = a.package_set "
+                                  "WHERE a.agent_id = ?", (agent_id,)).fetchone()
+        return self.packages(unpack_ids(row[0])) if row else []
+
+    def packages(self, ids):
+        """package_ids rows for `ids`, as dicts."""
+        conn, found = self.conn(), []
+        ids = list(ids)
+        for i in range(0, len(ids), MAX_PARAMS):
+            chunk = ids[i:i + MAX_PARAMS]
+            rows = conn.execute(f"SELECT {', '.join(PACKAGE_FIELDS)} FROM package_ids "
+                                f"WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+            found.extend(dict(zip(PACKAGE_FIELDS, row)) for row in rows)
+        return found
+
+    def package_sets(self):
+        """{set_hash: ([agent_id, ...], package ids)}: each distinct inventory once."""
+        sets = {}
+        for set_hash, ids in self.conn().execute("SELECT hash, ids FROM package_sets"):
+            sets[set_hash] = ([], unpack_ids(ids))
+        for agent_id, set_hash in self.conn().execute("SELECT agent_id, package_set FROM assets"):
+            if set_hash in sets:
+                sets[set_hash][0].append(agent_id)
+        return sets
+
+    def asset(self, agent_id):
+        """The stored summary row of one agent as a dict, or None."""
+        cur = self.conn().execute("SELECT * FROM assets WHERE agent_id = ?", (agent_id,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        asset = dict(zip([c[0] for c in cur.description], row))
+        asset["details"] = json.loads(asset["details"] or "{}")
+        return asset
+
+    def stats(self):
+        conn = self.conn()
+        stats = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                 for table in ("assets", "package_ids", "package_sets", "set_members", "services", "open_ports")}
+        # What one row per host and package would have taken
+        stats["host_packages"] = conn.execute("SELECT IFNULL(SUM(s.size), 0) FROM assets a "
+                                              "JOIN package_sets s ON s.hash = a.package_set").fetchone()[0]
+        return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the asset store")
+    parser.add_argument("db")
+    parser.add_argument("--package")
+    parser.add_argument("--version")
+    parser.add_argument("--below", help="With --package: hosts on an older version than this")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--service")
+    parser.add_argument("--stats", action="store_true", help="Row counts and package dedup ratio")
+    parser.add_argument("--import", dest="import_files", nargs="+", metavar="JSON",
+                        help="Load stored full payloads (e.g. cloud_data/state/*.json)")
+    args = parser.parse_args()
+
+    store = AssetStore(args.db)
+    if args.import_files:
+        batch = {}
+        for path in args.import_files:
+            with open(path) as f:
+                payload = json.load(f)
+            batch[str(payload.get("agent_id") or path)] = payload
+        started = time.perf_counter()
+        store.save(batch)
+        print(f"✅ Imported {len(batch)} assets in {time.perf_counter() - started:.2f}s")
+
+    started = time.perf_counter()
+    if args.package:
+        rows = store.hosts_with_package(args.package, args.version, args.below)
+    elif args.port is not None:
+        rows = store.hosts_with_port(args.port)
+    elif args.service:
+        rows = store.hosts_with_service(args.service)
+    else:
+        rows = None
+        stats = store.stats()
+        print("  ".join(f"{k}={v}" for k, v in stats.items()))
+        if stats["set_members"]:
+            print(f"{stats['host_packages'] / stats['set_members']:.1f}x fewer package rows than one per host "
+                  f"({stats['assets']} hosts share {stats['package_sets']} inventories)")
+    if rows is not None:
+        for row in rows:
+            print("  ".join(str(v) for v in row))
+        print(f"{len(rows)} hosts ({(time.perf_counter() - started) * 1000:.1f} ms)")
+    store.close()
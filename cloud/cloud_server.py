@@ -1,48 +1,378 @@
 from flask import Flask, request, jsonify
 import json
 import os
+import random
+import re
+import threading
+import time
+import zlib
+from collections import deque
 from datetime import datetime
 
+from delta import apply_upload, state_hash, SnapshotMismatch
+from ingest import IngestQueue, Job, QueueFull
+from asset_store import AssetStore
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# What a corrupt compressed or JSON body raises while decoding
+CORRUPT_BODY = (ValueError, zlib.error) + ((zstandard.ZstdError,) if zstandard else ())
+
 UPLOAD_FOLDER = 'cloud_data'
+# Last full state per agent, the base for its next delta upload
+STATE_FOLDER = os.path.join(UPLOAD_FOLDER, 'state')
+AGENT_ID = re.compile(r"^[\w.-]{1,128}$")
+READ_SIZE = 64 * 1024
+# Decoded upload size limit (guards against compression bombs)
+MAX_BODY_SIZE = 512 * 1024 * 1024
+# Scheduling: uploads we can comfortably take per minute, and the agents'
+# scan interval. Above capacity, agents are told to check in later.
+CAPACITY_PER_MIN = int(os.environ.get("VSCANNER_CAPACITY_PER_MIN", "600"))
+SCAN_INTERVAL = int(os.environ.get("VSCANNER_SCAN_INTERVAL", "14400"))
+MAX_CHECKIN_DELAY = 4 * SCAN_INTERVAL
 app = Flask(__name__)
 
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+class LoadMeter:
+    """Uploads seen over the last minute (thread-safe)."""
+
+    def __init__(self, window=60):
+        self.window = window
+        self.arrivals = deque()
+        self.lock = threading.Lock()
+
+    def hit(self):
+        now = time.monotonic()
+        with self.lock:
+            self.arrivals.append(now)
+            while self.arrivals and self.arrivals[0] < now - self.window:
+                self.arrivals.popleft()
+            return len(self.arrivals)
+
+LOAD = LoadMeter()
+
+def next_checkin_after(recent_uploads):
+    """
+    Seconds the agent should wait before its next check-in. 0 keeps the
+    agent on its own (phase-offset) schedule. At `load` times capacity,
+    agents skip load - 1 of their slots on average (the fractional part
+    by chance), which brings the fleet's rate back down to capacity.
+    """
+    load = recent_uploads / CAPACITY_PER_MIN
+    if load <= 1:
+        return 0
+    skips = int(load - 1) + (random.random() < (load - 1) % 1)
+    return int(min(MAX_CHECKIN_DELAY, skips * SCAN_INTERVAL))
+
+def reply(body, status):
+    body["next_checkin_after"] = next_checkin_after(len(LOAD.arrivals))
+    return jsonify(body), status
+
+if not os.path.exists(STATE_FOLDER):
+    os.makedirs(STATE_FOLDER)
+
+def load_state(agent_id):
+    path = os.path.join(STATE_FOLDER, f"{agent_id}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def save_state(agent_id, data):
+    path = os.path.join(STATE_FOLDER, f"{agent_id}.json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        # dumps() uses the C encoder; dump() to a file does not
+        f.write(json.dumps(data))
+    os.replace(tmp_path, path)
+
+def supported_encodings():
+    return ["gzip", "deflate", "identity"] + (["zstd"] if zstandard else [])
+
+class UnsupportedEncoding(ValueError):
+    """Content-Encoding we cannot decode (answered with 415)."""
+
+def decompressor(encoding):
+    """A streaming decompressor for `encoding`, None for identity."""
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(47)
+    if encoding == "deflate":
+        return zlib.decompressobj()
+    if encoding == "zstd" and zstandard:
+        return zstandard.ZstdDecompressor().decompressobj()
+    if encoding == "identity":
+        return None
+    raise UnsupportedEncoding(f"unsupported encoding '{encoding}'")
+
+def read_raw_body():
+    """The request body as sent (still compressed), size-checked."""
+    parts, size = [], 0
+    while True:
+        chunk = request.stream.read(READ_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > MAX_BODY_SIZE:
+            raise OverflowError(f"body larger than {MAX_BODY_SIZE} bytes")
+        parts.append(chunk)
+    return b"".join(parts)
+
+def decoded_chunks(raw, encoding):
+    """Yields the decoded body in chunks of at most READ_SIZE bytes, so a
+    compression bomb is stopped (see decode_body) before it inflates."""
+    decoder = decompressor(encoding)
+    if decoder is None:
+        for i in range(0, len(raw), READ_SIZE):
+            yield raw[i:i + READ_SIZE]
+    elif encoding == "zstd":
+        reader = zstandard.ZstdDecompressor().stream_reader(raw)
+        while True:
+            chunk = reader.read(READ_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        for i in range(0, len(raw), READ_SIZE):
+            data = raw[i:i + READ_SIZE]
+            while data:
+                yield decoder.decompress(data, READ_SIZE)
+                data = decoder.unconsumed_tail
+
+def decode_body(raw, encoding):
+    """Decodes a raw body per Content-Encoding, chunk by chunk.
+    Returns the parsed JSON, None for an empty body."""
+    parts, size = [], 0
+    for chunk in decoded_chunks(raw, encoding):
+        size += len(chunk)
+        if size > MAX_BODY_SIZE:
+            raise OverflowError(f"body larger than {MAX_BODY_SIZE} bytes")
+        parts.append(chunk)
+    if not size:
+        return None
+    return json.loads(b"".join(parts))
+
+def unsupported(error):
+    resp = jsonify({"status": "error", "message": str(error), "supported": supported_encodings()})
+    resp.headers["Accept-Encoding"] = ", ".join(supported_encodings())
+    return resp, 415
+
+# Per agent, the snapshot hash its next delta must be based on: that of
+# its last accepted upload, which may still be queued. None once an
+# upload failed, so the agent is told to resync.
+HEADS = {}
+HEADS_LOCK = threading.Lock()
+
+def head(agent_id):
+    with HEADS_LOCK:
+        if agent_id in HEADS:
+            return HEADS[agent_id]
+    state = load_state(agent_id)
+    current = state_hash(state) if state is not None else None
+    with HEADS_LOCK:
+        return HEADS.setdefault(agent_id, current)
+
+def set_head(agent_id, snapshot_hash):
+    with HEADS_LOCK:
+        if snapshot_hash:
+            HEADS[agent_id] = snapshot_hash
+        else:
+            HEADS.pop(agent_id, None)  # unknown: read from disk next time
+
+def write_json(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(json.dumps(data, separators=(",", ":")))
+    os.replace(tmp_path, path)
+
+def store_upload(data, remote_addr):
+    """
+    Applies one decoded upload to the agent's stored state. Returns
+    (agent_id, full payload) for the asset store. Raises SnapshotMismatch
+    when a delta does not apply.
+    """
+    # --- Snapshot uploads (full or delta since the last ack) ---
+    if data.get("type") in ("full", "delta"):
+        agent_id = str(data.get("agent_id", ""))
+        if not AGENT_ID.match(agent_id):
+            raise ValueError("Invalid agent_id")
+        data = apply_upload(load_state(agent_id), data)
+        save_state(agent_id, data)
+
+    # --- NEW: PARSE DEVICE INFO ---
+    # Check if this is the new "v2" format with device info
+    if "device" in data and "inventory" in data:
+        hostname = data['device'].get('hostname', 'Unknown')
+        ip = data['device'].get('ip', 'Unknown')
+        os_name = data['device'].get('os', 'Unknown')
+
+        print(f"📝 REGISTERING DEVICE: {hostname} [{ip}]")
+        print(f"   OS: {os_name}")
+
+    agent_id = str(data.get("agent_id") or "")
+    if not AGENT_ID.match(agent_id):
+        # Fallback for old agents
+        agent_id = "ip-" + str(remote_addr).replace(":", "_")
+    return agent_id, data
+
+# Every agent's last reported state, keyed by agent_id
+STORE = AssetStore(os.environ.get("VSCANNER_ASSET_DB", os.path.join(UPLOAD_FOLDER, "assets.db")))
+
+# Matching at ingest, enabled by a published snapshot directory (see
+# snapshots.py; new versions are picked up without a restart) or by an
+# NVD database and rule index (one Matcher per thread).
+MATCH_SNAPSHOTS = os.environ.get("VSCANNER_SNAPSHOTS")
+MATCH_DB = os.environ.get("VSCANNER_NVD_DB")
+MATCH_INDEX = os.environ.get("VSCANNER_RULE_INDEX")
+FINDINGS_FOLDER = os.path.join(UPLOAD_FOLDER, 'findings')
+_local = threading.local()
+SNAPSHOTS = None
+if MATCH_SNAPSHOTS:
+    from snapshots import SnapshotManager
+    SNAPSHOTS = SnapshotManager(MATCH_SNAPSHOTS)
+
+def match_inventories(inventories):
+    if SNAPSHOTS:
+        with SNAPSHOTS.acquire() as snapshot:
+            return snapshot.matcher.match_inventories(inventories)
+    if getattr(_local, "matcher", None) is None:
+        from matcher import Matcher
+        _local.matcher = Matcher(MATCH_DB, MATCH_INDEX)
+    return _local.matcher.match_inventories(inventories)
+
+def match_uploads(payloads):
+    """Matches the inventories of stored payloads (agent_id -> payload) as
+    one batch and writes cloud_data/findings/<agent_id>.json."""
+    if not (SNAPSHOTS or (MATCH_DB and MATCH_INDEX)) or not payloads:
+        return
+    findings = match_inventories({aid: p.get("inventory") for aid, p in payloads.items()})
+    os.makedirs(FINDINGS_FOLDER, exist_ok=True)
+    for agent_id, found in findings.items():
+        write_json(os.path.join(FINDINGS_FOLDER, f"{agent_id}.json"),
+                   {"agent_id": agent_id, "matched_at": datetime.now().isoformat(), "findings": found})
+
+def process_jobs(jobs):
+    """Ingest worker: decodes, stores and matches a batch of uploads.
+    Returns job -> error for the jobs that failed."""
+    errors, stored, addrs = {}, {}, {}
+    for job in jobs:
+        try:
+            data = decode_body(job.raw, job.encoding)
+            if not data:
+                raise ValueError("empty body")
+            agent_id, data = store_upload(data, job.remote_addr)
+            stored[agent_id], addrs[agent_id] = data, job.remote_addr
+        except Exception as e:
+            errors[job] = e
+    try:
+        STORE.save(stored, addrs)
+    except Exception as e:
+        return {job: e for job in jobs}
+    try:
+        match_uploads(stored)
+    except Exception as e:
+        print(f"❌ Matching failed: {e}")
+    return errors
+
+def job_failed(job, error):
+    print(f"❌ Ingest failed for {job.key}: {error}")
+    # The agent already took its upload as acknowledged: make it resync
+    if AGENT_ID.match(job.key):
+        with HEADS_LOCK:
+            HEADS[job.key] = None
+
+# Uploads are processed by INGEST_WORKERS background threads (0: in the
+# request thread, answering 200 instead of 202). Past INGEST_QUEUE
+# waiting uploads, new ones are refused with 503.
+INGEST_WORKERS = int(os.environ.get("VSCANNER_INGEST_WORKERS", "4"))
+INGEST_QUEUE = int(os.environ.get("VSCANNER_INGEST_QUEUE", "1000"))
+RETRY_AFTER = 60
+INGEST = IngestQueue(process_jobs, job_failed, INGEST_WORKERS, INGEST_QUEUE) if INGEST_WORKERS > 0 else None
 
 @app.route('/api/upload_scan', methods=['POST'])
 def receive_scan():
+    LOAD.hit()
     try:
-        data = request.json
-        if not data:
+        # Refuse a stale delta before reading (and decompressing) its body
+        agent_id = request.headers.get("X-Agent-Id", "")
+        base = request.headers.get("X-Base-Snapshot")
+        if base and base != "none" and AGENT_ID.match(agent_id):
+            if head(agent_id) != base:
+                print(f"🔁 RESYNC {agent_id}: stale base snapshot")
+                return reply({"status": "resync", "message": "stale base snapshot"}, 409)
+
+        encoding = (request.headers.get("Content-Encoding") or "identity").strip().lower()
+        try:
+            decompressor(encoding)
+            raw = read_raw_body()
+        except UnsupportedEncoding as e:
+            return unsupported(e)
+        except OverflowError as e:
+            return jsonify({"status": "error", "message": str(e)}), 413
+        if not raw:
             return jsonify({"status": "error"}), 400
 
-        # --- NEW: PARSE DEVICE INFO ---
-        # Check if this is the new "v2" format with device info
-        if "device" in data and "inventory" in data:
-            hostname = data['device'].get('hostname', 'Unknown')
-            ip = data['device'].get('ip', 'Unknown')
-            os_name = data['device'].get('os', 'Unknown')
-            
-            print(f"📝 REGISTERING DEVICE: {hostname} [{ip}]")
-            print(f"   OS: {os_name}")
-            
-            # Use Hostname in filename now!
-            filename = f"{hostname}_{ip}.json"
-        else:
-            # Fallback for old agents
-            client_ip = request.remote_addr
-            filename = f"scan_{client_ip}.json"
+        if INGEST:
+            key = agent_id if AGENT_ID.match(agent_id) else str(request.remote_addr)
+            job = Job(key, raw, encoding, request.remote_addr, request.headers.get("X-Snapshot-Hash"))
+            try:
+                INGEST.submit(job)
+            except QueueFull as e:
+                resp, status = reply({"status": "busy", "message": str(e)}, 503)
+                resp.headers["Retry-After"] = str(RETRY_AFTER)
+                return resp, status
+            if key == agent_id:
+                set_head(agent_id, job.snapshot_hash)
+            return reply({"status": "accepted", "message": "Upload queued"}, 202)
 
-        # Save to disk
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=2)
+        # Synchronous ingest
+        try:
+            data = decode_body(raw, encoding)
+        except CORRUPT_BODY as e:
+            return jsonify({"status": "error", "message": f"corrupt body: {e}"}), 400
+        if not data:
+            return jsonify({"status": "error"}), 400
+        snapshot = data.get("snapshot_hash")
+        try:
+            key, data = store_upload(data, request.remote_addr)
+        except SnapshotMismatch as e:
+            print(f"🔁 RESYNC {agent_id}: {e}")
+            set_head(agent_id, None)
+            return reply({"status": "resync", "message": str(e)}, 409)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        STORE.save({key: data}, {key: request.remote_addr})
+        set_head(key, snapshot)
+        match_uploads({key: data})
 
-        return jsonify({"status": "success", "message": "Device Registered"}), 200
+        return reply({"status": "success", "message": "Device Registered"}, 200)
 
     except Exception as e:
         print(f"❌ Error: {e}")
-        return jsonify({"status": "error"}), 500
+        return reply({"status": "error"}, 500)
+
+@app.route('/api/hosts', methods=['GET'])
+def find_hosts():
+    """Fleet lookup: ?package=<name>[&version=][&below=], ?port=<n>[&protocol=] or ?service=<name>."""
+    args = request.args
+    if args.get("package"):
+        rows = STORE.hosts_with_package(args["package"], args.get("version"), args.get("below"))
+        fields = ("agent_id", "hostname", "version", "manager")
+    elif args.get("port", "").isdigit():
+        rows = STORE.hosts_with_port(int(args["port"]), args.get("protocol"))
+        fields = ("agent_id", "hostname", "protocol", "address", "service_name")
+    elif args.get("service"):
+        rows = STORE.hosts_with_service(args["service"])
+        fields = ("agent_id", "hostname", "active_state")
+    else:
+        return jsonify({"status": "error", "message": "package, port or service required"}), 400
+    return jsonify([dict(zip(fields, row)) for row in rows]), 200
+
+@app.route('/api/ingest', methods=['GET'])
+def ingest_stats():
+    return jsonify(INGEST.stats() if INGEST else {"workers": 0}), 200
+
 @app.route('/ping', methods=['GET'])
 def ping():
     return "PONG", 200
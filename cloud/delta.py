@@ -0,0 +1,103 @@
+"""
+Server side of differential uploads (see app/delta.py).
+
+Agents send either a full payload (type "full") or a delta against the
+last snapshot the server acknowledged (type "delta"): changed sections as
+whole values plus added/changed/removed items for the itemised lists.
+Both sides hash the same order-independent form of the state, so the
+server can tell whether it holds the base the delta was built on.
+"""
+import copy
+import hashlib
+import json
+
+# Keep in sync with app/delta.py (pinned by tests/test_delta.py)
+ITEM_KEYS = {
+    "inventory": ("manager", "name", "architecture", "version"),
+    "services": ("name",),
+    "network.open_ports": ("protocol", "port", "address"),
+}
+ENVELOPE = ("agent_id", "timestamp")
+# Upload metadata, not part of the state
+PROTOCOL = ("type", "snapshot_hash", "base_hash", "sections", "items")
+
+class SnapshotMismatch(Exception):
+    """The delta does not apply to the state we hold; agent must resync."""
+
+def item_key(path, item):
+    return json.dumps([item.get(field) for field in ITEM_KEYS[path]])
+
+def _pop_path(state, path):
+    *parents, leaf = path.split(".")
+    for part in parents:
+        state = state.get(part)
+        if not isinstance(state, dict):
+            return None
+    return state.pop(leaf, None)
+
+def _set_path(state, path, value):
+    *parents, leaf = path.split(".")
+    for part in parents:
+        state = state.setdefault(part, {})
+    state[leaf] = value
+
+def split_state(payload):
+    sections = {k: copy.deepcopy(v) for k, v in payload.items() if k not in ENVELOPE + PROTOCOL}
+    items = {}
+    for path in ITEM_KEYS:
+        rows = _pop_path(sections, path) or []
+        items[path] = {item_key(path, item): item for item in rows if isinstance(item, dict)}
+    return sections, items
+
+def join_state(sections, items, envelope):
+    """Rebuilds a full payload, shaped like the agent's upload."""
+    payload = dict(envelope)
+    payload.update(copy.deepcopy(sections))
+    for path, rows in items.items():
+        parents = path.split(".")[:-1]
+        if not parents or parents[0] in payload:
+            _set_path(payload, path, list(rows.values()))
+    return payload
+
+def snapshot_hash(sections, items):
+    canonical = {"sections": sections, "items": {path: sorted(rows.items()) for path, rows in items.items()}}
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+def state_hash(payload):
+    """Snapshot hash of a stored full payload."""
+    return snapshot_hash(*split_state(payload))
+
+def apply_upload(base, body):
+    """
+    Returns the agent's full payload after `body` (full or delta).
+    `base` is the previously stored full payload (or None). Raises
+    SnapshotMismatch when a delta cannot be applied.
+    """
+    envelope = {k: body.get(k) for k in ENVELOPE}
+    if body.get("type") != "delta":
+        sections, items = split_state(body)
+    else:
+        if base is None:
+            raise SnapshotMismatch("no stored snapshot")
+        sections, items = split_state(base)
+        if snapshot_hash(sections, items) != body.get("base_hash"):
+            raise SnapshotMismatch("base hash differs")
+
+        for name, value in (body.get("sections") or {}).items():
+            if value is None:
+                sections.pop(name, None)
+            else:
+                sections[name] = value
+        for path, change in (body.get("items") or {}).items():
+            if path not in ITEM_KEYS:
+                continue
+            rows = items[path]
+            for key in change.get("removed", []):
+                rows.pop(json.dumps(key), None)
+            for item in change.get("added", []) + change.get("changed", []):
+                rows[item_key(path, item)] = item
+
+    expected = body.get("snapshot_hash")
+    if expected and snapshot_hash(sections, items) != expected:
+        raise SnapshotMismatch("result hash differs")
+    return join_state(sections, items, envelope)
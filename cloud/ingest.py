@@ -0,0 +1,102 @@
+"""
+Ingest queue: the local stand-in for the task queue in docs/arch/arch1.md.
+
+The upload handler only validates and enqueues raw bodies; a pool of
+worker threads decodes, stores and matches them. Each agent always
+lands on the same worker, so its uploads (a delta depends on the one
+before it) are processed in order. Queues are bounded: when a worker's
+queue is full, submit() refuses the job and the caller answers 503.
+
+Jobs live in memory. If the server stops with jobs queued, the affected
+agents' next deltas no longer match the stored state and they resync
+with a full upload.
+"""
+import queue
+import threading
+import time
+import zlib
+
+class QueueFull(Exception):
+    """The worker queue for this key has no room; try again later."""
+
+class Job:
+    def __init__(self, key, raw, encoding, remote_addr, snapshot_hash=None):
+        self.key = key
+        self.raw = raw
+        self.encoding = encoding
+        self.remote_addr = remote_addr
+        self.snapshot_hash = snapshot_hash
+        self.accepted_at = time.monotonic()
+
+class IngestQueue:
+    """
+    `workers` threads, each with a queue of up to `capacity / workers`
+    jobs. `handler(jobs)` processes a batch: a worker takes what is
+    already queued (up to `batch`) so matching can group packages
+    across agents. `on_error(job, error)` is called for every job of a
+    batch that raised.
+    """
+
+    def __init__(self, handler, on_error, workers=4, capacity=1000, batch=32):
+        self.handler = handler
+        self.on_error = on_error
+        self.batch = max(1, batch)
+        per_worker = max(1, -(-capacity // max(1, workers)))
+        self.queues = [queue.Queue(maxsize=per_worker) for _ in range(max(1, workers))]
+        self.lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.wait = 0.0
+        for i, q in enumerate(self.queues):
+            threading.Thread(target=self._work, args=(q,), name=f"ingest-{i}", daemon=True).start()
+
+    def _queue(self, key):
+        return self.queues[zlib.crc32(key.encode()) % len(self.queues)]
+
+    def submit(self, job):
+        try:
+            self._queue(job.key).put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            raise QueueFull(f"ingest queue full ({self.depth()} uploads waiting)")
+        with self.lock:
+            self.accepted += 1
+
+    def depth(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def stats(self):
+        with self.lock:
+            done = self.processed + self.failed
+            return {
+                "workers": len(self.queues),
+                "queued": self.depth(),
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "processed": self.processed,
+                "failed": self.failed,
+                "avg_wait_s": round(self.wait / done, 3) if done else 0,
+            }
+
+    def _work(self, q):
+        while True:
+            jobs = [q.get()]
+            while len(jobs) < self.batch:
+                try:
+                    jobs.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            started = time.monotonic()
+            try:
+                errors = self.handler(jobs) or {}
+            except Exception as e:
+                errors = {job: e for job in jobs}
+            for job, error in errors.items():
+                self.on_error(job, error)
+            with self.lock:
+                self.failed += len(errors)
+                self.processed += len(jobs) - len(errors)
+                self.wait += sum(started - job.accepted_at for job in jobs)
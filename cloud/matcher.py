@@ -0,0 +1,128 @@
+"""
+Matching Engine: agent inventories in, vulnerabilities out.
+
+Built for fleet-wide (re)scans. Packages from all agents are grouped
+first, so every distinct (product, version) pair is looked up in the
+rule index exactly once, no matter how many hosts carry it. Results are
+then fanned back out per agent.
+
+    python cloud/matcher.py nvd_robust.db rules.idx cloud_data/*.json
+"""
+import json
+import sqlite3
+import sys
+from collections import defaultdict
+
+from resolver import Resolver
+from rule_index import RuleIndex
+from versions import upstream_key
+
+# SQLite's default limit on bound parameters per statement
+MAX_PARAMS = 900
+
+# Memory-map immutable snapshots (up to 1GB) so processes share their pages
+MMAP_SIZE = 1 << 30
+
+class Matcher:
+    def __init__(self, db_path, index_path, immutable=False):
+        # immutable: the file never changes (published snapshots), so
+        # SQLite skips locking and change detection altogether
+        uri = f"file:{db_path}?mode=ro" + ("&immutable=1" if immutable else "")
+        self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        if immutable:
+            self.conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        self.index = RuleIndex(index_path)
+        self.resolver = Resolver(self.conn)
+        # Counters of the last match_inventories() call, reported by the CLI
+        self.last_stats = {}
+
+    def close(self):
+        self.index.close()
+        self.conn.close()
+
+    def cve_details(self, cve_ids):
+        """Fetches (severity, cvss_score) for many CVEs in a few queries."""
+        details = {}
+        cve_ids = list(cve_ids)
+        for i in range(0, len(cve_ids), MAX_PARAMS):
+            chunk = cve_ids[i:i + MAX_PARAMS]
+            rows = self.conn.execute(f"SELECT id, severity, cvss_score FROM cves WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+            for cve_id, severity, score in rows:
+                details[cve_id] = (severity, score)
+        return details
+
+    def match_inventories(self, inventories):
+        """Matches many agents at once.
+
+        `inventories` maps agent_id -> inventory list (as uploaded by
+        software.get_software_inventory()). Returns agent_id -> findings.
+        """
+        # 1. Group identical packages across the whole fleet
+        holders = defaultdict(list)
+        for agent_id, inventory in inventories.items():
+            for pkg in inventory or []:
+                key = (pkg.get("name"), pkg.get("source"), pkg.get("version"), pkg.get("manager"))
+                holders[key].append(agent_id)
+
+        # 2. Evaluate each distinct (product, version) once
+        verdicts = {}
+        hits = {}
+        for key in holders:
+            name, source, version, manager = key
+            if not version:
+                continue
+            vkey = upstream_key(version, manager)
+            matched = []
+            for pid in self.resolver.resolve(name, source, manager):
+                if (pid, vkey) not in verdicts:
+                    verdicts[(pid, vkey)] = self.index.affected(pid, vkey)
+                matched.extend((pid, cve_id) for cve_id in verdicts[(pid, vkey)])
+            if matched:
+                hits[key] = matched
+
+        # 3. Fan results back out per agent
+        details = self.cve_details({cve_id for matched in hits.values() for _, cve_id in matched})
+        findings = {agent_id: [] for agent_id in inventories}
+        for key, matched in hits.items():
+            name, _, version, manager = key
+            for pid, cve_id in matched:
+                severity, score = details.get(cve_id, ("UNKNOWN", 0.0))
+                finding = {
+                    "package": name,
+                    "version": version,
+                    "manager": manager,
+                    "product_id": pid,
+                    "cve_id": cve_id,
+                    "severity": severity,
+                    "cvss_score": score,
+                }
+                for agent_id in holders[key]:
+                    findings[agent_id].append(finding)
+
+        self.last_stats = {
+            "agents": len(inventories),
+            "packages": sum(len(v or []) for v in inventories.values()),
+            "distinct": len(holders),
+            "lookups": len(verdicts),
+        }
+        return findings
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("Usage: matcher.py <nvd.db> <rules.idx> <scan.json> [scan.json ...]")
+        sys.exit(1)
+
+    inventories = {}
+    for path in sys.argv[3:]:
+        with open(path) as f:
+            scan = json.load(f)
+        inventories[scan.get("agent_id") or path] = scan.get("inventory", [])
+
+    matcher = Matcher(sys.argv[1], sys.argv[2])
+    for agent_id, found in matcher.match_inventories(inventories).items():
+        critical = sum(1 for f in found if f["severity"] == "CRITICAL")
+        print(f"{agent_id}: {len(found)} findings ({critical} critical)")
+    stats = matcher.last_stats
+    print(f"   Matched {stats['packages']} packages from {stats['agents']} agents: "
+          f"{stats['distinct']} distinct, {stats['lookups']} (product, version) lookups ({matcher.resolver.stats()})")
+    matcher.close()
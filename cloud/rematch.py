@@ -0,0 +1,322 @@
+"""
+Targeted rematch: after an NVD sync, re-evaluate only what it touched.
+
+Keeps, next to the asset store (asset_store.py), a reverse index from
+NVD product to the interned packages that resolve to it, one from
+candidate name to the packages that could take that name, and the
+findings of every distinct package. An incremental sync records the
+products whose rules changed (pull/nvd_state.py); a rematch looks up
+the packages carrying them, re-evaluates just those, and reports the
+findings that appeared or closed, fanned out to the hosts holding them.
+Packages seen for the first time are resolved and matched as well, and
+so are packages whose names new NVD products could claim.
+
+package_findings is the source of truth for host findings: after a
+pass, the findings file of every host that gained or lost one (of every
+host, after a full pass) is rebuilt from it, in the format the server
+writes (cloud_data/findings/<agent_id>.json).
+
+A fresh NVD build (new build id), a resolver or version key change, or
+--full, re-resolves and re-matches every package. Recompile rules.idx
+before running this after a sync, or point it at published snapshots
+(snapshots.py) to use the current one.
+
+    python cloud/rematch.py cloud_data/assets.db nvd_robust.db rules.idx [--full] [--events events.jsonl] [--findings DIR]
+    python cloud/rematch.py cloud_data/assets.db --snapshots snapshots/
+"""
+import argparse
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from asset_store import AssetStore, PACKAGE_FIELDS, MAX_PARAMS
+from matcher import Matcher
+from resolver import VERSION as RESOLVER_VERSION, candidates, normalize
+from rule_index import FORMAT_VERSION
+from snapshots import current_paths
+from versions import upstream_key
+
+# Layout of the tables below
+SCHEMA_VERSION = 2
+
+# Stored resolutions and findings are redone when any of these changes
+MATCH_VERSION = f"{RESOLVER_VERSION}.{FORMAT_VERSION}.{SCHEMA_VERSION}"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS package_products (
+    product_id INTEGER NOT NULL,
+    package_id INTEGER NOT NULL,
+    PRIMARY KEY (product_id, package_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_package_products_package ON package_products(package_id);
+CREATE TABLE IF NOT EXISTS package_candidates (
+    name TEXT NOT NULL,
+    package_id INTEGER NOT NULL,
+    PRIMARY KEY (name, package_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_package_candidates_package ON package_candidates(package_id);
+CREATE TABLE IF NOT EXISTS resolved_packages (
+    package_id INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS package_findings (
+    package_id INTEGER NOT NULL,
+    cve_id TEXT NOT NULL,
+    product_id INTEGER NOT NULL,
+    PRIMARY KEY (package_id, cve_id, product_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rematch_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+def _chunks(values, size=MAX_PARAMS):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+class Rematcher:
+    def __init__(self, store_path, db_path, index_path, immutable=False):
+        self.store = AssetStore(store_path)
+        self.conn = self.store.conn()
+        self.conn.executescript(SCHEMA)
+        self.matcher = Matcher(db_path, index_path, immutable)
+        self.nvd = self.matcher.conn
+
+    def close(self):
+        self.matcher.close()
+        self.store.close()
+
+    def _state(self, key):
+        row = self.conn.execute("SELECT value FROM rematch_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _nvd_state(self, key):
+        try:
+            row = self.nvd.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        except Exception:
+            return None
+        return row[0] if row else None
+
+    def changed_products(self, since_seq):
+        try:
+            return {pid for pid, in self.nvd.execute("SELECT product_id FROM changed_products WHERE sync_seq > ?",
+                                                    (since_seq,))}
+        except Exception:
+            return None  # DB built before change tracking
+
+    def claimable(self, after_product_id):
+        """Ids of the packages that products added after `after_product_id`
+        could resolve to: one of their candidate names is such a product's."""
+        names = {normalize(name) for name, in self.nvd.execute(
+            "SELECT name FROM products WHERE id > ?", (after_product_id,)) if name}
+        claimed = set()
+        for chunk in _chunks(names):
+            claimed.update(pid for pid, in self.conn.execute(
+                f"SELECT package_id FROM package_candidates WHERE name IN ({','.join('?' * len(chunk))})", chunk))
+        return sorted(claimed)
+
+    def resolve(self, package_ids):
+        """(Re)resolves packages to products. Returns the ids whose products changed."""
+        changed = set()
+        for chunk in _chunks(package_ids):
+            marks = ",".join("?" * len(chunk))
+            old = defaultdict(set)
+            for product_id, package_id in self.conn.execute(
+                    f"SELECT product_id, package_id FROM package_products WHERE package_id IN ({marks})", chunk):
+                old[package_id].add(product_id)
+            self.conn.execute(f"DELETE FROM package_candidates WHERE package_id IN ({marks})", chunk)
+            rows = self.conn.execute(f"SELECT id, name, source, manager FROM package_ids WHERE id IN ({marks})", chunk)
+            for package_id, name, source, manager in rows.fetchall():
+                if name:
+                    self.conn.executemany("INSERT OR IGNORE INTO package_candidates VALUES (?, ?)",
+                                          [(product, package_id) for _, product, _ in candidates(name, source)])
+                products = set(self.matcher.resolver.resolve(name, source, manager))
+                if products == old.get(package_id, set()):
+                    continue
+                changed.add(package_id)
+                self.conn.execute("DELETE FROM package_products WHERE package_id = ?", (package_id,))
+                self.conn.executemany("INSERT INTO package_products VALUES (?, ?)", [(pid, package_id) for pid in products])
+            self.conn.executemany("INSERT OR IGNORE INTO resolved_packages VALUES (?)", [(pid,) for pid in chunk])
+        return changed
+
+    def evaluate(self, package_ids):
+        """
+        Re-matches packages against the rule index and replaces their
+        findings, one per (CVE, product) as the matcher reports them.
+        Returns (new, closed): sets of (package_id, cve_id, product_id).
+        """
+        new, closed = set(), set()
+        for chunk in _chunks(package_ids):
+            marks = ",".join("?" * len(chunk))
+            products = defaultdict(list)
+            for product_id, package_id in self.conn.execute(
+                    f"SELECT product_id, package_id FROM package_products WHERE package_id IN ({marks})", chunk):
+                products[package_id].append(product_id)
+            before = defaultdict(set)
+            for package_id, cve_id, product_id in self.conn.execute(
+                    f"SELECT package_id, cve_id, product_id FROM package_findings WHERE package_id IN ({marks})", chunk):
+                before[package_id].add((cve_id, product_id))
+
+            rows = []
+            for package_id, version, manager in self.conn.execute(
+                    f"SELECT id, version, manager FROM package_ids WHERE id IN ({marks})", chunk).fetchall():
+                found = set()
+                if version:
+                    vkey = upstream_key(version, manager)
+                    for product_id in products.get(package_id, ()):
+                        found.update((cve_id, product_id) for cve_id in self.matcher.index.affected(product_id, vkey))
+                rows.extend((package_id, cve_id, product_id) for cve_id, product_id in found)
+                new.update((package_id, *finding) for finding in found - before[package_id])
+                closed.update((package_id, *finding) for finding in before[package_id] - found)
+            self.conn.execute(f"DELETE FROM package_findings WHERE package_id IN ({marks})", chunk)
+            self.conn.executemany("INSERT INTO package_findings VALUES (?, ?, ?)", rows)
+        return new, closed
+
+    def events(self, kind, findings):
+        """Fans (package_id, cve_id, product_id) findings out to the hosts
+        carrying the package."""
+        by_package = defaultdict(list)
+        for package_id, cve_id, product_id in findings:
+            by_package[package_id].append((cve_id, product_id))
+        details = self.matcher.cve_details({cve_id for _, cve_id, _ in findings})
+        for chunk in _chunks(by_package):
+            marks = ",".join("?" * len(chunk))
+            packages = {row[0]: dict(zip(PACKAGE_FIELDS, row[1:])) for row in self.conn.execute(
+                f"SELECT id, {', '.join(PACKAGE_FIELDS)} FROM package_ids WHERE id IN ({marks})", chunk)}
+            hosts = self.conn.execute(
+                "SELECT m.package_id, a.agent_id, a.hostname FROM set_members m "
+                f"JOIN assets a ON a.package_set = m.set_hash WHERE m.package_id IN ({marks})", chunk)
+            for package_id, agent_id, hostname in hosts:
+                pkg = packages[package_id]
+                for cve_id, product_id in by_package[package_id]:
+                    severity, score = details.get(cve_id, ("UNKNOWN", 0.0))
+                    yield {"event": kind, "agent_id": agent_id, "hostname": hostname,
+                           "package": pkg["name"], "version": pkg["version"], "manager": pkg["manager"],
+                           "product_id": product_id, "cve_id": cve_id, "severity": severity, "cvss_score": score}
+
+    def host_findings(self, agent_ids):
+        """agent_id -> findings from the stored package findings, in the
+        matcher's format (matcher.match_inventories)."""
+        findings = {agent_id: [] for agent_id in agent_ids}
+        rows = []
+        for chunk in _chunks(agent_ids):
+            rows.extend(self.conn.execute(
+                "SELECT a.agent_id, p.name, p.version, p.manager, f.product_id, f.cve_id FROM assets a "
+                "JOIN set_members m ON m.set_hash = a.package_set "
+                "JOIN package_findings f ON f.package_id = m.package_id "
+                "JOIN package_ids p ON p.id = f.package_id "
+                f"WHERE a.agent_id IN ({','.join('?' * len(chunk))}) ORDER BY p.name, p.version, f.cve_id", chunk))
+        details = self.matcher.cve_details({row[5] for row in rows})
+        for agent_id, name, version, manager, product_id, cve_id in rows:
+            severity, score = details.get(cve_id, ("UNKNOWN", 0.0))
+            findings[agent_id].append({
+                "package": name,
+                "version": version,
+                "manager": manager,
+                "product_id": product_id,
+                "cve_id": cve_id,
+                "severity": severity,
+                "cvss_score": score,
+            })
+        return findings
+
+    def write_findings(self, folder, agent_ids):
+        """Rewrites the findings files of these hosts. Returns how many."""
+        os.makedirs(folder, exist_ok=True)
+        matched_at = datetime.now().isoformat()
+        for agent_id, found in self.host_findings(agent_ids).items():
+            path = os.path.join(folder, f"{agent_id}.json")
+            # The server may be writing the same file: never share its temp name
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(json.dumps({"agent_id": agent_id, "matched_at": matched_at, "findings": found},
+                                   separators=(",", ":")))
+            os.replace(tmp_path, path)
+        return len(agent_ids)
+
+    def run(self, full=False):
+        """
+        One rematch pass, committed as a whole. Returns (stats, new
+        findings, closed findings), as evaluate() does.
+        """
+        started = time.perf_counter()
+        build_id = self._nvd_state("build_id") or ""
+        seq = int(self._nvd_state("sync_seq") or 0)
+        max_product = self.nvd.execute("SELECT IFNULL(MAX(id), 0) FROM products").fetchone()[0]
+        last_seq = int(self._state("sync_seq") or 0)
+        changed = self.changed_products(last_seq)
+        full = (full or changed is None or self._state("build_id") != build_id
+                or self._state("match_version") != MATCH_VERSION)
+
+        with self.conn:
+            all_packages = [pid for pid, in self.conn.execute("SELECT id FROM package_ids")]
+            if full:
+                self.resolve(all_packages)
+                targets = set(all_packages)
+                changed = set()
+            else:
+                unresolved = [pid for pid, in self.conn.execute(
+                    "SELECT id FROM package_ids WHERE id NOT IN (SELECT package_id FROM resolved_packages)")]
+                # New NVD products can claim names that resolved to nothing (or elsewhere) before
+                claimable = self.claimable(int(self._state("max_product_id") or 0))
+                targets = self.resolve(set(unresolved) | set(claimable)) | set(unresolved)
+                for chunk in _chunks(changed):
+                    targets.update(pid for pid, in self.conn.execute(
+                        f"SELECT package_id FROM package_products WHERE product_id IN ({','.join('?' * len(chunk))})", chunk))
+
+            new, closed = self.evaluate(targets)
+            self.conn.executemany("INSERT OR REPLACE INTO rematch_state VALUES (?, ?)", [
+                ("build_id", build_id), ("sync_seq", str(seq)), ("max_product_id", str(max_product)),
+                ("match_version", MATCH_VERSION)])
+
+        stats = {
+            "full": full,
+            "changed_products": len(changed),
+            "packages": len(all_packages),
+            "evaluated": len(targets),
+            "new": len(new),
+            "closed": len(closed),
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+        return stats, new, closed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-match stored packages affected by the last NVD sync")
+    parser.add_argument("assets_db")
+    parser.add_argument("nvd_db", nargs="?")
+    parser.add_argument("rule_index", nargs="?")
+    parser.add_argument("--snapshots", metavar="DIR", help="Use the current published snapshot instead")
+    parser.add_argument("--full", action="store_true", help="Re-resolve and re-match every package")
+    parser.add_argument("--events", metavar="JSONL", help="Append new/closed findings per host to this file")
+    parser.add_argument("--findings", metavar="DIR",
+                        help="Host findings files to update (default: findings/ next to assets_db)")
+    args = parser.parse_args()
+    if args.snapshots:
+        args.nvd_db, args.rule_index = current_paths(args.snapshots)
+    elif not args.rule_index:
+        parser.error("nvd_db and rule_index are required without --snapshots")
+
+    rematcher = Rematcher(args.assets_db, args.nvd_db, args.rule_index, immutable=bool(args.snapshots))
+    stats, new, closed = rematcher.run(full=args.full)
+    print(f"{'Full' if stats['full'] else 'Targeted'} rematch: {stats['changed_products']} changed products, "
+          f"{stats['evaluated']} of {stats['packages']} packages evaluated in {stats['seconds']}s")
+
+    hosts, count = set(), 0
+    out = open(args.events, "a") if args.events else None
+    for kind, findings in (("new", new), ("closed", closed)):
+        for event in rematcher.events(kind, findings):
+            hosts.add(event["agent_id"])
+            count += 1
+            if out:
+                out.write(json.dumps(event) + "\n")
+    if out:
+        out.close()
+    print(f"   {stats['new']} new, {stats['closed']} closed package findings -> {count} host events on {len(hosts)} hosts")
+    folder = args.findings or os.path.join(os.path.dirname(args.assets_db), "findings")
+    if stats["full"]:
+        hosts = {agent_id for agent_id, in rematcher.conn.execute("SELECT agent_id FROM assets")}
+    print(f"   Rewrote {rematcher.write_findings(folder, hosts)} findings files in '{folder}'")
+    rematcher.close()
@@ -0,0 +1,208 @@
+"""
+Package name -> CPE product resolution.
+
+Agents report distro/ecosystem names (`libssl3`, `openssl-libs`,
+`python3-requests`), NVD rules are keyed by CPE product names
+(`openssl`, `requests`). The resolver builds a normalised-name index
+over the whole `products` table once, then maps every package through a
+short, ordered list of candidates, all in memory:
+
+    1. known aliases of the name or its source (libssl -> openssl:openssl,
+       kernel -> linux:linux_kernel), pinned to their vendor
+    2. the package name itself
+    3. the distro source package (deb `source`, e.g. libssl3 -> openssl)
+    4. ecosystem prefixes / packaging suffixes stripped
+       (python3-requests -> requests, openssl-libs -> openssl)
+    5. soname digits and the `lib` prefix stripped (libcurl4 -> curl)
+
+The first candidate with a product in scope wins, so the stripping only
+happens when nothing more exact matched. Scope depends on the package
+manager: language ecosystems (pip, npm, ...) have short, generic names,
+so there a product counts only if its vendor belongs to the ecosystem
+or is named after the project (`requests` -> python:requests, not some
+other vendor's `requests`). The same holds for distro packages of those
+projects, once their language prefix is stripped (deb python3-requests
+-> python:requests). Hardware products never match, and when a
+name is shared by several vendors, the vendor of the same name wins
+(openssl:openssl). Results are kept in a bounded LRU cache, since
+fleets report the same packages over and over.
+
+    python cloud/resolver.py nvd_robust.db libssl3 openssl
+    python cloud/resolver.py nvd_robust.db requests --manager pip
+"""
+import argparse
+import re
+import sqlite3
+from collections import defaultdict
+from functools import lru_cache
+
+CACHE_SIZE = 262144
+
+# Bumped whenever the same package may resolve differently; stored
+# resolutions (rematch.py) are redone when it changes
+VERSION = 3
+
+_SEPARATORS = re.compile(r"[\s._+-]+")
+# "glibc (2.35-0ubuntu3)" -> "glibc"
+_SOURCE_VERSION = re.compile(r"\s*\(.*\)\s*$")
+# libssl3, libssl1.1, libpng16 -> libssl, libssl, libpng
+_SONAME = re.compile(r"(?<=[a-z])[0-9][0-9_]*$")
+
+# Distro packaging of a language ecosystem's projects: prefix -> ecosystem
+PREFIXES = {
+    "python3_": "python", "python2_": "python", "python_": "python", "py3_": "python", "py_": "python",
+    "perl_": "perl", "ruby_": "gem", "rubygem_": "gem", "golang_": "golang",
+    "node_": "npm", "nodejs_": "npm", "php_": "php", "php8_": "php", "php7_": "php",
+}
+SUFFIXES = ("_libs", "_lib", "_devel", "_dev", "_common", "_bin", "_utils",
+            "_tools", "_data", "_doc", "_runtime", "_core", "_daemon")
+
+# Libraries whose package names never resemble their CPE product:
+# package name -> (vendor, product)
+ALIASES = {
+    "libssl": ("openssl", "openssl"),
+    "libcrypto": ("openssl", "openssl"),
+    "libc6": ("gnu", "glibc"),
+    "libc": ("gnu", "glibc"),
+    "libc_bin": ("gnu", "glibc"),
+    "libglib2": ("gnome", "glib"),
+    "libkrb5": ("mit", "kerberos_5"),
+    "krb5": ("mit", "kerberos_5"),
+    "libnss3": ("mozilla", "network_security_services"),
+    "nss": ("mozilla", "network_security_services"),
+    "zlib1g": ("zlib", "zlib"),
+    "libz": ("zlib", "zlib"),
+    "libbz2": ("bzip", "bzip2"),
+    "liblzma": ("tukaani", "xz"),
+    "libpcre3": ("pcre", "pcre"),
+    "libpcre2": ("pcre", "pcre2"),
+    "openjdk": ("oracle", "openjdk"),
+    "linux_image": ("linux", "linux_kernel"),
+    "kernel": ("linux", "linux_kernel"),
+    "apache2": ("apache", "http_server"),
+    "httpd": ("apache", "http_server"),
+}
+
+# Language ecosystems (normalised manager name -> the ecosystem's own
+# vendors). Their packages only resolve to products of these vendors or
+# of a vendor named after the project; aliases don't apply.
+ECOSYSTEMS = {
+    "pip": {"python", "psf", "python_software_foundation", "pypa", "pypi", "palletsprojects"},
+    "python": {"python", "psf", "python_software_foundation", "pypa", "pypi", "palletsprojects"},
+    "npm": {"nodejs", "npmjs", "openjsf"},
+    "gem": {"ruby_lang", "rubygems", "rubyonrails"},
+    "perl": {"perl"},
+    "golang": {"golang"},
+    "php": {"php"},
+    "chrome_extension": set(),
+}
+
+def normalize(name):
+    """Lower-cases and folds every separator run into '_' (CPE style)."""
+    return _SEPARATORS.sub("_", name.strip().lower()).strip("_")
+
+def candidates(name, source=None, aliases=True):
+    """
+    Yields (vendor, product, ecosystem) to try for a package, most
+    specific first. vendor is None for plain names (any vendor in scope)
+    and set for aliases. ecosystem is set for names whose language prefix
+    was stripped (python3-requests -> requests, "python"): only that
+    ecosystem's vendors are in scope for them.
+    """
+    seen = set()
+
+    def emit(value):
+        if value and value not in seen:
+            seen.add(value)
+            return True
+        return False
+
+    bases = [normalize(name)]
+    if source:
+        bases.append(normalize(_SOURCE_VERSION.sub("", source)))
+
+    def with_aliases(names):
+        if aliases:
+            for value, ecosystem in names:
+                # Aliases are distro library names, not ecosystem projects
+                alias = None if ecosystem else ALIASES.get(value)
+                if alias and emit(alias):
+                    yield alias + (None,)
+        for value, ecosystem in names:
+            if emit(value):
+                yield None, value, ecosystem
+
+    yield from with_aliases([(base, None) for base in bases])
+    for base in bases:
+        variants = [(base, None)]
+        for prefix, ecosystem in PREFIXES.items():
+            if base.startswith(prefix):
+                variants.append((base[len(prefix):], ecosystem))
+        for variant, ecosystem in list(variants):
+            for suffix in SUFFIXES:
+                if variant.endswith(suffix):
+                    variants.append((variant[:-len(suffix)], ecosystem))
+        for variant, ecosystem in list(variants):
+            stripped = _SONAME.sub("", variant).rstrip("_")
+            if stripped:
+                variants.append((stripped, ecosystem))
+        for variant, ecosystem in list(variants):
+            if variant.startswith("lib") and len(variant) > 3:
+                variants.append((variant[3:].lstrip("_"), ecosystem))
+        yield from with_aliases(variants[1:])
+
+class Resolver:
+    def __init__(self, conn, cache_size=CACHE_SIZE):
+        # Normalised CPE product name -> [(product id, normalised vendor)]
+        # (across vendors); hardware products are left out
+        self.index = defaultdict(list)
+        for pid, vendor, name, ptype in conn.execute("SELECT id, vendor, name, type FROM products"):
+            if ptype != "h":
+                self.index[normalize(name)].append((pid, normalize(vendor or "")))
+        self.index.default_factory = None
+        self.resolve = lru_cache(maxsize=cache_size)(self._resolve)
+
+    def _in_scope(self, name, products, ecosystem):
+        if ecosystem is not None:
+            products = [(pid, vendor) for pid, vendor in products
+                        if vendor in ecosystem or vendor.startswith(name)]
+        # A name several vendors use: the vendor of the same name wins
+        own = [(pid, vendor) for pid, vendor in products if vendor == name]
+        return own or products
+
+    def _resolve(self, name, source=None, manager=None):
+        if not name:
+            return ()
+        ecosystem = ECOSYSTEMS.get(normalize(manager or ""))
+        for vendor, product, prefixed in candidates(name, source, aliases=ecosystem is None):
+            products = self.index.get(product, ())
+            if vendor is not None:
+                pids = [pid for pid, v in products if v == vendor]
+            else:
+                scope = ecosystem if ecosystem is not None or prefixed is None else ECOSYSTEMS[prefixed]
+                pids = [pid for pid, _ in self._in_scope(product, products, scope)]
+            if pids:
+                return tuple(pids)
+        return ()
+
+    def stats(self):
+        info = self.resolve.cache_info()
+        total = info.hits + info.misses
+        return f"{len(self.index)} names indexed, {info.currsize} cached, {info.hits / total if total else 0:.0%} cache hits"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show which CPE products a package resolves to")
+    parser.add_argument("nvd_db")
+    parser.add_argument("package")
+    parser.add_argument("source", nargs="?")
+    parser.add_argument("--manager", help="Package manager (deb, rpm, pip, ...)")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(f"file:{args.nvd_db}?mode=ro", uri=True)
+    resolver = Resolver(conn)
+    ecosystem = ECOSYSTEMS.get(normalize(args.manager or ""))
+    print("Candidates: " + ", ".join(f"{vendor}:{product}" if vendor else f"{product} ({prefixed})" if prefixed else product
+                                     for vendor, product, prefixed in candidates(args.package, args.source, ecosystem is None)))
+    for pid in resolver.resolve(args.package, args.source, args.manager):
+        vendor, product = conn.execute("SELECT vendor, name FROM products WHERE id = ?", (pid,)).fetchone()
+        print(f"   {pid}: cpe:2.3:*:{vendor}:{product}")
@@ -0,0 +1,240 @@
+"""
+Precompiled, memory-mappable version-range index of vulnerability_rules.
+
+Compile once after each NVD sync:
+
+    python cloud/rule_index.py compile nvd_robust.db rules.idx
+    python cloud/rule_index.py lookup rules.idx <product_id> <version>
+
+Each product's rules become a sorted array of intervals [lo, hi] with
+pre-parsed version keys (see versions.py). Rules are sorted by lo, and
+every entry also carries the running maximum of hi over the entries
+before it. Lookup is a binary search for the last rule starting at or
+below the version, then a backwards walk that stops as soon as that
+running maximum drops below the version.
+
+File layout (little-endian):
+
+    header    MAGIC, format version, counts and section offsets
+    products  (product_id u32, first_rule u32, rule_count u32), sorted
+    rules     (lo, hi, maxhi key refs, flags, cve index), sorted by lo
+    keys      deduplicated version keys, referenced by (offset, length)
+    cves      (offset u32, length u16) into the CVE id strings blob
+"""
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+from bisect import bisect_right
+
+from versions import version_key, MAX_KEY, MIN_KEY
+
+MAGIC = b"VSRI"
+# Bumped whenever versions.py changes how keys are built: old files must be recompiled
+FORMAT_VERSION = 4
+
+HEADER = struct.Struct("<4sIIII6Q")
+PRODUCT = struct.Struct("<III")
+# lo_off, lo_len, hi_off, hi_len, maxhi_off, maxhi_len, flags, cve_idx
+RULE = struct.Struct("<IHIHIHBI")
+CVE = struct.Struct("<IH")
+
+HI_INCLUSIVE = 1
+MAXHI_INCLUSIVE = 2
+
+class RuleIndexError(Exception):
+    """The index file is missing, truncated or of another format."""
+
+# ==========================================
+# 🛠️ COMPILER
+# ==========================================
+def rule_interval(version_start, version_end_excl, version_end_incl):
+    """Returns (lo, hi, hi_inclusive) keys for one rule's version range."""
+    lo = version_key(version_start) if version_start else MIN_KEY
+    if version_end_excl:
+        return lo, version_key(version_end_excl), False
+    if version_end_incl:
+        return lo, version_key(version_end_incl), True
+    return lo, MAX_KEY, True
+
+def _above(a_key, a_incl, b_key, b_incl):
+    """True if upper bound a reaches further than upper bound b."""
+    return a_key > b_key or (a_key == b_key and a_incl and not b_incl)
+
+def compile_index(db_path, out_path):
+    """Builds the index file from an NVD DB. Returns (products, rules)."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    rows = conn.execute('''SELECT product_id, cve_id, version_start, version_end_excl, version_end_incl
+                           FROM vulnerability_rules ORDER BY product_id''')
+
+    keys = {}
+    key_blob = bytearray()
+    cves = {}
+    cve_blob = bytearray()
+    cve_table = bytearray()
+
+    def key_ref(key):
+        if key not in keys:
+            keys[key] = len(key_blob)
+            key_blob.extend(key)
+        return keys[key], len(key)
+
+    def cve_ref(cve_id):
+        if cve_id not in cves:
+            cves[cve_id] = len(cves)
+            raw = cve_id.encode()
+            cve_table.extend(CVE.pack(len(cve_blob), len(raw)))
+            cve_blob.extend(raw)
+        return cves[cve_id]
+
+    product_table = bytearray()
+    rule_table = bytearray()
+    n_products = 0
+    n_rules = 0
+
+    def flush(product_id, intervals):
+        nonlocal n_products, n_rules
+        intervals.sort(key=lambda r: r[0])
+        product_table.extend(PRODUCT.pack(product_id, n_rules, len(intervals)))
+        max_hi, max_incl = MIN_KEY, False
+        for lo, hi, hi_incl, cve_idx in intervals:
+            if _above(hi, hi_incl, max_hi, max_incl):
+                max_hi, max_incl = hi, hi_incl
+            flags = (HI_INCLUSIVE if hi_incl else 0) | (MAXHI_INCLUSIVE if max_incl else 0)
+            rule_table.extend(RULE.pack(*key_ref(lo), *key_ref(hi), *key_ref(max_hi), flags, cve_idx))
+        n_products += 1
+        n_rules += len(intervals)
+
+    current, intervals = None, []
+    for product_id, cve_id, v_start, v_end_ex, v_end_in in rows:
+        if product_id != current:
+            if intervals:
+                flush(current, intervals)
+            current, intervals = product_id, []
+        lo, hi, hi_incl = rule_interval(v_start, v_end_ex, v_end_in)
+        intervals.append((lo, hi, hi_incl, cve_ref(cve_id)))
+    if intervals:
+        flush(current, intervals)
+    conn.close()
+
+    products_off = HEADER.size
+    rules_off = products_off + len(product_table)
+    keys_off = rules_off + len(rule_table)
+    cves_off = keys_off + len(key_blob)
+    cve_blob_off = cves_off + len(cve_table)
+    end_off = cve_blob_off + len(cve_blob)
+
+    # Write aside and rename, so readers never map a half-written file
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, n_products, n_rules, len(cves),
+                            products_off, rules_off, keys_off, cves_off, cve_blob_off, end_off))
+        for section in (product_table, rule_table, key_blob, cve_table, cve_blob):
+            f.write(section)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, out_path)
+    return n_products, n_rules
+
+# ==========================================
+# 🔎 READER
+# ==========================================
+class RuleIndex:
+    """Read-only view of a compiled index. The file is memory-mapped, so
+    several processes opening the same file share its pages."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            try:
+                self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise RuleIndexError(f"{path}: empty file")
+        if len(self.buf) < HEADER.size:
+            raise RuleIndexError(f"{path}: truncated header")
+        (magic, fmt, self.n_products, self.n_rules, self.n_cves,
+         self.products_off, self.rules_off, self.keys_off,
+         self.cves_off, self.cve_blob_off, end_off) = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or fmt != FORMAT_VERSION:
+            raise RuleIndexError(f"{path}: not a v{FORMAT_VERSION} rule index, recompile it")
+        if end_off != len(self.buf):
+            raise RuleIndexError(f"{path}: truncated ({len(self.buf)} of {end_off} bytes)")
+        self._product_ids = _U32Column(self.buf, self.products_off, PRODUCT.size, self.n_products)
+
+    def close(self):
+        self.buf.close()
+
+    def _key(self, off, length):
+        return self.buf[self.keys_off + off:self.keys_off + off + length]
+
+    def _cve(self, idx):
+        off, length = CVE.unpack_from(self.buf, self.cves_off + idx * CVE.size)
+        return self.buf[self.cve_blob_off + off:self.cve_blob_off + off + length].decode()
+
+    def _rules(self, product_id):
+        i = bisect_right(self._product_ids, product_id) - 1
+        if i < 0 or self._product_ids[i] != product_id:
+            return 0, 0
+        _, first, count = PRODUCT.unpack_from(self.buf, self.products_off + i * PRODUCT.size)
+        return first, count
+
+    def has_product(self, product_id):
+        return self._rules(product_id)[1] > 0
+
+    def affected(self, product_id, version):
+        """Returns the set of CVE ids affecting `product_id` at `version`.
+
+        `version` may be a string or a key from versions.version_key().
+        """
+        key = version if isinstance(version, bytes) else version_key(version)
+        first, count = self._rules(product_id)
+        if not count:
+            return set()
+
+        base = self.rules_off + first * RULE.size
+        # Binary search: last rule with lo <= key
+        lo_i, hi_i = 0, count
+        while lo_i < hi_i:
+            mid = (lo_i + hi_i) // 2
+            lo_off, lo_len = struct.unpack_from("<IH", self.buf, base + mid * RULE.size)
+            if self._key(lo_off, lo_len) <= key:
+                lo_i = mid + 1
+            else:
+                hi_i = mid
+
+        found = set()
+        for i in range(lo_i - 1, -1, -1):
+            _, _, hi_off, hi_len, max_off, max_len, flags, cve_idx = RULE.unpack_from(self.buf, base + i * RULE.size)
+            max_hi = self._key(max_off, max_len)
+            if max_hi < key or (max_hi == key and not flags & MAXHI_INCLUSIVE):
+                break  # nothing at or before i reaches this version
+            hi = self._key(hi_off, hi_len)
+            if hi > key or (hi == key and flags & HI_INCLUSIVE):
+                found.add(self._cve(cve_idx))
+        return found
+
+class _U32Column:
+    """Sequence view over the first u32 of fixed-size records, for bisect."""
+
+    def __init__(self, buf, offset, stride, count):
+        self.buf, self.offset, self.stride, self.count = buf, offset, stride, count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return struct.unpack_from("<I", self.buf, self.offset + i * self.stride)[0]
+
+if __name__ == "__main__":
+    usage = "Usage: rule_index.py compile <nvd.db> <out.idx> | lookup <index.idx> <product_id> <version>"
+    if len(sys.argv) == 4 and sys.argv[1] == "compile":
+        products, rules = compile_index(sys.argv[2], sys.argv[3])
+        print(f"✅ Compiled {rules} rules for {products} products into '{sys.argv[3]}'")
+    elif len(sys.argv) == 5 and sys.argv[1] == "lookup":
+        index = RuleIndex(sys.argv[2])
+        for cve_id in sorted(index.affected(int(sys.argv[3]), sys.argv[4])):
+            print(cve_id)
+    else:
+        print(usage)
+        sys.exit(1)
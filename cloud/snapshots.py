@@ -0,0 +1,291 @@
+"""
+Versioned, read-only NVD snapshots for the matching workers.
+
+The pull scripts keep writing their working database (nvd_robust.db).
+After a sync, `publish` turns it into an immutable snapshot: a
+compacted copy of the DB plus its compiled rules.idx and a manifest, in
+a versioned directory that appears by atomic rename. A `CURRENT` file,
+also replaced atomically, names the live version:
+
+    snapshots/
+        CURRENT                            -> "20261018T120000000000Z"
+        20261018T120000000000Z/  nvd.db  rules.idx  manifest.json
+
+Readers never see a half-written file and never contend for SQLite
+locks: snapshots are opened with `immutable=1` and memory-mapped, so
+every process matching from the same version shares its pages.
+SnapshotManager notices a new CURRENT and switches over; work that
+acquired the old version keeps it until released. An opened version
+holds a shared lock on its manifest, and prune leaves locked versions
+for a later publish, so no process loses files it still reads.
+
+    python cloud/snapshots.py publish nvd_robust.db snapshots/ [--keep 3]
+    python cloud/snapshots.py list snapshots/
+"""
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+import stat
+import sys
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no locks, prune deletes by age only
+    fcntl = None
+
+from matcher import Matcher
+from rule_index import compile_index
+
+CURRENT = "CURRENT"
+DB_NAME = "nvd.db"
+INDEX_NAME = "rules.idx"
+MANIFEST = "manifest.json"
+# Old versions kept next to the current one (readers may still hold them)
+KEEP = 3
+
+class SnapshotError(Exception):
+    """No usable snapshot published."""
+
+def _sync_state(conn):
+    try:
+        return dict(conn.execute("SELECT key, value FROM sync_state"))
+    except sqlite3.Error:
+        return {}
+
+def publish(db_path, directory, keep=KEEP):
+    """Publishes `db_path` as the new current snapshot. Returns its version."""
+    os.makedirs(directory, exist_ok=True)
+    version = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    staging = os.path.join(directory, f".{version}.tmp")
+    os.makedirs(staging)
+    try:
+        # VACUUM INTO: a consistent, compacted copy, even while a sync writes
+        src = sqlite3.connect(db_path)
+        src.execute("VACUUM INTO ?", (os.path.join(staging, DB_NAME),))
+        src.close()
+        # The manifest describes the copy, not whatever the source holds by now
+        dst = sqlite3.connect(os.path.join(staging, DB_NAME))
+        dst.execute("PRAGMA journal_mode = DELETE")  # immutable readers cannot use a WAL
+        state = _sync_state(dst)
+        counts = {table: dst.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in ("cves", "products", "vulnerability_rules")}
+        dst.close()
+
+        compile_index(os.path.join(staging, DB_NAME), os.path.join(staging, INDEX_NAME))
+        with open(os.path.join(staging, MANIFEST), "w") as f:
+            json.dump({"version": version, "source": os.path.abspath(db_path),
+                       "build_id": state.get("build_id"), "sync_seq": state.get("sync_seq"),
+                       "last_modified_sync": state.get("last_modified_sync"), **counts}, f, indent=2)
+
+        for name in (DB_NAME, INDEX_NAME, MANIFEST):
+            path = os.path.join(staging, name)
+            with open(path, "rb") as f:
+                os.fsync(f.fileno())
+            os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.rename(staging, os.path.join(directory, version))
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    pointer = os.path.join(directory, CURRENT + ".tmp")
+    with open(pointer, "w") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer, os.path.join(directory, CURRENT))
+    prune(directory, keep)
+    return version
+
+def versions(directory):
+    """Published versions, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory)
+                  if not name.startswith(".") and os.path.isfile(os.path.join(directory, name, MANIFEST)))
+
+def current_version(directory):
+    try:
+        with open(os.path.join(directory, CURRENT)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def current_paths(directory):
+    """(nvd.db, rules.idx) of the current snapshot."""
+    version = current_version(directory)
+    if version is None:
+        raise SnapshotError(f"no snapshot published in '{directory}'")
+    return os.path.join(directory, version, DB_NAME), os.path.join(directory, version, INDEX_NAME)
+
+def pin(path):
+    """Marks the version at `path` in use (until the returned file is
+    closed), so prune() leaves it alone."""
+    f = open(os.path.join(path, MANIFEST), "rb")
+    if fcntl:
+        fcntl.flock(f, fcntl.LOCK_SH)
+    return f
+
+def prune(directory, keep=KEEP):
+    """Deletes all but the current and `keep` newest older versions.
+    Versions some process still has open (see pin) are skipped; the next
+    publish retries them."""
+    current = current_version(directory)
+    older = [v for v in versions(directory) if v != current]
+    for version in older[:max(0, len(older) - keep)]:
+        path = os.path.join(directory, version)
+        try:
+            f = open(os.path.join(path, MANIFEST), "rb")
+        except FileNotFoundError:
+            continue
+        with f:
+            if fcntl:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+            # Deleted while holding the lock: a reader pinning it now waits,
+            # then finds the manifest gone
+            shutil.rmtree(path, ignore_errors=True)
+
+class Snapshot:
+    """One opened version. Reference counted: closed when the manager has
+    moved on and the last user released it.
+
+    Each thread gets its own Matcher (SQLite connection, resolver cache),
+    which are not safe to share. The files are memory-mapped, so extra
+    matchers share the snapshot's pages and only add their resolver. The
+    version is pinned while open, so threads that start matching late
+    still find its files."""
+
+    def __init__(self, directory, version):
+        self.version = version
+        path = os.path.join(directory, version)
+        self.db_path = os.path.join(path, DB_NAME)
+        self.index_path = os.path.join(path, INDEX_NAME)
+        self.pinned = pin(path)
+        if not os.path.exists(self.pinned.name):
+            self.pinned.close()
+            raise SnapshotError(f"snapshot {version} was pruned")
+        self.refs = 1
+        self.lock = threading.Lock()
+        self.matchers = []
+        self._local = threading.local()
+        # Opened now, so an unusable version is noticed before it goes live
+        try:
+            self.matcher
+        except Exception:
+            self.pinned.close()
+            raise
+
+    @property
+    def matcher(self):
+        """This thread's Matcher on the snapshot."""
+        matcher = getattr(self._local, "matcher", None)
+        if matcher is None:
+            matcher = self._local.matcher = Matcher(self.db_path, self.index_path, immutable=True)
+            with self.lock:
+                self.matchers.append(matcher)
+        return matcher
+
+    def acquire(self):
+        with self.lock:
+            self.refs += 1
+        return self
+
+    def release(self):
+        with self.lock:
+            self.refs -= 1
+            closing = self.refs == 0
+        if closing:
+            for matcher in self.matchers:
+                matcher.close()
+            self.pinned.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class SnapshotManager:
+    """
+    Hands out the current snapshot. CURRENT is re-read at most every
+    `check_interval` seconds; a new version is opened before the old one
+    is let go, so matching never pauses.
+
+        with manager.acquire() as snap:
+            snap.matcher.match_inventories(...)
+    """
+
+    def __init__(self, directory, check_interval=30):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.checked_at = 0.0
+        self.swaps = 0
+
+    def _refresh(self):
+        version = current_version(self.directory)
+        if version is None or (self.snapshot and self.snapshot.version == version):
+            return
+        try:
+            snapshot = Snapshot(self.directory, version)
+        except Exception as e:
+            if self.snapshot is None:
+                raise SnapshotError(f"cannot open snapshot {version}: {e}")
+            print(f"⚠️ Snapshot {version} unusable, staying on {self.snapshot.version}: {e}")
+            return
+        old, self.snapshot = self.snapshot, snapshot
+        if old:
+            self.swaps += 1
+            print(f"🔄 Matching switched to NVD snapshot {version} (was {old.version})")
+            old.release()
+
+    def acquire(self):
+        """The current Snapshot, held until released (or the `with` ends)."""
+        with self.lock:
+            now = time.monotonic()
+            if self.snapshot is None or now - self.checked_at >= self.check_interval:
+                self.checked_at = now
+                self._refresh()
+            if self.snapshot is None:
+                raise SnapshotError(f"no snapshot published in '{self.directory}'")
+            # Taken under the lock: a swap cannot release it in between
+            return self.snapshot.acquire()
+
+    def close(self):
+        with self.lock:
+            if self.snapshot:
+                self.snapshot.release()
+                self.snapshot = None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish and inspect NVD snapshots")
+    sub = parser.add_subparsers(dest="command", required=True)
+    pub = sub.add_parser("publish", help="Snapshot an NVD DB (with its compiled rule index) and make it current")
+    pub.add_argument("db")
+    pub.add_argument("directory")
+    pub.add_argument("--keep", type=int, default=KEEP, help="Older versions to keep (default: %(default)s)")
+    ls = sub.add_parser("list", help="Show published versions")
+    ls.add_argument("directory")
+    args = parser.parse_args()
+
+    if args.command == "publish":
+        started = time.perf_counter()
+        version = publish(args.db, args.directory, args.keep)
+        print(f"✅ Published snapshot {version} in {time.perf_counter() - started:.1f}s")
+    else:
+        current = current_version(args.directory)
+        for version in versions(args.directory):
+            with open(os.path.join(args.directory, version, MANIFEST)) as f:
+                manifest = json.load(f)
+            print(f"{'*' if version == current else ' '} {version}  {manifest.get('cves')} CVEs, "
+                  f"{manifest.get('vulnerability_rules')} rules, sync_seq {manifest.get('sync_seq')}")
+        if current is None:
+            sys.exit(1)
@@ -0,0 +1,268 @@
+"""
+Version strings -> comparable keys.
+
+A key is a byte string whose plain bytewise order is the version order,
+so keys can be sorted, binary searched and stored in a flat file
+(see rule_index.py) without any parsing at lookup time.
+
+version_key() is the generic (NVD / upstream) ordering. Segments are
+split into runs of digits and letters (separators are ignored), numbers
+compare numerically, letters sort below numbers, pre-release tags
+(alpha, beta, rc, dev, ...) and a '~' sort below the end of the version:
+
+    1.0.dev1 < 1.0-beta < 1.0~rc1 < 1.0 == 1.0.0 < 1.0a < 1.0.1 < 1.0.10
+
+Trailing zero components do not count (1.0 == 1.0.0, as NVD bounds use
+both). PEP 440's short pre-release spellings count as tags when a number
+follows (2.0b1 == 2.0-beta1 < 2.0); a lone trailing letter is still a
+later release (1.1.1a).
+
+Package managers order versions by their own rules. package_key() gives
+the exact ordering of one manager (dpkg, rpm, PEP 440) for comparing two
+installed versions of the same package. NVD bounds are upstream
+versions, so matching uses upstream_key() instead: it strips what the
+package manager added (epoch, distro revision, dfsg repacks, PEP 440
+spelling) and returns the version_key() of the rest. The rule index
+builds its bounds with version_key() too, so both sides are normalised
+the same way:
+
+    upstream_key("1:1.1.1f-1ubuntu2.16", "deb") == version_key("1.1.1f")
+    upstream_key("1:1.2.11.dfsg-2ubuntu9", "deb") == version_key("1.2.11")
+    upstream_key("2.0b1", "pip") == version_key("2.0b1")
+
+All keys are memoised; a fleet reports the same few thousand version
+strings over and over.
+"""
+import re
+from functools import lru_cache
+
+_TOKEN = re.compile(r"([0-9]+)|([a-zA-Z]+)|(~)")
+# 2.0b1, 1.0.a2, 3.1c1: a single a/b/c between numbers is a PEP 440 pre-release
+_SHORT_PRE = re.compile(r"(?<=[0-9])([-_.]?)([abc])(?=[0-9])", re.IGNORECASE)
+_SHORT_PRE_NAMES = {"a": "alpha", "b": "beta", "c": "rc"}
+
+# Marker bytes, in sort order
+TILDE = b"\x00"
+END = b"\x01"
+ALPHA = b"\x02"
+NUMERIC = b"\x03"
+
+# Sorts above every key: the upper bound of an open-ended range
+MAX_KEY = b"\xff"
+# Sorts below every key: the lower bound of a range with no start
+MIN_KEY = b""
+
+# Letter segments meaning "before the release", and their canonical spelling.
+# Other single letters are left alone: 1.1.1a is a *later* OpenSSL release.
+PRE_RELEASE = {
+    "alpha": "alpha", "beta": "beta", "rc": "rc", "cr": "rc",
+    "pre": "rc", "preview": "rc",
+}
+DEVELOPMENT = {"dev", "snapshot"}
+
+KEY_CACHE_SIZE = 65536
+
+def _number(digits):
+    digits = (digits.lstrip("0") or "0")[:255]
+    return bytes([len(digits)]) + digits.encode()
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def version_key(version):
+    """Returns the generic byte key for a version string."""
+    version = _SHORT_PRE.sub(lambda m: m.group(1) + _SHORT_PRE_NAMES[m.group(2).lower()], version)
+    segments = []
+    after_tilde = False
+    for number, alpha, tilde in _TOKEN.findall(version):
+        if number:
+            segment = NUMERIC + _number(number)
+        elif alpha:
+            alpha = alpha.lower()
+            if alpha in DEVELOPMENT:
+                segment = (TILDE if after_tilde else TILDE * 2) + ALPHA + b"dev\x00"
+            elif alpha in PRE_RELEASE:
+                segment = (b"" if after_tilde else TILDE) + ALPHA + PRE_RELEASE[alpha].encode() + b"\x00"
+            else:
+                segment = ALPHA + alpha.encode() + b"\x00"
+        else:
+            segment = TILDE
+        # 1.0.0 == 1.0, 1.0.0-rc1 == 1.0-rc1: zeros before the end or a pre-release tag
+        if segment.startswith(TILDE):
+            _drop_zeros(segments)
+        segments.append(segment)
+        after_tilde = bool(tilde)
+    _drop_zeros(segments)
+    return b"".join(segments) + END
+
+_ZERO = NUMERIC + _number("0")
+
+def _drop_zeros(segments):
+    while segments and segments[-1] == _ZERO:
+        segments.pop()
+
+# ==========================================
+# 📦 DPKG (epoch:upstream-revision)
+# ==========================================
+_DPKG_CHUNK = re.compile(r"([^0-9]*)([0-9]*)")
+
+def _dpkg_order(char):
+    # dpkg: '~' < end of string < letters < everything else
+    if char == "~":
+        return b"\x01"
+    if char.isalpha() and char.isascii():
+        return bytes([ord(char)])
+    return bytes([0x80 + min(ord(char), 0x7e)])
+
+def _dpkg_part(part):
+    out = bytearray()
+    if not part.strip("0"):
+        part = ""  # a missing revision equals "0"
+    for text, digits in _DPKG_CHUNK.findall(part):
+        if not text and not digits:
+            continue
+        out += b"".join(_dpkg_order(c) for c in text) + b"\x02"
+        out += _number(digits) if digits.strip("0") else b"\x00"
+    return bytes(out) + b"\x02"
+
+def _split_epoch(version):
+    epoch, sep, rest = version.partition(":")
+    if sep and epoch.isdigit():
+        return epoch, rest
+    return "0", version
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def dpkg_key(version):
+    """Byte key with dpkg --compare-versions ordering."""
+    epoch, rest = _split_epoch(version.strip())
+    upstream, sep, revision = rest.rpartition("-")
+    if not sep:
+        upstream, revision = rest, ""
+    return _number(epoch) + _dpkg_part(upstream) + _dpkg_part(revision)
+
+# ==========================================
+# 📦 RPM (epoch:version-release)
+# ==========================================
+_RPM_TOKEN = re.compile(r"([0-9]+)|([a-zA-Z]+)|(~)|(\^)")
+
+def _rpm_part(part):
+    # rpmvercmp: '~' < end < '^' < letters < numbers, other chars ignored
+    out = bytearray()
+    for number, alpha, tilde, caret in _RPM_TOKEN.findall(part):
+        if number:
+            out += b"\x04" + _number(number)
+        elif alpha:
+            out += b"\x03" + alpha.encode() + b"\x00"
+        elif tilde:
+            out += b"\x00"
+        else:
+            out += b"\x02"
+    return bytes(out) + b"\x01"
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def rpm_key(version):
+    """Byte key with rpmvercmp ordering."""
+    epoch, rest = _split_epoch(version.strip())
+    ver, sep, release = rest.rpartition("-")
+    if not sep:
+        ver, release = rest, ""
+    return _number(epoch) + _rpm_part(ver) + _rpm_part(release)
+
+# ==========================================
+# 🐍 PEP 440
+# ==========================================
+_PEP440 = re.compile(r"""
+    ^\s*v?
+    (?:(?P<epoch>[0-9]+)!)?
+    (?P<release>[0-9]+(?:\.[0-9]+)*)
+    (?:[-_.]?(?P<pre_l>alpha|a|beta|b|preview|pre|c|rc)[-_.]?(?P<pre_n>[0-9]+)?)?
+    (?:-(?P<post_n1>[0-9]+)|[-_.]?(?P<post_l>post|rev|r)[-_.]?(?P<post_n2>[0-9]+)?)?
+    (?:[-_.]?(?P<dev_l>dev)[-_.]?(?P<dev_n>[0-9]+)?)?
+    (?:\+(?P<local>[a-z0-9]+(?:[-_.][a-z0-9]+)*))?
+    \s*$""", re.VERBOSE | re.IGNORECASE)
+
+_PEP440_PRE = {"a": "alpha", "alpha": "alpha", "b": "beta", "beta": "beta",
+               "c": "rc", "rc": "rc", "pre": "rc", "preview": "rc"}
+_PEP440_RANK = {"alpha": 1, "beta": 2, "rc": 3}
+
+def _pep440(version):
+    m = _PEP440.match(version)
+    if not m:
+        return None
+    release = [int(n) for n in m.group("release").split(".")]
+    pre = None
+    if m.group("pre_l"):
+        pre = (_PEP440_PRE[m.group("pre_l").lower()], int(m.group("pre_n") or 0))
+    post = None
+    if m.group("post_n1") or m.group("post_l"):
+        post = int(m.group("post_n1") or m.group("post_n2") or 0)
+    dev = None
+    if m.group("dev_l"):
+        dev = int(m.group("dev_n") or 0)
+    return int(m.group("epoch") or 0), release, pre, post, dev, m.group("local")
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def pep440_key(version):
+    """Byte key with PEP 440 ordering. Non-PEP 440 versions sort first."""
+    parsed = _pep440(version)
+    if parsed is None:
+        return b"\x00" + version_key(version)
+    epoch, release, pre, post, dev, local = parsed
+    # 1.0 == 1.0.0
+    while len(release) > 1 and release[-1] == 0:
+        release.pop()
+
+    out = bytearray(b"\x01" + _number(str(epoch)))
+    for n in release:
+        out += b"\x01" + _number(str(n))
+    out += b"\x00"
+    # X.dev0 < X.a0 < X.a0.post0 < X < X.post0
+    if pre:
+        out += b"\x01" + bytes([_PEP440_RANK[pre[0]]]) + _number(str(pre[1]))
+    elif dev is not None and post is None:
+        out += b"\x00"
+    else:
+        out += b"\x02"
+    out += b"\x00" if post is None else b"\x01" + _number(str(post))
+    out += b"\x02" if dev is None else b"\x01" + _number(str(dev))
+    out += b"\x00" if not local else b"\x01" + version_key(local)
+    return bytes(out)
+
+# ==========================================
+# 🔀 DISPATCH
+# ==========================================
+PACKAGE_KEYS = {
+    "deb": dpkg_key,
+    "rpm": rpm_key,
+    "pip": pep440_key,
+}
+
+def package_key(version, manager=None):
+    """Key with the ordering of the package manager that reported `version`."""
+    return PACKAGE_KEYS.get(manager, version_key)(version)
+
+# "2.4.52+dfsg-1", "1.2.11.dfsg-2", "1.2.3~ds1", "5.4+really5.3"
+_DEB_REPACK = re.compile(r"[.+~](dfsg|ds|repack|debian|deb|ubuntu|nmu|build).*$", re.IGNORECASE)
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def upstream_key(version, manager=None):
+    """Version key comparable against NVD bounds (see version_key)."""
+    version = version.strip()
+    if manager in ("deb", "rpm"):
+        _, version = _split_epoch(version)
+        if "-" in version:
+            version = version.rsplit("-", 1)[0]
+        if manager == "deb":
+            if "+really" in version:
+                version = version.split("+really", 1)[1]
+            version = _DEB_REPACK.sub("", version)
+    elif manager == "pip":
+        parsed = _pep440(version)
+        if parsed:
+            _, release, pre, post, dev, _ = parsed
+            version = ".".join(map(str, release))
+            if pre:
+                version += f"-{pre[0]}{pre[1]}"
+            if post is not None:
+                version += f".post{post}"
+            if dev is not None:
+                version += f".dev{dev}"
+    return version_key(version)
@@ -0,0 +1,105 @@
+"""
+Benchmark: rows/sec of the old per-row save_to_db() vs the BulkLoader,
+serial and with parsing spread over worker processes.
+
+    python pull/bench_save.py --dump nvd_cache            # recorded API pages
+    python pull/bench_save.py --dump nvdcve-2.0-2023.json.gz
+    python pull/bench_save.py --cves 50000                # synthetic data
+    python pull/bench_save.py --cves 50000 --workers 8
+
+Both paths load the same items into a fresh temporary DB. Pages are read
+into memory first, so only parsing + writing is timed.
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+import build_nvd_db
+from build_nvd_db import BulkLoader, PARSE_WORKERS
+from fake_nvd_server import synthetic_cves
+from nvd_parse import parse_cve, parse_pages
+from feed_reader import iter_feed_pages
+
+PAGE_SIZE = 2000
+
+def load_pages(dump):
+    return [page for _, page in iter_feed_pages([dump], PAGE_SIZE)]
+
+# ------------------------------------------
+# Baseline: the previous row-at-a-time path
+# (default pragmas, indexes created up front)
+# ------------------------------------------
+def legacy_get_or_create_product(cursor, vendor, name, prod_type, cache):
+    key = (vendor, name)
+    if key in cache:
+        return cache[key]
+    cursor.execute("INSERT OR IGNORE INTO products (vendor, name, type) VALUES (?, ?, ?)", (vendor, name, prod_type))
+    if cursor.rowcount == 0:
+        cursor.execute("SELECT id FROM products WHERE vendor = ? AND name = ?", (vendor, name))
+        row = cursor.fetchone()
+        pid = row[0] if row else None
+    else:
+        pid = cursor.lastrowid
+    cache[key] = pid
+    return pid
+
+def legacy_save_to_db(conn, raw_cves, product_cache):
+    c = conn.cursor()
+    for item in raw_cves:
+        cve_row, rules = parse_cve(item)
+        c.execute("INSERT OR REPLACE INTO cves VALUES (?, ?, ?, ?, ?)", cve_row)
+        c.execute("DELETE FROM vulnerability_rules WHERE cve_id = ?", (cve_row[0],))
+        for vendor, name, ptype, v_start, v_end_ex, v_end_in in rules:
+            pid = legacy_get_or_create_product(c, vendor, name, ptype, product_cache)
+            c.execute('''INSERT INTO vulnerability_rules
+                         (cve_id, product_id, version_start, version_end_excl, version_end_incl)
+                         VALUES (?, ?, ?, ?, ?)''', (cve_row[0], pid, v_start, v_end_ex, v_end_in))
+    conn.commit()
+
+# ------------------------------------------
+def run(label, pages, bulk, workers=1):
+    with tempfile.TemporaryDirectory(prefix="vscanner_bench_") as tmp_dir:
+        build_nvd_db.DB_FILE = os.path.join(tmp_dir, "bench.db")
+        conn = build_nvd_db.setup_database()
+
+        started = time.perf_counter()
+        if bulk:
+            loader = BulkLoader(conn)
+            for _, (cve_rows, rules) in parse_pages(((None, page) for page in pages), workers):
+                loader.write(cve_rows, rules)
+            loader.finish()
+        else:
+            conn.execute('CREATE INDEX idx_prod_name ON products(name)')
+            conn.execute('CREATE INDEX idx_rules_prod ON vulnerability_rules(product_id)')
+            conn.execute('CREATE INDEX idx_rules_cve ON vulnerability_rules(cve_id)')
+            product_cache = {}
+            for page in pages:
+                legacy_save_to_db(conn, page, product_cache)
+        elapsed = time.perf_counter() - started
+
+        rows = sum(conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                   for t in ("cves", "vulnerability_rules", "products"))
+        conn.close()
+    print(f"   {label:<10} {rows:>9} rows in {elapsed:7.2f}s  →  {rows / elapsed:>10,.0f} rows/sec")
+    return rows / elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark NVD DB write paths")
+    parser.add_argument("--dump", help="Page cache dir or NVD JSON 2.0 file (.json / .json.gz)")
+    parser.add_argument("--cves", type=int, default=50000, help="Synthetic CVEs when no dump is given")
+    parser.add_argument("--workers", type=int, default=PARSE_WORKERS, help="Parser processes for the parallel run")
+    args = parser.parse_args()
+
+    if args.dump:
+        pages = load_pages(args.dump)
+    else:
+        items = synthetic_cves(args.cves, 3650)
+        pages = [items[i:i + PAGE_SIZE] for i in range(0, len(items), PAGE_SIZE)]
+
+    print(f"--- ⏱️ Loading {sum(len(p) for p in pages)} CVEs ({len(pages)} pages) ---")
+    before = run("per-row", pages, bulk=False)
+    after = run("bulk", pages, bulk=True)
+    parallel = run(f"bulk x{args.workers}", pages, bulk=True, workers=args.workers)
+    print(f"\n✅ Speedup: {after / before:.1f}x bulk, {parallel / before:.1f}x bulk + {args.workers} parser processes")
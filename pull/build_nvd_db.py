@@ -1,24 +1,34 @@
-import requests
-import json
-import time
+import argparse
+import os
+import sys
 import sqlite3
 import datetime
 from datetime import timedelta
 
+from nvd_fetch import fetch_all_data, fetch_modified_since, NVDFetchError
+from nvd_state import (setup_state_tables, get_high_water_mark, set_high_water_mark, utc_now, OVERLAP,
+                       finished_windows, mark_window_finished, clear_finished_windows,
+                       next_sync_seq, new_build_id, record_changed_products)
+from page_cache import PageCache, DEFAULT_CACHE_DIR
+from nvd_parse import parse_page, parse_pages
+from feed_reader import iter_feed_pages, FeedFormatError
+
 # ==========================================
 # ⚙️ CONFIGURATION
 # ==========================================
 # Your API Key (Highly Recommended to set this to avoid rate limits)
-NVD_API_KEY = None 
+NVD_API_KEY = os.environ.get("NVD_API_KEY")
 
 # Timeframe: 10 Years back
 DAYS_BACK = 3650
 DB_FILE = "nvd_robust.db" # Changed name to reflect new schema
 
-# API Limits
-# NIST allows 120 days max per request range
-MAX_RANGE_DAYS = 120 
-DELAY = 2.0 if NVD_API_KEY else 6.0
+# Parallel window downloads (default: 2 without a key, 6 with one).
+# Rate limiting follows NVD's quotas, see nvd_fetch.py
+FETCH_WORKERS = None
+
+# Processes parsing pages while this process writes the DB
+PARSE_WORKERS = max(1, (os.cpu_count() or 1) - 1)
 
 # ==========================================
 # 🗄️ DATABASE SETUP (ROBUST SCHEMA)
@@ -57,199 +67,239 @@ def setup_database():
                     FOREIGN KEY(product_id) REFERENCES products(id)
                 )''')
     
-    # Indexes for performance
-    c.execute('CREATE INDEX IF NOT EXISTS idx_prod_name ON products(name)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_rules_prod ON vulnerability_rules(product_id)')
+    # 4. Sync bookkeeping (high-water mark for incremental runs)
+    setup_state_tables(c)
+
+    # Indexes for performance. A fresh DB gets them after the bulk load
+    # instead (see BulkLoader), which is much faster than maintaining
+    # them row by row.
+    if c.execute("SELECT 1 FROM cves LIMIT 1").fetchone():
+        create_indexes(c)
     
     conn.commit()
     return conn
 
-# ==========================================
-# 📥 DOWNLOADER LOGIC (CHUNKED)
-# ==========================================
-def fetch_nvd_chunk(start_date, end_date):
-    """Downloads a specific 120-day window."""
-    base_url = "https://services.nvd.nist.gov/rest/json/cves/2.0"
-    headers = {"apiKey": NVD_API_KEY} if NVD_API_KEY else {}
-    fmt = "%Y-%m-%dT%H:%M:%S.000"
-    
-    params = {
-        "pubStartDate": start_date.strftime(fmt),
-        "pubEndDate": end_date.strftime(fmt),
-        "resultsPerPage": 2000,
-        "startIndex": 0
-    }
-
-    print(f"   Downloading window: {params['pubStartDate']} -> {params['pubEndDate']}")
-    
-    chunk_cves = []
-    
-    while True:
-        try:
-            response = requests.get(base_url, headers=headers, params=params, timeout=30)
-            
-            if response.status_code != 200:
-                print(f"   ❌ API Error {response.status_code}: {response.text}")
-                time.sleep(10) 
-                return []
-
-            data = response.json()
-            cves = data.get("vulnerabilities", [])
-            chunk_cves.extend(cves)
-            
-            total_results = data.get("totalResults", 0)
-            count = len(cves)
-            
-            if params["startIndex"] + count >= total_results or count == 0:
-                break 
-
-            params["startIndex"] += count
-            time.sleep(DELAY) 
-
-        except Exception as e:
-            print(f"   ❌ Network Error: {e}")
-            break
-
-    return chunk_cves
-
-def fetch_all_data(total_start_date, total_end_date):
-    """Loops through the 10-year range in 120-day chunks."""
-    all_data = []
-    current_start = total_start_date
-    
-    print(f"--- 📡 Connecting to NVD API (Chunking 10 years) ---")
-    
-    while current_start < total_end_date:
-        current_end = current_start + timedelta(days=MAX_RANGE_DAYS)
-        if current_end > total_end_date:
-            current_end = total_end_date
-            
-        cves = fetch_nvd_chunk(current_start, current_end)
-        all_data.extend(cves)
-        
-        current_start = current_end
-        print(f"   ✅ Chunk complete. Total collected so far: {len(all_data)}")
-        
-    return all_data
+def create_indexes(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_prod_name ON products(name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rules_prod ON vulnerability_rules(product_id)')
+
+    # A rule is unique per CVE, product and range, so re-runs can't grow the
+    # table. Leading with cve_id, it also serves the per-CVE replace.
+    # Older DBs may hold duplicates, which must go before the index can exist.
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_rules_unique'").fetchone()
+    if not exists:
+        removed = remove_duplicate_rules(cursor)
+        if removed:
+            print(f"   🧹 Removed {removed} duplicate rules")
+        cursor.execute('DROP INDEX IF EXISTS idx_rules_cve')
+        cursor.execute(f'CREATE UNIQUE INDEX idx_rules_unique ON vulnerability_rules({RULE_KEY})')
+
+# NULL never equals NULL in a UNIQUE index, so open range ends are keyed as ''
+RULE_KEY = "cve_id, product_id, IFNULL(version_start, ''), IFNULL(version_end_excl, ''), IFNULL(version_end_incl, '')"
+
+def remove_duplicate_rules(cursor):
+    """Keeps the oldest copy of every rule. Returns how many rows were deleted."""
+    cursor.execute(f'''DELETE FROM vulnerability_rules WHERE id NOT IN (
+                        SELECT MIN(id) FROM vulnerability_rules GROUP BY {RULE_KEY}
+                    )''')
+    return cursor.rowcount
+
+def compact_database(conn):
+    """Reclaims the space freed by removed duplicates."""
+    size_before = os.path.getsize(DB_FILE)
+    conn.execute("VACUUM")
+    size_after = os.path.getsize(DB_FILE)
+    print(f"✅ Compacted '{DB_FILE}': {size_before / 1e6:.1f}MB -> {size_after / 1e6:.1f}MB")
 
 # ==========================================
-# 💾 ROBUST PARSER & STORAGE
+# 💾 ROBUST STORAGE (BULK)
 # ==========================================
-def get_or_create_product(cursor, vendor, name, prod_type, cache):
-    """Helper to handle Product Normalization efficiently."""
-    key = (vendor, name)
-    if key in cache:
-        return cache[key]
-        
-    cursor.execute("INSERT OR IGNORE INTO products (vendor, name, type) VALUES (?, ?, ?)", (vendor, name, prod_type))
-    
-    # Get the ID (whether inserted or existed)
-    if cursor.rowcount == 0:
-        cursor.execute("SELECT id FROM products WHERE vendor = ? AND name = ?", (vendor, name))
-        row = cursor.fetchone()
-        pid = row[0] if row else None
-    else:
-        pid = cursor.lastrowid
-        
-    cache[key] = pid
-    return pid
+class BulkLoader:
+    """Batched writer: one executemany per table per page, product IDs
+    allocated in memory instead of INSERT + SELECT per new product.
 
-def save_to_db(conn, raw_cves):
-    print(f"\n--- 💾 Saving {len(raw_cves)} records to Robust Database ---")
-    c = conn.cursor()
-    product_cache = {} # Local cache for this batch speedup
-    count = 0
-    
-    for item in raw_cves:
-        cve = item['cve']
-        cve_id = cve['id']
-        
-        # --- 1. METADATA ---
-        desc = "No description"
-        if 'descriptions' in cve:
-            for d in cve['descriptions']:
-                if d['lang'] == 'en':
-                    desc = d['value']
-                    break
-        
-        score = 0.0
-        severity = "UNKNOWN"
-        metrics = cve.get('metrics', {})
-        
-        if 'cvssMetricV31' in metrics:
-            m = metrics['cvssMetricV31'][0]['cvssData']
-            score = m['baseScore']
-            severity = m['baseSeverity']
-        elif 'cvssMetricV30' in metrics:
-            m = metrics['cvssMetricV30'][0]['cvssData']
-            score = m['baseScore']
-            severity = m['baseSeverity']
-        elif 'cvssMetricV2' in metrics:
-            m = metrics['cvssMetricV2'][0]['cvssData']
-            score = m['baseScore']
-            severity = "MEDIUM" if score < 7 else "HIGH"
-
-        c.execute("INSERT OR REPLACE INTO cves VALUES (?, ?, ?, ?, ?)", 
-                  (cve_id, desc, severity, score, cve['published']))
-
-        # --- 2. CONFIGURATIONS (Version Ranges) ---
-        if 'configurations' in cve:
-            for config in cve['configurations']:
-                for node in config.get('nodes', []):
-                    # We only care about OR operators usually (match ANY)
-                    if node.get('operator') == 'OR': 
-                        for match in node.get('cpeMatch', []):
-                            if match.get('vulnerable'):
-                                cpe_str = match['criteria']
-                                
-                                # Parse CPE String: cpe:2.3:a:vendor:product:version:...
-                                parts = cpe_str.split(':')
-                                if len(parts) > 4:
-                                    vendor = parts[3]
-                                    name = parts[4]
-                                    ptype = parts[2]
-                                    
-                                    # Normalize Product
-                                    pid = get_or_create_product(c, vendor, name, ptype, product_cache)
-                                    
-                                    # Extract Critical Ranges
-                                    v_start = match.get('versionStartIncluding')
-                                    v_end_ex = match.get('versionEndExcluding')
-                                    v_end_in = match.get('versionEndIncluding')
-                                    
-                                    # Fallback: specific version in CPE if no range
-                                    if not (v_start or v_end_ex or v_end_in):
-                                        specific_ver = parts[5]
-                                        if specific_ver not in ('*', '-'):
-                                            v_end_in = specific_ver
-                                            v_start = specific_ver
-
-                                    # Insert Rule
-                                    c.execute('''INSERT INTO vulnerability_rules 
-                                                 (cve_id, product_id, version_start, version_end_excl, version_end_incl)
-                                                 VALUES (?, ?, ?, ?, ?)''', 
-                                              (cve_id, pid, v_start, v_end_ex, v_end_in))
-
-        count += 1
-        if count % 1000 == 0:
-            print(f"   Saved {count}...", end="\r")
+    On a fresh DB it also switches SQLite into build mode (WAL, no fsync,
+    big page cache) and leaves the indexes for finish(). On an existing
+    DB it records the products whose rules changed (see nvd_state.py).
+    """
 
-    conn.commit()
-    print(f"\n✅ Success! Robust Database ready at '{DB_FILE}'")
+    def __init__(self, conn):
+        self.conn = conn
+        self.products = {(vendor, name): pid for pid, vendor, name in conn.execute("SELECT id, vendor, name FROM products")}
+        self.next_product_id = max(self.products.values(), default=0) + 1
+        self.bulk = conn.execute("SELECT 1 FROM cves LIMIT 1").fetchone() is None
+        self.seen = set()
+
+        if self.bulk:
+            # Trades durability against power loss for speed; a crashed
+            # build is simply rerun (finished windows are checkpointed)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute("PRAGMA cache_size = -262144")  # 256MB
+            conn.execute("PRAGMA temp_store = MEMORY")
+            new_build_id(conn)
+            self.sync_seq = None
+        else:
+            self.sync_seq = next_sync_seq(conn)
+
+    def write(self, cve_rows, rules):
+        """Stores parsed rows and commits.
+
+        cve_rows: [(id, description, severity, cvss_score, published_date), ...]
+        rules:    [(cve_id, vendor, name, type, version_start, version_end_excl, version_end_incl), ...]
+        """
+        new_products = []
+        rule_rows = []
+        for cve_id, vendor, name, ptype, v_start, v_end_ex, v_end_in in rules:
+            pid = self.products.get((vendor, name))
+            if pid is None:
+                pid = self.products[(vendor, name)] = self.next_product_id
+                self.next_product_id += 1
+                new_products.append((pid, vendor, name, ptype))
+            rule_rows.append((cve_id, pid, v_start, v_end_ex, v_end_in))
+
+        c = self.conn.cursor()
+        c.executemany("INSERT INTO products (id, vendor, name, type) VALUES (?, ?, ?, ?)", new_products)
+        c.executemany("INSERT OR REPLACE INTO cves VALUES (?, ?, ?, ?, ?)", cve_rows)
+
+        # A modified CVE replaces its old rules (same transaction as the insert).
+        # During a bulk load only CVEs seen earlier in this run can have any.
+        if self.bulk:
+            replaced = [row[0] for row in cve_rows if row[0] in self.seen]
+            for i in range(0, len(replaced), 500):
+                chunk = replaced[i:i + 500]
+                c.execute(f"DELETE FROM vulnerability_rules WHERE cve_id IN ({','.join('?' * len(chunk))})", chunk)
+            self.seen.update(row[0] for row in cve_rows)
+        else:
+            # Products losing rules count as changed as much as those gaining them
+            changed = {pid for _, pid, _, _, _ in rule_rows}
+            cve_ids = [row[0] for row in cve_rows]
+            for i in range(0, len(cve_ids), 500):
+                chunk = cve_ids[i:i + 500]
+                changed.update(row[0] for row in c.execute(
+                    f"SELECT DISTINCT product_id FROM vulnerability_rules WHERE cve_id IN ({','.join('?' * len(chunk))})", chunk))
+            record_changed_products(c, changed, self.sync_seq)
+            c.executemany("DELETE FROM vulnerability_rules WHERE cve_id = ?", [(row[0],) for row in cve_rows])
+
+        # Upsert: a rule that is already stored is left as it is
+        c.executemany('''INSERT OR IGNORE INTO vulnerability_rules 
+                         (cve_id, product_id, version_start, version_end_excl, version_end_incl)
+                         VALUES (?, ?, ?, ?, ?)''', rule_rows)
+        self.conn.commit()
+
+    def finish(self):
+        """Builds the deferred indexes and restores safe settings."""
+        if not self.bulk:
+            return
+        print("   Building indexes...")
+        create_indexes(self.conn.cursor())
+        # The duplicate sweep opened a transaction; synchronous can't change inside one
+        self.conn.commit()
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.bulk = False
+
+def save_to_db(conn, raw_cves, loader=None):
+    """Parses one page of raw NVD items and commits it. Returns the number saved."""
+    loader = loader or BulkLoader(conn)
+    cve_rows, rules = parse_page(raw_cves)
+    loader.write(cve_rows, rules)
+    return len(cve_rows)
 
 # ==========================================
 # 🚀 MAIN
 # ==========================================
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the NVD vulnerability database")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only fetch CVEs modified since the last successful sync")
+    parser.add_argument("--offline", action="store_true",
+                        help="Rebuild from the local page cache only, without calling NVD")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="Where downloaded pages are kept (default: %(default)s)")
+    parser.add_argument("--import-feed", nargs="+", metavar="PATH",
+                        help="Load NVD JSON 2.0 feed files (.json/.json.gz) or page cache dirs, without calling NVD")
+    parser.add_argument("--compact", action="store_true",
+                        help="Remove duplicate rules, rebuild indexes and VACUUM, then exit")
+    parser.add_argument("--workers", type=int, default=PARSE_WORKERS,
+                        help="Parser processes; 1 parses in-process (default: %(default)s)")
+    parser.add_argument("--publish", metavar="DIR",
+                        help="After a successful sync, publish the DB as the current snapshot in DIR (see cloud/snapshots.py)")
+    args = parser.parse_args()
+    cache = PageCache(args.cache_dir)
+
     db_conn = setup_database()
+    if args.compact:
+        # Duplicates are already gone (setup_database); just give the space back
+        compact_database(db_conn)
+        db_conn.close()
+        sys.exit(0)
+
+    sync_started = utc_now()
+    since = get_high_water_mark(db_conn)
+    # What we commit is only as current as the oldest page it came from
+    data_as_of = sync_started
+
+    if args.import_feed:
+        print(f"--- 📦 Importing {len(args.import_feed)} feed(s) ---")
+        pages = iter_feed_pages(args.import_feed)
+    elif args.offline:
+        print(f"--- 📦 Offline rebuild from '{args.cache_dir}' ---")
+        pages = cache.iter_pages()
+    elif args.incremental and since:
+        # Delta: everything added or re-scored since the last run
+        print(f"--- 🔄 Incremental sync: changes since {since} UTC ---")
+        pages = fetch_modified_since(since - OVERLAP, sync_started, NVD_API_KEY, FETCH_WORKERS, cache,
+                                     cache_newer_than=since)
+    else:
+        if args.incremental:
+            print("--- ⚠️ No previous sync recorded, running a full build ---")
+        # Range: Now back to 10 years ago
+        end = datetime.datetime.now()
+        start = end - timedelta(days=DAYS_BACK)
+        # Skipped windows hold data as of their checkpoint's oldest page
+        finished = finished_windows(db_conn)
+        data_as_of = min([sync_started, *finished.values()])
+        pages = fetch_all_data(start, end, NVD_API_KEY, FETCH_WORKERS, cache, finished, cache_newer_than=since)
     
-    # Range: Now back to 10 years ago
-    end = datetime.datetime.now()
-    start = end - timedelta(days=DAYS_BACK)
-    
-    data = fetch_all_data(start, end)
-    
-    if data:
-        save_to_db(db_conn, data)
-    
-    db_conn.close()
\ No newline at end of file
+    # Stream: each page is parsed and committed as soon as it arrives
+    print(f"\n--- 💾 Saving records to Robust Database ---")
+    loader = BulkLoader(db_conn)
+    total = 0
+    try:
+        # Worker processes parse; this process is the only DB writer
+        for window, rows in parse_pages(pages, args.workers):
+            if rows is None:
+                # Every page of this window is committed: checkpoint it
+                data_as_of = min(data_as_of, window.fetched_at or data_as_of)
+                if window.closed:
+                    mark_window_finished(db_conn, window.key, window.fetched_at)
+                continue
+            cve_rows, rules = rows
+            loader.write(cve_rows, rules)
+            total += len(cve_rows)
+            print(f"   Saved {total}...")
+    except (NVDFetchError, FeedFormatError) as e:
+        # Pages committed so far are kept; only the failed window is missing
+        # and the high-water mark is not advanced, so the next run retries it
+        print(f"\n❌ Load failed: {e}")
+        loader.finish()
+        db_conn.close()
+        sys.exit(1)
+
+    loader.finish()
+    if not (args.offline or args.import_feed):
+        full_build = not (args.incremental and since)
+        if full_build:
+            clear_finished_windows(db_conn)
+        if data_as_of < sync_started:
+            print(f"   Used cached pages from {data_as_of:%Y-%m-%d %H:%M:%S} UTC: the next incremental sync starts there")
+        set_high_water_mark(db_conn, data_as_of)
+    print(f"\n✅ Success! Robust Database ready at '{DB_FILE}' ({total} records)")
+    db_conn.close()
+
+    if args.publish:
+        # Snapshots are the server's code; matching workers pick the new one up
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cloud"))
+        from snapshots import publish
+        version = publish(DB_FILE, args.publish)
+        print(f"✅ Published snapshot {version} to '{args.publish}'")
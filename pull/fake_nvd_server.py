@@ -0,0 +1,149 @@
+"""
+Local stand-in for the NVD CVE API 2.0, for exercising the pull scripts
+without touching services.nvd.nist.gov.
+
+    python pull/fake_nvd_server.py --cves 20000 --quota 5 --error-rate 0.05
+    NVD_BASE_URL=http://127.0.0.1:8088/rest/json/cves/2.0 python pull/build_nvd_db.py
+
+Serves synthetic CVEs (or a recorded dump via --dump) with real paging,
+pub/lastMod date filters, a rolling 30s quota answered with 403 like NVD,
+and optional random 503s.
+"""
+import argparse
+import datetime
+import gzip
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DATE_FMT = "%Y-%m-%dT%H:%M:%S.000"
+VENDORS = ["apache", "openssl", "linux", "microsoft", "google", "mozilla", "python", "nginx"]
+
+def synthetic_cves(count, days_back, seed=42):
+    rnd = random.Random(seed)
+    now = datetime.datetime.now()
+    items = []
+    for i in range(count):
+        published = now - datetime.timedelta(seconds=rnd.randint(0, days_back * 86400))
+        modified = published + datetime.timedelta(days=rnd.randint(0, 30))
+        vendor = rnd.choice(VENDORS)
+        product = f"{vendor}_product_{rnd.randint(1, 2000)}"
+        score = round(rnd.uniform(1, 10), 1)
+        # Real CVEs list several affected ranges, often across products
+        matches = []
+        for _ in range(rnd.randint(1, 12)):
+            major, minor = rnd.randint(0, 9), rnd.randint(0, 20)
+            target = product if rnd.random() < 0.7 else f"{vendor}_product_{rnd.randint(1, 2000)}"
+            matches.append({
+                "vulnerable": True,
+                "criteria": f"cpe:2.3:a:{vendor}:{target}:*:*:*:*:*:*:*:*",
+                "versionStartIncluding": f"{major}.{minor}.0",
+                "versionEndExcluding": f"{major}.{minor}.{rnd.randint(1, 30)}"})
+        items.append({"cve": {
+            "id": f"CVE-{published.year}-{100000 + i}",
+            "published": published.strftime(DATE_FMT),
+            "lastModified": min(modified, now).strftime(DATE_FMT),
+            "descriptions": [{"lang": "en", "value": f"Synthetic vulnerability {i} in {product}."}],
+            "metrics": {"cvssMetricV31": [{"cvssData": {
+                "baseScore": score,
+                "baseSeverity": "CRITICAL" if score >= 9 else "HIGH" if score >= 7 else "MEDIUM" if score >= 4 else "LOW"}}]},
+            "configurations": [{"nodes": [{"operator": "OR", "cpeMatch": matches}]}],
+        }})
+    return items
+
+def load_dump(path):
+    """Accepts an NVD JSON 2.0 file ({"vulnerabilities": [...]}), optionally gzip'd."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        return json.load(f)["vulnerabilities"]
+
+def parse_date(value):
+    return datetime.datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")
+
+class FakeNVD:
+    def __init__(self, items, quota=None, error_rate=0.0):
+        self.items = sorted(items, key=lambda i: i["cve"]["published"])
+        self.quota = quota
+        self.error_rate = error_rate
+        self.recent = deque()
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0}
+
+    def over_quota(self):
+        with self.lock:
+            now = time.monotonic()
+            while self.recent and now - self.recent[0] > 30:
+                self.recent.popleft()
+            self.stats["requests"] += 1
+            if self.quota and len(self.recent) >= self.quota:
+                self.stats["throttled"] += 1
+                return True
+            self.recent.append(now)
+            return False
+
+    def query(self, params):
+        def in_range(item, field, start_key, end_key):
+            if start_key not in params:
+                return True
+            value = parse_date(item["cve"][field])
+            return parse_date(params[start_key]) <= value <= parse_date(params[end_key])
+
+        matches = [i for i in self.items
+                   if in_range(i, "published", "pubStartDate", "pubEndDate")
+                   and in_range(i, "lastModified", "lastModStartDate", "lastModEndDate")]
+        start = int(params.get("startIndex", 0))
+        per_page = int(params.get("resultsPerPage", 2000))
+        return {
+            "resultsPerPage": per_page,
+            "startIndex": start,
+            "totalResults": len(matches),
+            "format": "NVD_CVE",
+            "version": "2.0",
+            "vulnerabilities": matches[start:start + per_page],
+        }
+
+def make_handler(nvd):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != "/rest/json/cves/2.0":
+                return self.reply(404, {"message": "not found"})
+            if nvd.over_quota():
+                return self.reply(403, {"message": "Rate limit exceeded"})
+            if random.random() < nvd.error_rate:
+                nvd.stats["errors"] += 1
+                return self.reply(503, {"message": "Service Unavailable"})
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            self.reply(200, nvd.query(params))
+
+        def reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, fmt, *args):
+            print(f"   [fake-nvd] {self.address_string()} {fmt % args}  {nvd.stats}")
+
+    return Handler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake NVD CVE API 2.0 server")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--cves", type=int, default=5000, help="Number of synthetic CVEs")
+    parser.add_argument("--days", type=int, default=3650, help="Spread synthetic CVEs over this many days")
+    parser.add_argument("--dump", help="Serve items from a recorded NVD JSON 2.0 file instead")
+    parser.add_argument("--quota", type=int, default=None, help="Requests per rolling 30s (5 = unkeyed NVD)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    items = load_dump(args.dump) if args.dump else synthetic_cves(args.cves, args.days)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(FakeNVD(items, args.quota, args.error_rate)))
+    print(f"🧪 Fake NVD serving {len(items)} CVEs on http://127.0.0.1:{args.port}/rest/json/cves/2.0")
+    server.serve_forever()
@@ -0,0 +1,101 @@
+"""
+Streaming reader for NVD JSON 2.0 data feeds (nvdcve-2.0-<year>.json.gz,
+nvdcve-2.0-modified.json.gz, ...) for air-gapped builds.
+
+The feeds are one big object holding a "vulnerabilities" array. Items are
+decoded one at a time from a rolling text buffer, so a multi-GB feed is
+never materialised in memory.
+"""
+import gzip
+import json
+import os
+
+from page_cache import PageCache
+
+CHUNK_SIZE = 1024 * 1024
+PAGE_SIZE = 2000
+# Largest single CVE item we are willing to buffer before calling it corrupt
+MAX_ITEM_SIZE = 64 * 1024 * 1024
+ARRAY_KEY = '"vulnerabilities"'
+
+class FeedFormatError(Exception):
+    """The file is not a readable NVD JSON 2.0 feed."""
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+def iter_feed_items(path):
+    """Yields each raw item ({"cve": {...}}) of one feed file."""
+    decoder = json.JSONDecoder()
+    with _open(path) as f:
+        buf = ""
+        pos = 0
+        eof = False
+
+        def refill():
+            nonlocal buf, pos, eof
+            chunk = f.read(CHUNK_SIZE)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            return not eof
+
+        # 1. Find the start of the "vulnerabilities" array
+        while True:
+            idx = buf.find(ARRAY_KEY, pos)
+            if idx >= 0:
+                bracket = buf.find("[", idx + len(ARRAY_KEY))
+                if bracket >= 0:
+                    pos = bracket + 1
+                    break
+                pos = idx
+            else:
+                pos = max(pos, len(buf) - len(ARRAY_KEY))
+            if not refill():
+                raise FeedFormatError(f"{path}: no '{ARRAY_KEY}' array found")
+
+        # 2. Decode items one by one
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buf):
+                if not refill():
+                    raise FeedFormatError(f"{path}: truncated feed")
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Item continues past the buffer: read more and retry
+                if len(buf) - pos > MAX_ITEM_SIZE:
+                    raise FeedFormatError(f"{path}: malformed item (over {MAX_ITEM_SIZE} bytes without a valid object)")
+                if not refill():
+                    raise FeedFormatError(f"{path}: truncated feed")
+                continue
+            pos = end
+            yield item
+
+def _feed_order(path):
+    # Yearly feeds first, then "modified"/"recent" so the newest data wins
+    name = os.path.basename(path)
+    return ("modified" in name or "recent" in name, name)
+
+def iter_feed_pages(paths, page_size=PAGE_SIZE):
+    """Yields (source, page) for feed files and/or API page cache dirs."""
+    for path in sorted(paths, key=_feed_order):
+        if os.path.isdir(path):
+            yield from PageCache(path).iter_pages()
+            continue
+
+        print(f"   Reading feed: {path}")
+        page = []
+        for item in iter_feed_items(path):
+            page.append(item)
+            if len(page) >= page_size:
+                yield path, page
+                page = []
+        if page:
+            yield path, page
@@ -0,0 +1,304 @@
+"""
+Shared NVD API downloader used by the pull scripts.
+
+Several date windows are downloaded at once over one pooled HTTP session.
+A token bucket keeps the whole process inside NVD's published rolling
+quota (5 requests per 30s without a key, 50 with one) and slows down
+further whenever the API pushes back with 403/429/503.
+
+Every page can be kept in a PageCache (see page_cache.py), which lets an
+interrupted run resume where it stopped. Each finished window reports
+when its oldest page was downloaded, so the caller knows how current the
+data it committed is.
+
+Point NVD_BASE_URL at `fake_nvd_server.py` to exercise it locally.
+"""
+import os
+import queue
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ==========================================
+# ⚙️ CONFIGURATION
+# ==========================================
+NVD_URL = os.environ.get("NVD_BASE_URL", "https://services.nvd.nist.gov/rest/json/cves/2.0")
+DATE_FMT = "%Y-%m-%dT%H:%M:%S.000"
+
+# NIST allows 120 days max per request range
+MAX_RANGE_DAYS = 120
+RESULTS_PER_PAGE = 2000
+
+# Full-build windows are aligned to this date so their keys are stable
+GRID_EPOCH = datetime(2000, 1, 1)
+
+# Published quotas: requests per rolling 30 second window
+QUOTA_WINDOW = 30.0
+QUOTA_NO_KEY = 5
+QUOTA_WITH_KEY = 50
+
+# Retry policy for throttling / transient server errors
+MAX_RETRIES = 6
+RETRY_STATUS = (403, 429, 500, 502, 503, 504)
+MAX_BACKOFF = 120
+
+class NVDFetchError(Exception):
+    """A window could not be downloaded, even after retrying."""
+
+class FetchStopped(Exception):
+    """The download was abandoned (the consumer stopped or another window failed)."""
+
+# ==========================================
+# 🪣 RATE LIMITER
+# ==========================================
+class TokenBucket:
+    """Thread-safe token bucket sized so no rolling window exceeds `quota`."""
+
+    def __init__(self, quota, period=QUOTA_WINDOW, burst=None):
+        # A full bucket plus one period of refill must stay within the quota
+        self.capacity = burst or max(1, quota // 5)
+        self.base_rate = (quota - self.capacity) / period
+        self.rate = self.base_rate
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, stop=None):
+        """Blocks until a request may be sent. Returns False instead if the
+        `stop` event is set while waiting."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait_for = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            if stop is None:
+                time.sleep(wait_for)
+            elif stop.wait(wait_for):
+                return False
+
+    def penalize(self, retry_after=None):
+        """The server pushed back: drain the bucket and halve the refill rate."""
+        with self.lock:
+            self.tokens = 0.0
+            self.rate = max(self.base_rate / 16, self.rate / 2)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def reward(self):
+        """A request succeeded: creep back towards the published rate."""
+        with self.lock:
+            self.rate = min(self.base_rate, self.rate + self.base_rate / 10)
+
+# ==========================================
+# 📥 DOWNLOADER
+# ==========================================
+# A date window to download. `key` names it in the page cache and the
+# checkpoint table; only `closed` windows (whose end is in the past and
+# fixed) are ever checkpointed. `fetched_at` is set on the end-of-window
+# marker: when the window's oldest page was downloaded (naive UTC).
+Window = namedtuple("Window", ["key", "params", "closed", "fetched_at"], defaults=(None,))
+
+def make_window(field, start, end, closed=False):
+    key = f"{field}_{start:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}"
+    params = {f"{field}StartDate": start.strftime(DATE_FMT), f"{field}EndDate": end.strftime(DATE_FMT)}
+    return Window(key, params, closed)
+
+def date_windows(total_start_date, total_end_date, days=MAX_RANGE_DAYS):
+    """Splits a date range into consecutive windows of at most `days`."""
+    windows = []
+    current_start = total_start_date
+    while current_start < total_end_date:
+        current_end = min(current_start + timedelta(days=days), total_end_date)
+        windows.append((current_start, current_end))
+        current_start = current_end
+    return windows
+
+def grid_windows(total_start_date, total_end_date, days=MAX_RANGE_DAYS):
+    """Like date_windows, but snapped to a fixed grid so reruns produce the
+    same window keys. Only the last window (cut off at `total_end_date`) is
+    left open."""
+    step = timedelta(days=days)
+    current_start = GRID_EPOCH + step * ((total_start_date - GRID_EPOCH) // step)
+    windows = []
+    while current_start < total_end_date:
+        grid_end = current_start + step
+        windows.append((current_start, min(grid_end, total_end_date), grid_end <= total_end_date))
+        current_start = grid_end
+    return windows
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+def _utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class NVDFetcher:
+    """
+    Cached pages downloaded before `cache_newer_than` (normally the last
+    sync's high-water mark) are ignored and fetched again.
+    """
+
+    def __init__(self, api_key=None, workers=None, base_url=NVD_URL, cache=None, cache_newer_than=None):
+        self.base_url = base_url
+        self.cache = cache
+        self.cache_newer_than = cache_newer_than
+        self.headers = {"apiKey": api_key} if api_key else {}
+        self.bucket = TokenBucket(QUOTA_WITH_KEY if api_key else QUOTA_NO_KEY)
+        self.workers = workers or (6 if api_key else 2)
+
+        # One keep-alive pool shared by every worker thread
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get_page(self, params, stop=None):
+        """Fetches one page, backing off on throttling instead of giving up.
+        Raises FetchStopped as soon as `stop` is set."""
+        for attempt in range(MAX_RETRIES):
+            if not self.bucket.acquire(stop):
+                raise FetchStopped()
+            retry_after = None
+            try:
+                response = self.session.get(self.base_url, headers=self.headers, params=params, timeout=60)
+            except requests.RequestException as e:
+                error = f"Network Error: {e}"
+            else:
+                if response.status_code == 200:
+                    self.bucket.reward()
+                    return response.json()
+                if response.status_code not in RETRY_STATUS:
+                    raise NVDFetchError(f"API Error {response.status_code}: {response.text[:200]}")
+                error = f"API Error {response.status_code}"
+                retry_after = _retry_after(response)
+                self.bucket.penalize(retry_after)
+
+            delay = retry_after or min(MAX_BACKOFF, 3 * 2 ** attempt) * random.uniform(0.5, 1.5)
+            print(f"   ⚠️ {error} (attempt {attempt + 1}/{MAX_RETRIES}), retrying in {delay:.0f}s")
+            if stop is None:
+                time.sleep(delay)
+            elif stop.wait(delay):
+                raise FetchStopped()
+
+        raise NVDFetchError(f"Giving up on startIndex={params.get('startIndex')} after {MAX_RETRIES} attempts")
+
+    def fetch_window(self, window, stop=None):
+        """Yields (page, fetched_at) for every page of one window, following
+        startIndex.
+
+        Pages already in the cache are read from disk, so an interrupted
+        window resumes at the first page it never finished.
+        """
+        params = dict(window.params, resultsPerPage=RESULTS_PER_PAGE, startIndex=0)
+        while True:
+            if stop is not None and stop.is_set():
+                raise FetchStopped()
+            data = None
+            if self.cache:
+                data = self.cache.load(window.key, params["startIndex"], self.cache_newer_than)
+                fetched_at = self.cache.fetched_at(window.key, params["startIndex"])
+            if data is None:
+                fetched_at = _utc_now()
+                data = self.get_page(params, stop)
+                if self.cache:
+                    self.cache.save(window.key, params["startIndex"], data)
+            cves = data.get("vulnerabilities", [])
+            if cves:
+                yield cves, fetched_at
+
+            if params["startIndex"] + len(cves) >= data.get("totalResults", 0) or not cves:
+                return
+            params["startIndex"] += len(cves)
+
+    def fetch_windows(self, windows):
+        """Downloads several windows at once, yielding (window, page) in arrival order.
+
+        After a window's last page comes (window, None), so the caller can
+        checkpoint it once everything before it is committed; that window
+        carries `fetched_at`. Pages pass
+        through a small bounded queue, so memory stays flat no matter how
+        fast the consumer writes. Once the consumer stops (or a window
+        fails), windows not yet started are dropped and running ones give
+        up before their next request.
+        """
+        pages = queue.Queue(maxsize=self.workers * 2)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def worker(window):
+            if stop.is_set():
+                return
+            print(f"   Downloading window: {' -> '.join(window.params.values())}")
+            oldest = None
+            try:
+                for page, fetched_at in self.fetch_window(window, stop):
+                    oldest = min(oldest or fetched_at, fetched_at)
+                    if not put((window, page)):
+                        return
+                put((window._replace(fetched_at=oldest or _utc_now()), None))
+            except FetchStopped:
+                pass
+            except Exception as e:
+                put(e)
+
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        futures = [pool.submit(worker, window) for window in windows]
+        threading.Thread(target=lambda: (wait(futures), put(done)), daemon=True).start()
+        try:
+            while True:
+                item = pages.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Release workers blocked on a full queue or the rate limiter,
+            # and drop the windows that never started
+            stop.set()
+            pool.shutdown(wait=True, cancel_futures=True)
+
+def fetch_all_data(total_start_date, total_end_date, api_key=None, workers=None,
+                   cache=None, finished=(), cache_newer_than=None):
+    """Yields (window, page) for CVEs published in the range, several windows at a time.
+
+    Windows whose key is in `finished` (already checkpointed) are skipped.
+    """
+    print(f"--- 📡 Connecting to NVD API ({NVD_URL}) ---")
+    windows = [make_window("pub", s, e, closed) for s, e, closed in grid_windows(total_start_date, total_end_date)]
+    pending = [w for w in windows if w.key not in finished]
+    if len(pending) < len(windows):
+        print(f"   ⏭️ Skipping {len(windows) - len(pending)} finished windows")
+    return NVDFetcher(api_key, workers, cache=cache, cache_newer_than=cache_newer_than).fetch_windows(pending)
+
+def fetch_modified_since(since, until, api_key=None, workers=None, cache=None, cache_newer_than=None):
+    """Yields (window, page) for CVEs added or changed between `since` and `until`."""
+    print(f"--- 📡 Connecting to NVD API ({NVD_URL}) ---")
+    windows = [make_window("lastMod", s, e) for s, e in date_windows(since, until)]
+    return NVDFetcher(api_key, workers, cache=cache, cache_newer_than=cache_newer_than).fetch_windows(windows)
@@ -0,0 +1,116 @@
+"""
+Pure parsing of raw NVD CVE items into row tuples.
+
+Kept free of any DB access so every loader (API sync, offline feeds,
+worker processes) extracts CVSS and CPE ranges exactly the same way.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+def parse_cve(item):
+    """Returns (cve_row, rules) for one raw NVD item.
+
+    cve_row: (id, description, severity, cvss_score, published_date)
+    rules:   [(vendor, name, type, version_start, version_end_excl, version_end_incl), ...]
+    """
+    cve = item['cve']
+    cve_id = cve['id']
+
+    # --- 1. METADATA ---
+    desc = "No description"
+    if 'descriptions' in cve:
+        for d in cve['descriptions']:
+            if d['lang'] == 'en':
+                desc = d['value']
+                break
+
+    score = 0.0
+    severity = "UNKNOWN"
+    metrics = cve.get('metrics', {})
+
+    if 'cvssMetricV31' in metrics:
+        m = metrics['cvssMetricV31'][0]['cvssData']
+        score = m['baseScore']
+        severity = m['baseSeverity']
+    elif 'cvssMetricV30' in metrics:
+        m = metrics['cvssMetricV30'][0]['cvssData']
+        score = m['baseScore']
+        severity = m['baseSeverity']
+    elif 'cvssMetricV2' in metrics:
+        m = metrics['cvssMetricV2'][0]['cvssData']
+        score = m['baseScore']
+        severity = "MEDIUM" if score < 7 else "HIGH"
+
+    cve_row = (cve_id, desc, severity, score, cve['published'])
+
+    # --- 2. CONFIGURATIONS (Version Ranges) ---
+    rules = []
+    for config in cve.get('configurations', []):
+        for node in config.get('nodes', []):
+            # We only care about OR operators usually (match ANY)
+            if node.get('operator') != 'OR':
+                continue
+            for match in node.get('cpeMatch', []):
+                if not match.get('vulnerable'):
+                    continue
+
+                # Parse CPE String: cpe:2.3:a:vendor:product:version:...
+                parts = match['criteria'].split(':')
+                if len(parts) <= 4:
+                    continue
+                ptype, vendor, name = parts[2], parts[3], parts[4]
+
+                # Extract Critical Ranges
+                v_start = match.get('versionStartIncluding')
+                v_end_ex = match.get('versionEndExcluding')
+                v_end_in = match.get('versionEndIncluding')
+
+                # Fallback: specific version in CPE if no range
+                if not (v_start or v_end_ex or v_end_in) and len(parts) > 5:
+                    specific_ver = parts[5]
+                    if specific_ver not in ('*', '-'):
+                        v_end_in = specific_ver
+                        v_start = specific_ver
+
+                rules.append((vendor, name, ptype, v_start, v_end_ex, v_end_in))
+
+    return cve_row, rules
+
+def parse_page(raw_cves):
+    """Parses one page into compact rows for the writer.
+
+    Returns (cve_rows, rules) with each rule prefixed by its cve_id:
+    (cve_id, vendor, name, type, version_start, version_end_excl, version_end_incl)
+    """
+    cve_rows = []
+    rules = []
+    for item in raw_cves:
+        cve_row, cve_rules = parse_cve(item)
+        cve_rows.append(cve_row)
+        rules.extend((cve_row[0],) + rule for rule in cve_rules)
+    return cve_rows, rules
+
+def parse_pages(pages, workers):
+    """Parses (source, page) pairs across a process pool.
+
+    Yields (source, (cve_rows, rules)) in input order, so the single
+    writer sees pages exactly as a serial run would. A None page (end of
+    window marker) passes through as None. With workers <= 1 everything
+    runs in-process.
+    """
+    if workers <= 1:
+        for source, page in pages:
+            yield source, (parse_page(page) if page is not None else None)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for source, page in pages:
+            pending.append((source, pool.submit(parse_page, page) if page is not None else None))
+            # Bounded read-ahead keeps memory flat
+            while len(pending) > workers * 2:
+                done_source, future = pending.popleft()
+                yield done_source, (future.result() if future else None)
+        while pending:
+            done_source, future = pending.popleft()
+            yield done_source, (future.result() if future else None)
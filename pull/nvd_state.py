@@ -0,0 +1,96 @@
+"""
+Sync bookkeeping stored next to the data in the NVD database.
+
+The high-water mark is the (UTC) time the last successful sync started.
+An incremental run asks NVD for everything modified since then.
+
+The checkpoint table lists download windows whose pages are all
+committed, so a rerun after a crash skips them. Each records when its
+oldest page was downloaded: a build that reuses cached pages or skips
+finished windows only knows NVD as of then, so that, not the start of
+the run, becomes the high-water mark. A successful full build clears the
+checkpoints.
+
+Incremental runs also record which products had rules added or removed
+(`changed_products`, stamped with the run's sequence number), so the
+server can re-match only the packages that resolve to them. A fresh
+build gets a new build id instead: product ids may have been renumbered.
+"""
+import datetime
+import uuid
+
+HIGH_WATER_MARK = "last_modified_sync"
+SYNC_SEQ = "sync_seq"
+BUILD_ID = "build_id"
+STATE_FMT = "%Y-%m-%dT%H:%M:%S"
+
+# Re-fetch a little before the mark, in case NVD published late edits
+OVERLAP = datetime.timedelta(minutes=15)
+
+def setup_state_tables(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS sync_state (
+                        key TEXT PRIMARY KEY,
+                        value TEXT
+                    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS sync_windows (
+                        window_key TEXT PRIMARY KEY,
+                        finished_at TEXT,
+                        fetched_at TEXT
+                    )''')
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(sync_windows)")}
+    if "fetched_at" not in columns:
+        # Older checkpoints don't say how old their pages were; see finished_windows()
+        cursor.execute("ALTER TABLE sync_windows ADD COLUMN fetched_at TEXT")
+    cursor.execute('''CREATE TABLE IF NOT EXISTS changed_products (
+                        product_id INTEGER PRIMARY KEY,
+                        sync_seq INTEGER
+                    )''')
+
+def utc_now():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def get_high_water_mark(conn):
+    """Returns the start time of the last successful sync, or None."""
+    row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (HIGH_WATER_MARK,)).fetchone()
+    if not row:
+        return None
+    return datetime.datetime.strptime(row[0], STATE_FMT)
+
+def set_high_water_mark(conn, sync_started):
+    conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)",
+                 (HIGH_WATER_MARK, sync_started.strftime(STATE_FMT)))
+    conn.commit()
+
+def finished_windows(conn):
+    """Returns {window_key: when its oldest page was downloaded}. Windows
+    checkpointed without that time are left out, so they are fetched again."""
+    return {key: datetime.datetime.strptime(fetched_at, STATE_FMT) for key, fetched_at in
+            conn.execute("SELECT window_key, fetched_at FROM sync_windows WHERE fetched_at IS NOT NULL")}
+
+def mark_window_finished(conn, window_key, fetched_at):
+    conn.execute("INSERT OR REPLACE INTO sync_windows (window_key, finished_at, fetched_at) VALUES (?, ?, ?)",
+                 (window_key, utc_now().strftime(STATE_FMT), fetched_at.strftime(STATE_FMT)))
+    conn.commit()
+
+def clear_finished_windows(conn):
+    """After a successful full build: the next one starts from scratch."""
+    conn.execute("DELETE FROM sync_windows")
+    conn.commit()
+
+def next_sync_seq(conn):
+    """Starts an incremental run: returns its (new) sequence number."""
+    row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (SYNC_SEQ,)).fetchone()
+    seq = int(row[0]) + 1 if row else 1
+    conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (SYNC_SEQ, str(seq)))
+    conn.commit()
+    return seq
+
+def new_build_id(conn):
+    """Starts a fresh build: earlier change records no longer apply."""
+    conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (BUILD_ID, uuid.uuid4().hex))
+    conn.execute("DELETE FROM changed_products")
+    conn.commit()
+
+def record_changed_products(cursor, product_ids, seq):
+    cursor.executemany("INSERT OR REPLACE INTO changed_products (product_id, sync_seq) VALUES (?, ?)",
+                       [(pid, seq) for pid in product_ids])
@@ -1,24 +1,28 @@
-import requests
-import json
-import time
+import argparse
+import os
+import sys
 import sqlite3
 import datetime
 from datetime import timedelta
 
+from nvd_fetch import fetch_all_data, fetch_modified_since, NVDFetchError
+from nvd_state import (setup_state_tables, get_high_water_mark, set_high_water_mark, utc_now, OVERLAP,
+                       finished_windows, mark_window_finished, clear_finished_windows)
+from page_cache import PageCache, DEFAULT_CACHE_DIR
+
 # ==========================================
 # ⚙️ CONFIGURATION
 # ==========================================
 # Your API Key
-NVD_API_KEY = None 
+NVD_API_KEY = os.environ.get("NVD_API_KEY")
 
 # Timeframe: 10 Years back
 DAYS_BACK = 3650
 DB_FILE = "vulnerabilities.db"
 
-# API Limits
-# NIST allows 120 days max per request range
-MAX_RANGE_DAYS = 120 
-DELAY = 2.0 if NVD_API_KEY else 6.0
+# Parallel window downloads (default: 2 without a key, 6 with one).
+# Rate limiting follows NVD's quotas, see nvd_fetch.py
+FETCH_WORKERS = None
 
 # ==========================================
 # 🗄️ DATABASE SETUP
@@ -39,93 +43,38 @@ def setup_database():
                     FOREIGN KEY(cve_id) REFERENCES cves(id)
                 )''')
     c.execute('CREATE INDEX IF NOT EXISTS idx_cpe ON cpe_matches (cpe_string)')
+    create_unique_index(c)
+    setup_state_tables(c)
     conn.commit()
     return conn
 
-# ==========================================
-# 📥 DOWNLOADER LOGIC (CHUNKED)
-# ==========================================
-def fetch_nvd_chunk(start_date, end_date):
-    """Downloads a specific 120-day window."""
-    base_url = "https://services.nvd.nist.gov/rest/json/cves/2.0"
-    headers = {"apiKey": NVD_API_KEY} if NVD_API_KEY else {}
-    fmt = "%Y-%m-%dT%H:%M:%S.000"
-    
-    params = {
-        "pubStartDate": start_date.strftime(fmt),
-        "pubEndDate": end_date.strftime(fmt),
-        "resultsPerPage": 2000,
-        "startIndex": 0
-    }
-
-    print(f"   Downloading window: {params['pubStartDate']} -> {params['pubEndDate']}")
-    
-    chunk_cves = []
-    
-    while True:
-        try:
-            response = requests.get(base_url, headers=headers, params=params, timeout=30)
-            
-            if response.status_code != 200:
-                print(f"   ❌ API Error {response.status_code}: {response.text}")
-                # If we hit an error, pause and retry or skip
-                time.sleep(10) 
-                return []
-
-            data = response.json()
-            cves = data.get("vulnerabilities", [])
-            chunk_cves.extend(cves)
-            
-            total_results = data.get("totalResults", 0)
-            count = len(cves)
-            
-            # Check if we got everything in this window
-            if params["startIndex"] + count >= total_results or count == 0:
-                break 
-
-            # Next page within this window
-            params["startIndex"] += count
-            time.sleep(DELAY) # Rate limit
-
-        except Exception as e:
-            print(f"   ❌ Network Error: {e}")
-            break
-
-    return chunk_cves
-
-def fetch_all_data(total_start_date, total_end_date):
-    """Loops through the 10-year range in 120-day chunks."""
-    all_data = []
-    current_start = total_start_date
-    
-    print(f"--- 📡 Connecting to NVD API (Chunking 10 years) ---")
-    
-    while current_start < total_end_date:
-        # Calculate the end of this chunk (start + 120 days)
-        current_end = current_start + timedelta(days=MAX_RANGE_DAYS)
-        
-        # Don't go past the present
-        if current_end > total_end_date:
-            current_end = total_end_date
-            
-        # Fetch this chunk
-        cves = fetch_nvd_chunk(current_start, current_end)
-        all_data.extend(cves)
-        
-        # Move forward
-        current_start = current_end
-        
-        print(f"   ✅ Chunk complete. Total collected so far: {len(all_data)}")
-        # Save incrementally or just keep in memory (Memory might get high for 10y)
-        # Ideally, we yield here, but list extend is okay for ~200k items (approx 500MB RAM)
-        
-    return all_data
+def create_unique_index(cursor):
+    # One row per (CVE, CPE): re-runs can't grow the table. Leading with
+    # cve_id, it also serves the per-CVE replace. Older DBs may hold
+    # duplicates, which must go before the index can exist.
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_cpe_unique'").fetchone()
+    if exists:
+        return
+    cursor.execute('''DELETE FROM cpe_matches WHERE rowid NOT IN (
+                        SELECT MIN(rowid) FROM cpe_matches GROUP BY cve_id, cpe_string
+                    )''')
+    if cursor.rowcount:
+        print(f"   🧹 Removed {cursor.rowcount} duplicate CPE matches")
+    cursor.execute('DROP INDEX IF EXISTS idx_cpe_cve')
+    cursor.execute('CREATE UNIQUE INDEX idx_cpe_unique ON cpe_matches (cve_id, cpe_string)')
+
+def compact_database(conn):
+    """Reclaims the space freed by removed duplicates."""
+    size_before = os.path.getsize(DB_FILE)
+    conn.execute("VACUUM")
+    size_after = os.path.getsize(DB_FILE)
+    print(f"✅ Compacted '{DB_FILE}': {size_before / 1e6:.1f}MB -> {size_after / 1e6:.1f}MB")
 
 # ==========================================
 # 💾 PARSER & STORAGE LOGIC
 # ==========================================
 def save_to_db(conn, raw_cves):
-    print(f"\n--- 💾 Saving {len(raw_cves)} records to Database ---")
+    """Parses one page of raw NVD items and commits it. Returns the number saved."""
     c = conn.cursor()
     count = 0
     
@@ -165,6 +114,9 @@ def save_to_db(conn, raw_cves):
         except sqlite3.Error:
             pass
 
+        # A modified CVE replaces its old matches (same transaction as the insert)
+        c.execute("DELETE FROM cpe_matches WHERE cve_id = ?", (cve_id,))
+
         # CPEs
         if 'configurations' in cve:
             for config in cve['configurations']:
@@ -172,30 +124,89 @@ def save_to_db(conn, raw_cves):
                     for match in node.get('cpeMatch', []):
                         if match.get('vulnerable'):
                             cpe_str = match['criteria']
-                            c.execute("INSERT INTO cpe_matches VALUES (?, ?)", (cve_id, cpe_str))
+                            c.execute("INSERT OR IGNORE INTO cpe_matches VALUES (?, ?)", (cve_id, cpe_str))
 
         count += 1
-        if count % 1000 == 0:
-            print(f"   Saved {count}...", end="\r")
 
+    # Commit per page: a failure later in the run keeps everything saved so far
     conn.commit()
-    print(f"\n✅ Success! Database ready at '{DB_FILE}'")
+    return count
 
 # ==========================================
 # 🚀 MAIN
 # ==========================================
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync CVEs from the NVD API")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only fetch CVEs modified since the last successful sync")
+    parser.add_argument("--offline", action="store_true",
+                        help="Rebuild from the local page cache only, without calling NVD")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="Where downloaded pages are kept (default: %(default)s)")
+    parser.add_argument("--compact", action="store_true",
+                        help="Remove duplicate CPE matches and VACUUM, then exit")
+    args = parser.parse_args()
+    cache = PageCache(args.cache_dir)
+
     db_conn = setup_database()
-    
-    # Range: Now back to 10 years ago
-    end = datetime.datetime.now()
-    start = end - timedelta(days=DAYS_BACK)
+    if args.compact:
+        # Duplicates are already gone (setup_database); just give the space back
+        compact_database(db_conn)
+        db_conn.close()
+        sys.exit(0)
+
+    sync_started = utc_now()
+    since = get_high_water_mark(db_conn)
+    # What we commit is only as current as the oldest page it came from
+    data_as_of = sync_started
+
+    if args.offline:
+        print(f"--- 📦 Offline rebuild from '{args.cache_dir}' ---")
+        pages = cache.iter_pages()
+    elif args.incremental and since:
+        # Delta: everything added or re-scored since the last run
+        print(f"--- 🔄 Incremental sync: changes since {since} UTC ---")
+        pages = fetch_modified_since(since - OVERLAP, sync_started, NVD_API_KEY, FETCH_WORKERS, cache,
+                                     cache_newer_than=since)
+    else:
+        if args.incremental:
+            print("--- ⚠️ No previous sync recorded, running a full sync ---")
+        # Range: Now back to 10 years ago
+        end = datetime.datetime.now()
+        start = end - timedelta(days=DAYS_BACK)
+        # Skipped windows hold data as of their checkpoint's oldest page
+        finished = finished_windows(db_conn)
+        data_as_of = min([sync_started, *finished.values()])
+        pages = fetch_all_data(start, end, NVD_API_KEY, FETCH_WORKERS, cache, finished, cache_newer_than=since)
     
     # Fetch Loop
-    # Note: This may take 30-60 minutes for 10 years of data!
-    data = fetch_all_data(start, end)
-    
-    if data:
-        save_to_db(db_conn, data)
-    
-    db_conn.close()
\ No newline at end of file
+    # Windows are downloaded in parallel within the NVD rate limit.
+    # Each page is parsed and committed as soon as it arrives.
+    print(f"\n--- 💾 Saving records to Database ---")
+    total = 0
+    try:
+        for window, page in pages:
+            if page is None:
+                # Every page of this window is committed: checkpoint it
+                data_as_of = min(data_as_of, window.fetched_at or data_as_of)
+                if window.closed:
+                    mark_window_finished(db_conn, window.key, window.fetched_at)
+                continue
+            total += save_to_db(db_conn, page)
+            print(f"   Saved {total}...")
+    except NVDFetchError as e:
+        # Pages committed so far are kept; the high-water mark is not
+        # advanced, so the next run fetches the missing changes again
+        print(f"\n❌ Download failed: {e}")
+        db_conn.close()
+        sys.exit(1)
+
+    if not args.offline:
+        full_build = not (args.incremental and since)
+        if full_build:
+            clear_finished_windows(db_conn)
+        if data_as_of < sync_started:
+            print(f"   Used cached pages from {data_as_of:%Y-%m-%d %H:%M:%S} UTC: the next incremental sync starts there")
+        set_high_water_mark(db_conn, data_as_of)
+    print(f"\n✅ Success! Database ready at '{DB_FILE}' ({total} records)")
+    db_conn.close()
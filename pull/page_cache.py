@@ -0,0 +1,79 @@
+"""
+On-disk cache of raw NVD API pages.
+
+Every downloaded page is stored gzip'd under its window and startIndex:
+
+    nvd_cache/pub_20160101T000000_20160430T000000/0000000.json.gz
+
+A rerun reads finished pages from here instead of the network, and
+`--offline` rebuilds the whole DB from the cache alone. A page is only
+as current as the time it was downloaded (its file's mtime): online runs
+skip pages older than the last sync and date their high-water mark back
+to the oldest page they did use.
+"""
+import datetime
+import gzip
+import json
+import os
+
+DEFAULT_CACHE_DIR = os.environ.get("NVD_CACHE_DIR", "nvd_cache")
+
+class PageCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _path(self, window_key, start_index):
+        return os.path.join(self.cache_dir, window_key, f"{start_index:07d}.json.gz")
+
+    def fetched_at(self, window_key, start_index):
+        """When the page was downloaded (naive UTC), or None if not cached."""
+        try:
+            mtime = os.path.getmtime(self._path(window_key, start_index))
+        except OSError:
+            return None
+        return datetime.datetime.fromtimestamp(mtime, datetime.timezone.utc).replace(tzinfo=None)
+
+    def load(self, window_key, start_index, newer_than=None):
+        """Returns the cached API response for this page, or None. With
+        `newer_than`, pages downloaded before then count as missing."""
+        path = self._path(window_key, start_index)
+        if not os.path.exists(path):
+            return None
+        if newer_than is not None and self.fetched_at(window_key, start_index) < newer_than:
+            return None
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, EOFError, ValueError):
+            # Truncated by a crash mid-write: treat as missing
+            return None
+
+    def save(self, window_key, start_index, data):
+        path = self._path(window_key, start_index)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+            json.dump(data, f)
+        # Atomic: a page is either fully cached or not at all
+        os.replace(tmp_path, path)
+
+    def iter_pages(self):
+        """Yields (window_key, page) for everything cached.
+
+        Published-date windows come first in date order, then lastMod
+        (incremental) windows in date order, so replaying them leaves
+        each CVE in its most recent state.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        window_keys = sorted(os.listdir(self.cache_dir), key=lambda k: (not k.startswith("pub_"), k.split("_", 1)[-1]))
+        for window_key in window_keys:
+            window_dir = os.path.join(self.cache_dir, window_key)
+            if not os.path.isdir(window_dir):
+                continue
+            for name in sorted(os.listdir(window_dir)):
+                if not name.endswith(".json.gz"):
+                    continue
+                data = self.load(window_key, int(name.split(".")[0]))
+                if data and data.get("vulnerabilities"):
+                    yield window_key, data["vulnerabilities"]
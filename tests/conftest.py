@@ -0,0 +1,39 @@
+"""
+The agent (app/), the server (cloud/) and the NVD scripts (pull/) are run
+as scripts from their own directories, so their modules import each other
+by bare name. Tests do the same: all three go on sys.path, cloud/ first.
+Both app/ and cloud/ have a `delta` module; the agent's is loaded
+separately as `agent_delta`.
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for sub in ("app", "pull", "cloud"):
+    sys.path.insert(0, os.path.join(ROOT, sub))
+
+def load_module(name, relpath):
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, relpath))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+@pytest.fixture
+def agent_conf(tmp_path, monkeypatch):
+    """The agent's config, with every path under tmp_path."""
+    from config import conf, DEFAULT_CONFIG
+    data = dict(DEFAULT_CONFIG,
+                snapshot_file=str(tmp_path / "snapshot.json.gz"),
+                agent_id_file=str(tmp_path / "agent_id"),
+                spool_dir=str(tmp_path / "spool"))
+    monkeypatch.setattr(conf, "_data", data)
+    return data
+
+@pytest.fixture
+def agent_delta(agent_conf):
+    return load_module("agent_delta", "app/delta.py")
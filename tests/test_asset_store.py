@@ -0,0 +1,11 @@
+from asset_store import AssetStore
+
+def test_hosts_below_a_version(tmp_path):
+    store = AssetStore(str(tmp_path / "fleet.db"))
+    store.save({
+        "h1": {"agent_id": "h1", "inventory": [{"name": "zlib1g", "version": "1:1.2.11.dfsg-2ubuntu9", "manager": "deb"}]},
+        "h2": {"agent_id": "h2", "inventory": [{"name": "zlib1g", "version": "1:1.2.11.dfsg-2ubuntu9.2", "manager": "deb"}]},
+        "h3": {"agent_id": "h3", "inventory": [{"name": "zlib1g", "version": "1:1.2.11.dfsg-2ubuntu9~rc1", "manager": "deb"}]},
+    })
+    assert {row[0] for row in store.hosts_with_package("zlib1g", below="1:1.2.11.dfsg-2ubuntu9.2")} == {"h1", "h3"}
+    store.close()
@@ -0,0 +1,125 @@
+import copy
+
+import pytest
+
+import delta as cloud_delta
+
+def payload(**sections):
+    base = {
+        "agent_id": "agent-1",
+        "timestamp": 1000.0,
+        "asset_summary": {"hostname": "web-1", "os_name": "Ubuntu"},
+        "hardware": {"ram_gb": 4},
+        "network": {
+            "interfaces": [{"name": "eth0"}],
+            "open_ports": [{"protocol": "tcp", "port": 22, "address": "0.0.0.0"}],
+        },
+        "services": [{"name": "ssh", "status": "running"}, {"name": "cron", "status": "running"}],
+        "inventory": [
+            {"manager": "deb", "name": "openssl", "architecture": "amd64", "version": "3.0.2"},
+            {"manager": "deb", "name": "bash", "architecture": "amd64", "version": "5.1"},
+        ],
+        "collection_status": {"asset_summary": "ok", "hardware": "ok", "network": "ok",
+                              "services": "ok", "inventory": "ok"},
+    }
+    base.update(sections)
+    return base
+
+def upload(agent_delta, server_state, new_payload):
+    """One agent -> server round trip; returns (body, server's new state)."""
+    body, state = agent_delta.build_upload(new_payload)
+    server_state = cloud_delta.apply_upload(server_state, body)
+    agent_delta.save_snapshot(*state)
+    return body, server_state
+
+def test_modules_agree_on_item_keys_and_hashes(agent_delta):
+    assert agent_delta.ITEM_KEYS == cloud_delta.ITEM_KEYS
+    assert agent_delta.ENVELOPE == cloud_delta.ENVELOPE
+    p = payload()
+    assert agent_delta.snapshot_hash(*agent_delta.split_state(p)) == cloud_delta.state_hash(p)
+
+def test_hash_ignores_item_order(agent_delta):
+    p = payload()
+    q = copy.deepcopy(p)
+    q["inventory"].reverse()
+    q["network"]["open_ports"].reverse()
+    assert cloud_delta.state_hash(p) == cloud_delta.state_hash(q)
+
+def test_first_upload_is_full(agent_delta):
+    body, _ = agent_delta.build_upload(payload())
+    assert body["type"] == "full"
+    assert cloud_delta.apply_upload(None, body)["inventory"] == payload()["inventory"]
+
+def test_delta_round_trip(agent_delta):
+    _, server = upload(agent_delta, None, payload())
+
+    changed = payload(hardware={"ram_gb": 8})
+    changed["inventory"][0]["version"] = "3.0.13"
+    changed["inventory"].append({"manager": "pip", "name": "requests", "architecture": None, "version": "2.31.0"})
+    changed["services"] = changed["services"][:1]
+    changed["network"]["open_ports"] = []
+    body, server = upload(agent_delta, server, changed)
+
+    assert body["type"] == "delta"
+    assert body["sections"] == {"hardware": {"ram_gb": 8}}
+    inventory = body["items"]["inventory"]
+    assert len(inventory["added"]) == 2  # version is part of the key: 3.0.13 is new,
+    assert len(inventory["removed"]) == 1  # 3.0.2 is gone
+    assert body["items"]["services"]["removed"] == [["cron"]]
+    assert cloud_delta.state_hash(server) == cloud_delta.state_hash(changed)
+
+def test_removed_section_round_trip(agent_delta):
+    _, server = upload(agent_delta, None, payload())
+    smaller = payload()
+    del smaller["hardware"]
+    body, server = upload(agent_delta, server, smaller)
+    assert body["sections"] == {"hardware": None}
+    assert "hardware" not in server
+
+def test_unchanged_payload_sends_empty_delta(agent_delta):
+    _, server = upload(agent_delta, None, payload())
+    body, _ = upload(agent_delta, server, payload(timestamp=2000.0))
+    assert body["sections"] == {} and body["items"] == {}
+
+def failed(section, state="partial", empty=None):
+    p = payload()
+    p[section] = [] if empty is None else empty
+    p["collection_status"] = dict(p["collection_status"], **{section: state})
+    return p
+
+def test_partial_inventory_keeps_last_packages(agent_delta):
+    _, server = upload(agent_delta, None, payload())
+    body, server = upload(agent_delta, server, failed("inventory"))
+    assert "inventory" not in body["items"]
+    assert server["inventory"] == payload()["inventory"]
+
+def test_failed_services_keep_last_services(agent_delta):
+    _, server = upload(agent_delta, None, payload())
+    body, server = upload(agent_delta, server, failed("services", state="error"))
+    assert "services" not in body["items"]
+    assert len(server["services"]) == 2
+
+def test_partial_network_keeps_ports_and_interfaces(agent_delta):
+    _, server = upload(agent_delta, None, payload())
+    body, server = upload(agent_delta, server, failed("network", empty={}))
+    assert set(body["sections"]) == {"collection_status"} and body["items"] == {}
+    assert server["network"]["interfaces"] == [{"name": "eth0"}]
+    assert server["network"]["open_ports"] == payload()["network"]["open_ports"]
+
+def test_stale_base_is_refused(agent_delta):
+    _, server = upload(agent_delta, None, payload())
+    body, _ = agent_delta.build_upload(payload(hardware={"ram_gb": 2}))
+    other = payload(hardware={"ram_gb": 16})
+    with pytest.raises(cloud_delta.SnapshotMismatch):
+        cloud_delta.apply_upload(other, body)
+
+def test_unchanged_inventory_sends_cached_data(agent_delta):
+    # "unchanged" data is the collector's last good result, which may be
+    # newer than the acknowledged snapshot (e.g. that upload was spooled)
+    _, server = upload(agent_delta, None, payload())
+    p = payload()
+    p["inventory"] = p["inventory"][:1]
+    p["collection_status"] = dict(p["collection_status"], inventory="unchanged")
+    body, server = upload(agent_delta, server, p)
+    assert len(body["items"]["inventory"]["removed"]) == 1
+    assert len(server["inventory"]) == 1
@@ -0,0 +1,150 @@
+import importlib
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from asset_store import AssetStore
+from ingest import IngestQueue, Job, QueueFull
+
+def wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def job(key, raw=b"{}"):
+    return Job(key, raw, "identity", "127.0.0.1")
+
+def test_same_key_is_processed_in_order():
+    seen = []
+    ingest = IngestQueue(lambda jobs: seen.extend(j.raw for j in jobs), None, workers=4, capacity=400)
+    for i in range(50):
+        ingest.submit(job("agent-1", i))
+    wait_for(lambda: ingest.stats()["processed"] == 50)
+    assert seen == list(range(50))
+
+def test_failed_jobs_are_reported():
+    failed = []
+
+    def handler(jobs):
+        return {j: ValueError("bad") for j in jobs if j.raw == b"bad"}
+
+    ingest = IngestQueue(handler, lambda j, e: failed.append((j.key, str(e))), workers=1)
+    ingest.submit(job("a", b"ok"))
+    ingest.submit(job("b", b"bad"))
+    wait_for(lambda: ingest.stats()["processed"] + ingest.stats()["failed"] == 2)
+    assert failed == [("b", "bad")]
+    assert ingest.stats()["failed"] == 1
+
+def test_full_queue_refuses():
+    release = threading.Event()
+
+    def handler(jobs):
+        release.wait()
+
+    ingest = IngestQueue(handler, None, workers=1, capacity=1, batch=1)
+    ingest.submit(job("a"))
+    wait_for(lambda: ingest.depth() == 0)  # taken by the (blocked) worker
+    ingest.submit(job("b"))
+    with pytest.raises(QueueFull):
+        ingest.submit(job("c"))
+    release.set()
+    wait_for(lambda: ingest.stats()["processed"] == 2)
+    assert ingest.stats()["rejected"] == 1
+    ingest.submit(job("c"))
+
+@pytest.fixture(scope="module")
+def server_module(tmp_path_factory):
+    # The server creates cloud_data/ in the working directory on import
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("server"))
+    os.environ["VSCANNER_INGEST_WORKERS"] = "0"
+    try:
+        return importlib.import_module("cloud_server")
+    finally:
+        os.environ.pop("VSCANNER_INGEST_WORKERS")
+        os.chdir(cwd)
+
+@pytest.fixture
+def server(server_module, tmp_path, monkeypatch):
+    store = AssetStore(str(tmp_path / "assets.db"))
+    monkeypatch.setattr(server_module, "STATE_FOLDER", str(tmp_path / "state"))
+    monkeypatch.setattr(server_module, "STORE", store)
+    monkeypatch.setattr(server_module, "HEADS", {})
+    os.makedirs(tmp_path / "state")
+    yield server_module
+    store.close()
+
+def upload(client, agent_id, **headers):
+    body = json.dumps({"agent_id": agent_id, "inventory": [{"name": "openssl", "version": "3.0.2"}]})
+    return client.post("/api/upload_scan", data=body, headers={"X-Agent-Id": agent_id, **headers})
+
+def test_queue_full_answers_503_until_drained(server, monkeypatch):
+    release = threading.Event()
+
+    def blocked(jobs):
+        release.wait()
+        return server.process_jobs(jobs)
+
+    ingest = IngestQueue(blocked, server.job_failed, workers=1, capacity=1, batch=1)
+    monkeypatch.setattr(server, "INGEST", ingest)
+    client = server.app.test_client()
+
+    assert upload(client, "host-1").status_code == 202
+    wait_for(lambda: ingest.depth() == 0)
+    assert upload(client, "host-2").status_code == 202
+    busy = upload(client, "host-3")
+    assert busy.status_code == 503
+    assert busy.headers["Retry-After"] == str(server.RETRY_AFTER)
+    assert busy.get_json()["status"] == "busy"
+    assert client.get("/api/ingest").get_json()["rejected"] == 1
+
+    release.set()
+    wait_for(lambda: ingest.stats()["processed"] == 2)
+    assert upload(client, "host-3").status_code == 202
+    wait_for(lambda: ingest.stats()["processed"] == 3)
+    assert {host[0] for host in server.STORE.hosts_with_package("openssl")} == {"host-1", "host-2", "host-3"}
+
+def test_failed_upload_makes_the_agent_resync(server, monkeypatch):
+    ingest = IngestQueue(server.process_jobs, server.job_failed, workers=1)
+    monkeypatch.setattr(server, "INGEST", ingest)
+    client = server.app.test_client()
+
+    resp = client.post("/api/upload_scan", data=b"not gzip", headers={
+        "X-Agent-Id": "host-1", "Content-Encoding": "gzip", "X-Snapshot-Hash": "abc"})
+    assert resp.status_code == 202
+    wait_for(lambda: ingest.stats()["failed"] == 1)
+    assert upload(client, "host-1", **{"X-Base-Snapshot": "abc"}).status_code == 409
+
+def test_synchronous_ingest(server, monkeypatch):
+    monkeypatch.setattr(server, "INGEST", None)
+    client = server.app.test_client()
+    assert upload(client, "host-1").status_code == 200
+    assert server.STORE.hosts_with_package("openssl", "3.0.2")
+
+def test_bomb_is_stopped_without_inflating_it(server, monkeypatch):
+    import tracemalloc
+    import zlib
+    bomb = zlib.compress(b"\0" * (64 << 20))
+    monkeypatch.setattr(server, "MAX_BODY_SIZE", 1 << 20)
+    tracemalloc.start()
+    try:
+        with pytest.raises(OverflowError):
+            server.decode_body(bomb, "deflate")
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 4 << 20
+
+@pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+def test_corrupt_body_answers_400(server, monkeypatch, encoding):
+    if encoding not in server.supported_encodings():
+        pytest.skip(f"{encoding} not supported here")
+    monkeypatch.setattr(server, "INGEST", None)
+    client = server.app.test_client()
+    resp = client.post("/api/upload_scan", data=b"not compressed", headers={
+        "X-Agent-Id": "host-1", "Content-Encoding": encoding})
+    assert resp.status_code == 400
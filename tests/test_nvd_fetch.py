@@ -0,0 +1,143 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import fake_nvd_server
+import nvd_fetch
+from nvd_fetch import NVDFetcher, NVDFetchError, TokenBucket, make_window
+from page_cache import PageCache
+
+class FlakyNVD(fake_nvd_server.FakeNVD):
+    """Throttles (403) the first `fail_first` requests."""
+
+    def __init__(self, items, fail_first=0):
+        super().__init__(items)
+        self.fail_first = fail_first
+
+    def over_quota(self):
+        with self.lock:
+            self.stats["requests"] += 1
+            if self.stats["requests"] <= self.fail_first:
+                self.stats["throttled"] += 1
+                return True
+            return False
+
+@pytest.fixture
+def nvd(monkeypatch):
+    """Starts a fake NVD; returns a function (fail_first=0) -> (FakeNVD, base_url)."""
+    monkeypatch.setattr(nvd_fetch, "MAX_BACKOFF", 0.01)
+    servers = []
+
+    def start(fail_first=0, cves=300):
+        fake = FlakyNVD(fake_nvd_server.synthetic_cves(cves, 3650), fail_first)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), fake_nvd_server.make_handler(fake))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return fake, f"http://127.0.0.1:{server.server_address[1]}/rest/json/cves/2.0"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+def fetcher(base_url, quota=1000, workers=2, cache=None):
+    f = NVDFetcher(workers=workers, base_url=base_url, cache=cache)
+    f.bucket = TokenBucket(quota, period=1.0)
+    return f
+
+def windows(count, days=120):
+    start = datetime.now() - timedelta(days=3660)
+    return [make_window("pub", start + timedelta(days=days * i), start + timedelta(days=days * (i + 1)), True)
+            for i in range(count)]
+
+def test_bucket_stays_within_quota():
+    bucket = TokenBucket(10, period=1.0)
+    started = time.monotonic()
+    stamps = []
+    for _ in range(14):
+        bucket.acquire()
+        stamps.append(time.monotonic())
+    # 2 burst tokens, then 8 per second
+    assert stamps[-1] - started == pytest.approx(12 / 8, abs=0.2)
+    for i, stamp in enumerate(stamps):
+        assert sum(1 for s in stamps[i:] if s - stamp < 1.0) <= 10
+
+def test_bucket_penalty_and_recovery():
+    bucket = TokenBucket(10, period=1.0)
+    bucket.penalize(retry_after=0.3)
+    assert bucket.rate == bucket.base_rate / 2
+    started = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - started >= 0.3
+    for _ in range(10):
+        bucket.reward()
+    assert bucket.rate == bucket.base_rate
+
+def test_bucket_acquire_gives_up_when_stopped():
+    bucket = TokenBucket(10, period=1.0)
+    bucket.penalize(retry_after=30)
+    stop = threading.Event()
+    threading.Timer(0.1, stop.set).start()
+    started = time.monotonic()
+    assert bucket.acquire(stop) is False
+    assert time.monotonic() - started < 1
+
+def test_retries_throttled_requests(nvd):
+    fake, url = nvd(fail_first=2)
+    data = fetcher(url).get_page({"startIndex": 0, "resultsPerPage": 10})
+    assert len(data["vulnerabilities"]) == 10
+    assert fake.stats == {"requests": 3, "throttled": 2, "errors": 0}
+
+def test_gives_up_after_max_retries(nvd):
+    fake, url = nvd(fail_first=100)
+    with pytest.raises(NVDFetchError):
+        fetcher(url).get_page({"startIndex": 0})
+    assert fake.stats["requests"] == nvd_fetch.MAX_RETRIES
+
+def test_non_retryable_status_fails_at_once(nvd):
+    fake, url = nvd()
+    with pytest.raises(NVDFetchError, match="404"):
+        fetcher(url.replace("/cves/", "/nope/")).get_page({})
+    assert fake.stats["requests"] == 0
+
+def test_fetch_windows_pages_through_every_window(nvd, monkeypatch, tmp_path):
+    monkeypatch.setattr(nvd_fetch, "RESULTS_PER_PAGE", 7)
+    fake, url = nvd()
+    wins = windows(32)
+    seen, finished = set(), []
+    for window, page in fetcher(url, cache=PageCache(str(tmp_path))).fetch_windows(wins):
+        if page is None:
+            finished.append(window)
+        else:
+            seen.update(item["cve"]["id"] for item in page)
+    assert len(seen) == 300
+    assert sorted(w.key for w in finished) == sorted(w.key for w in wins)
+    assert all(w.fetched_at is not None for w in finished)
+
+    # Everything is cached now: a rerun makes no requests
+    requests = fake.stats["requests"]
+    assert sum(1 for _, page in fetcher(url, cache=PageCache(str(tmp_path))).fetch_windows(wins) if page) > 0
+    assert fake.stats["requests"] == requests
+
+def test_early_stop_drops_queued_windows(nvd):
+    fake, url = nvd()
+    # 2 requests per second: 40 windows would take 20s if they all ran
+    pages = fetcher(url, quota=4, workers=2).fetch_windows(windows(40, days=30))
+    next(pages)
+    started = time.monotonic()
+    pages.close()
+    assert time.monotonic() - started < 2
+    time.sleep(0.5)
+    assert fake.stats["requests"] <= 4
+
+def test_failed_window_stops_the_rest(nvd):
+    fake, url = nvd()
+    f = fetcher(url, quota=4, workers=2)
+    f.base_url = url.replace("/cves/", "/nope/")
+    started = time.monotonic()
+    with pytest.raises(NVDFetchError):
+        for _ in f.fetch_windows(windows(40, days=30)):
+            pass
+    assert time.monotonic() - started < 3
@@ -0,0 +1,99 @@
+import json
+import os
+import sys
+import time
+
+import pytest
+
+from osquery import MARKER, OsquerySession, OutputParser, parse_output
+
+FAKE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "fake_osqueryi.py")
+
+@pytest.fixture
+def osqueryi(tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_OSQUERYI_STARTUP_MS", "0")
+    # Buffer like the real osqueryi does
+    monkeypatch.delenv("PYTHONUNBUFFERED", raising=False)
+    wrapper = tmp_path / "osqueryi"
+    wrapper.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE}" "$@"\n')
+    wrapper.chmod(0o755)
+    return str(wrapper)
+
+def output(*arrays):
+    return "".join(json.dumps(rows, indent=2) + "\n" for rows in arrays)
+
+def test_parse_output_skips_noise():
+    text = ("W1018 warning [ignored]\n"
+            + output([{"a": "1"}, {"a": "2"}], [{MARKER: "q1"}], [{MARKER: "q2"}], [{"b": "]"}], [{MARKER: "q3"}]))
+    assert parse_output(text) == {"q1": [{"a": "1"}, {"a": "2"}], "q2": [], "q3": [{"b": "]"}]}
+
+def test_parser_reports_queries_as_they_complete():
+    text = output([{"a": "1"}], [{MARKER: "q1"}], [{"b": "2"}], [{MARKER: "q2"}])
+    parser = OutputParser()
+    done = []
+    for i in range(0, len(text), 7):
+        done += parser.feed(text[i:i + 7])
+        if "q1" in done:
+            assert parser.results["q1"] == [{"a": "1"}]
+    done += parser.close()
+    assert done == ["q1", "q2"]
+    assert parser.results == parse_output(text)
+
+def sessions(binary):
+    session = OsquerySession(binary)
+    session.group("first")
+    session.add("first.info", "SELECT hostname FROM system_info;")
+    session.group("slow")
+    session.add("slow.ports", "SELECT port FROM listening_ports;")
+    session.add("slow.units", "SELECT name FROM systemd_units;")
+    session.group("last")
+    session.add("last.info", "SELECT uptime FROM uptime;")
+    return session
+
+def test_groups_run(osqueryi):
+    session = sessions(osqueryi)
+    session.run(timeout=30)
+    assert session.status == {"first": "ok", "slow": "ok", "last": "ok"}
+    assert len(session.rows("slow.ports")) == 12
+    assert len(session.rows("slow.units")) == 60
+    assert len(session.rows("last.info")) == 3
+
+def test_groups_run_concurrently(osqueryi, monkeypatch):
+    monkeypatch.setenv("FAKE_OSQUERYI_SLOW", "systemd_units:1.5,uptime:1.5")
+    session = sessions(osqueryi)
+    started = time.monotonic()
+    session.run(timeout=30)
+    assert 1.5 <= time.monotonic() - started < 2.5
+    assert session.status == {"first": "ok", "slow": "ok", "last": "ok"}
+
+def test_timeout_cuts_one_group(osqueryi, monkeypatch):
+    monkeypatch.setenv("FAKE_OSQUERYI_SLOW", "systemd_units:30")
+    session = sessions(osqueryi)
+    started = time.monotonic()
+    session.run(timeout=1.5)
+    assert time.monotonic() - started < 5
+    assert session.status == {"first": "ok", "slow": "partial", "last": "ok"}
+    assert session.timed_out
+    # Finished before the deadline: only seen if output streams unflushed
+    assert len(session.rows("slow.ports")) == 12
+    assert session.rows("slow.units") == []
+    assert len(session.rows("last.info")) == 3
+
+def test_cycle_takes_as_long_as_the_slowest_collector(osqueryi, agent_conf, monkeypatch):
+    import main
+    monkeypatch.setitem(agent_conf, "osquery_bin", osqueryi)
+    monkeypatch.setattr(main, "SPOOL", None)
+    monkeypatch.setattr(main, "CHANGES", None)
+    monkeypatch.setenv("FAKE_OSQUERYI_SLOW", "deb_packages:2,systemd_units:2,uptime:2")
+    started = time.monotonic()
+    sections, status, _ = main.collect(30)
+    assert time.monotonic() - started < 3.5
+    assert set(status.values()) == {"ok"}
+    assert sections["services"] and sections["inventory"]
+
+def test_missing_binary(tmp_path):
+    session = sessions(str(tmp_path / "missing"))
+    session.run(timeout=1)
+    assert session.status == {"first": "error", "slow": "error", "last": "error"}
+    assert session.error is not None
+    assert session.rows("first.info") == []
@@ -0,0 +1,102 @@
+import json
+import os
+
+import pytest
+
+import build_nvd_db
+from asset_store import AssetStore
+from rematch import Rematcher
+from rule_index import compile_index
+
+def cve(cve_id):
+    return (cve_id, "test", "HIGH", 7.5, "2024-01-01")
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    monkeypatch.setattr(build_nvd_db, "DB_FILE", str(tmp_path / "nvd.db"))
+    nvd = build_nvd_db.setup_database()
+    loader = build_nvd_db.BulkLoader(nvd)
+    loader.write([cve("CVE-A"), cve("CVE-B")],
+                 [("CVE-A", "openssl", "openssl", "a", None, "1.1.1g", None),
+                  ("CVE-B", "zlib", "zlib", "a", None, "1.3", None)])
+    loader.finish()
+
+    store = AssetStore(str(tmp_path / "assets.db"))
+    store.save({
+        "h1": {"agent_id": "h1", "inventory": [
+            {"name": "openssl", "version": "1.1.1f", "manager": "deb"},
+            {"name": "frobnicate", "version": "1.0", "manager": "deb"}]},
+        "h2": {"agent_id": "h2", "inventory": [{"name": "zlib1g", "version": "1:1.2.11.dfsg-2", "manager": "deb"}]},
+    })
+    store.close()
+    yield tmp_path, nvd
+    nvd.close()
+
+def rematch(tmp_path):
+    compile_index(str(tmp_path / "nvd.db"), str(tmp_path / "rules.idx"))
+    rematcher = Rematcher(str(tmp_path / "assets.db"), str(tmp_path / "nvd.db"), str(tmp_path / "rules.idx"))
+    return rematcher
+
+def host_findings(tmp_path, agent_id):
+    with open(tmp_path / "findings" / f"{agent_id}.json") as f:
+        data = json.load(f)
+    return data, {finding["cve_id"] for finding in data["findings"]}
+
+def test_rewrites_findings_of_affected_hosts(env):
+    tmp_path, nvd = env
+    rematcher = rematch(tmp_path)
+    stats, new, closed = rematcher.run()
+    assert stats["full"] and stats["new"] == 2
+    rematcher.write_findings(str(tmp_path / "findings"), ["h1", "h2"])
+    rematcher.close()
+    h1, cves = host_findings(tmp_path, "h1")
+    assert cves == {"CVE-A"}
+    assert h1["findings"][0]["package"] == "openssl" and h1["findings"][0]["severity"] == "HIGH"
+    h2_before, cves = host_findings(tmp_path, "h2")
+    assert cves == {"CVE-B"}
+
+    # CVE-A is fixed earlier than thought; a new product claims frobnicate
+    loader = build_nvd_db.BulkLoader(nvd)
+    loader.write([cve("CVE-A"), cve("CVE-C")],
+                 [("CVE-A", "openssl", "openssl", "a", None, "1.0.2", None),
+                  ("CVE-C", "acme", "frobnicate", "a", None, "2.0", None)])
+
+    rematcher = rematch(tmp_path)
+    frobnicate = rematcher.conn.execute("SELECT id FROM package_ids WHERE name = 'frobnicate'").fetchone()[0]
+    assert rematcher.claimable(2) == [frobnicate]
+    stats, new, closed = rematcher.run()
+    assert not stats["full"]
+    # openssl (changed product) and frobnicate (claimed by a new product), not zlib
+    assert stats["evaluated"] == 2
+    assert {cve_id for _, cve_id, _ in new} == {"CVE-C"}
+    assert {cve_id for _, cve_id, _ in closed} == {"CVE-A"}
+    hosts = {event["agent_id"] for kind, pairs in (("new", new), ("closed", closed))
+             for event in rematcher.events(kind, pairs)}
+    assert hosts == {"h1"}
+    rematcher.write_findings(str(tmp_path / "findings"), hosts)
+    rematcher.close()
+
+    assert host_findings(tmp_path, "h1")[1] == {"CVE-C"}
+    assert host_findings(tmp_path, "h2")[0] == h2_before
+    assert not [name for name in os.listdir(tmp_path / "findings") if name.endswith(".tmp")]
+
+def test_a_cve_on_two_products_is_two_findings(env):
+    tmp_path, nvd = env
+    # frobnicate has no vendor of its own name: it resolves to both products
+    loader = build_nvd_db.BulkLoader(nvd)
+    loader.write([cve("CVE-D")],
+                 [("CVE-D", "acme", "frobnicate", "a", None, "2.0", None),
+                  ("CVE-D", "globex", "frobnicate", "a", None, "2.0", None)])
+    loader.finish()
+    rematcher = rematch(tmp_path)
+    stats, new, closed = rematcher.run()
+    found = {(cve_id, product_id) for _, cve_id, product_id in new if cve_id == "CVE-D"}
+    assert len(found) == 2
+    events = [event for event in rematcher.events("new", new) if event["cve_id"] == "CVE-D"]
+    assert {(event["cve_id"], event["product_id"]) for event in events} == found
+    assert len([f for f in rematcher.host_findings(["h1"])["h1"] if f["cve_id"] == "CVE-D"]) == 2
+
+    # Candidate names are indexed as packages resolve, for claimable()
+    frobnicate = rematcher.conn.execute("SELECT id FROM package_ids WHERE name = 'frobnicate'").fetchone()[0]
+    assert (frobnicate,) in rematcher.conn.execute("SELECT package_id FROM package_candidates WHERE name = 'frobnicate'")
+    rematcher.close()
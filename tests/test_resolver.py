@@ -0,0 +1,69 @@
+import sqlite3
+
+import pytest
+
+from resolver import Resolver, candidates
+
+PRODUCTS = [
+    ("openssl", "openssl", "a"),
+    ("nodejs", "openssl", "a"),
+    ("python", "requests", "a"),
+    ("acme", "requests", "a"),
+    ("djangoproject", "django", "a"),
+    ("linux", "linux_kernel", "o"),
+    ("acme", "kernel", "a"),
+    ("apache", "http_server", "a"),
+    ("ibm", "http_server", "a"),
+    ("haxx", "curl", "a"),
+    ("xmlsoft", "libxml2", "a"),
+    ("acme", "xml2", "a"),
+    ("cisco", "router", "h"),
+    ("gnu", "glibc", "a"),
+]
+
+@pytest.fixture(scope="module")
+def resolver():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, vendor TEXT, name TEXT, type TEXT)")
+    conn.executemany("INSERT INTO products (vendor, name, type) VALUES (?, ?, ?)", PRODUCTS)
+    return Resolver(conn), dict(((v, n), pid) for pid, v, n in conn.execute("SELECT id, vendor, name FROM products"))
+
+def resolve(resolver, name, source=None, manager=None):
+    res, ids = resolver
+    names = {pid: key for key, pid in ids.items()}
+    return sorted(names[pid] for pid in res.resolve(name, source, manager))
+
+def test_ecosystem_packages_only_match_ecosystem_vendors(resolver):
+    assert resolve(resolver, "requests", manager="pip") == [("python", "requests")]
+    assert resolve(resolver, "Django", manager="pip") == [("djangoproject", "django")]
+    assert resolve(resolver, "kernel", manager="pip") == []
+
+def test_alias_beats_raw_name(resolver):
+    assert resolve(resolver, "kernel", manager="rpm") == [("linux", "linux_kernel")]
+    assert resolve(resolver, "apache2", manager="deb") == [("apache", "http_server")]
+    assert resolve(resolver, "httpd", manager="rpm") == [("apache", "http_server")]
+
+def test_vendor_of_the_same_name_wins(resolver):
+    assert resolve(resolver, "openssl", manager="deb") == [("openssl", "openssl")]
+    assert resolve(resolver, "openssl", manager="rpm") == [("openssl", "openssl")]
+
+def test_language_prefix_scopes_to_the_ecosystem(resolver):
+    assert resolve(resolver, "python3-requests", manager="deb") == [("python", "requests")]
+    assert resolve(resolver, "python3-django", manager="deb") == [("djangoproject", "django")]
+    assert resolve(resolver, "python3-kernel", manager="deb") == []
+
+def test_distro_names_fall_back_to_stripping(resolver):
+    assert resolve(resolver, "libssl3", "openssl", manager="deb") == [("openssl", "openssl")]
+    assert resolve(resolver, "libcurl4", manager="deb") == [("haxx", "curl")]
+    assert resolve(resolver, "libc6", "glibc (2.35-0ubuntu3)", manager="deb") == [("gnu", "glibc")]
+
+def test_exact_name_is_not_stripped(resolver):
+    assert resolve(resolver, "libxml2", manager="deb") == [("xmlsoft", "libxml2")]
+
+def test_hardware_never_matches(resolver):
+    assert resolve(resolver, "router", manager="deb") == []
+
+def test_candidate_order():
+    assert list(candidates("kernel")) == [("linux", "linux_kernel", None), (None, "kernel", None)]
+    assert list(candidates("kernel", aliases=False)) == [(None, "kernel", None)]
+    assert list(candidates("python3-requests"))[:2] == [(None, "python3_requests", None), (None, "requests", "python")]
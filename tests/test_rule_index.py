@@ -0,0 +1,105 @@
+import random
+import sqlite3
+
+import pytest
+
+from rule_index import FORMAT_VERSION, RuleIndex, RuleIndexError, compile_index, rule_interval
+from versions import upstream_key, version_key
+
+def build(tmp_path, rules):
+    """rules: (product_id, cve_id, start, end_excl, end_incl)"""
+    db = tmp_path / "nvd.db"
+    conn = sqlite3.connect(db)
+    conn.execute('''CREATE TABLE vulnerability_rules (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT, cve_id TEXT, product_id INTEGER,
+                    version_start TEXT, version_end_excl TEXT, version_end_incl TEXT)''')
+    conn.executemany('''INSERT INTO vulnerability_rules (product_id, cve_id, version_start,
+                        version_end_excl, version_end_incl) VALUES (?, ?, ?, ?, ?)''', rules)
+    conn.commit()
+    conn.close()
+    out = str(tmp_path / "rules.idx")
+    compile_index(str(db), out)
+    return RuleIndex(out)
+
+def brute_force(rules, product_id, version):
+    key = version_key(version)
+    found = set()
+    for pid, cve_id, start, end_ex, end_in in rules:
+        lo, hi, hi_incl = rule_interval(start, end_ex, end_in)
+        if pid == product_id and lo <= key and (key < hi or (hi_incl and key == hi)):
+            found.add(cve_id)
+    return found
+
+def test_bounds(tmp_path):
+    index = build(tmp_path, [
+        (1, "CVE-EXCL", "1.0", "2.0", None),
+        (1, "CVE-INCL", "1.5", None, "2.0"),
+        (1, "CVE-OPEN-END", "3.0", None, None),
+        (1, "CVE-NO-START", None, "0.9", None),
+        (2, "CVE-OTHER", None, None, None),
+    ])
+    assert index.affected(1, "0.1") == {"CVE-NO-START"}
+    assert index.affected(1, "0.9") == set()
+    assert index.affected(1, "1.0") == {"CVE-EXCL"}
+    assert index.affected(1, "1.5") == {"CVE-EXCL", "CVE-INCL"}
+    assert index.affected(1, "2.0") == {"CVE-INCL"}
+    assert index.affected(1, "2.0.1") == set()
+    assert index.affected(1, "99") == {"CVE-OPEN-END"}
+    assert index.affected(2, "1.0") == {"CVE-OTHER"}
+    assert index.affected(3, "1.0") == set()
+    assert index.has_product(1) and not index.has_product(3)
+
+def test_pre_release_bound_is_exclusive(tmp_path):
+    index = build(tmp_path, [(1, "CVE-1", None, "2.0b1", None)])
+    assert index.affected(1, "2.0a3") == {"CVE-1"}
+    assert index.affected(1, "2.0b1") == set()
+    assert index.affected(1, version_key("2.0-beta1")) == set()
+
+def test_trailing_zero_bounds(tmp_path):
+    index = build(tmp_path, [(1, "CVE-1", "1.0.0", None, "1.2.11"), (2, "CVE-2", None, None, "1.2.11")])
+    assert index.affected(1, "1.0") == {"CVE-1"}
+    assert index.affected(1, "1.2.11.0") == {"CVE-1"}
+    zlib = upstream_key("1:1.2.11.dfsg-2ubuntu9", "deb")
+    assert index.affected(2, zlib) == {"CVE-2"}
+
+def test_walk_continues_past_short_rules(tmp_path):
+    # A wide early rule must still be found behind later, narrower ones
+    index = build(tmp_path, [
+        (1, "CVE-WIDE", "1.0", "5.0", None),
+        (1, "CVE-A", "2.0", "2.1", None),
+        (1, "CVE-B", "3.0", "3.1", None),
+        (1, "CVE-C", "4.0", None, "4.0"),
+    ])
+    assert index.affected(1, "4.5") == {"CVE-WIDE"}
+    assert index.affected(1, "4.0") == {"CVE-WIDE", "CVE-C"}
+    assert index.affected(1, "5.0") == set()
+
+def test_matches_brute_force(tmp_path):
+    rng = random.Random(7)
+    versions = [f"{a}.{b}" for a in range(6) for b in range(6)] + ["1.1rc1", "2.0b1", "3.3a", "4.0.dev1"]
+    rules = []
+    for n in range(400):
+        lo, hi = sorted(rng.sample(versions, 2), key=version_key)
+        start = rng.choice([lo, None])
+        kind = rng.randrange(3)
+        rules.append((rng.randrange(1, 6), f"CVE-{n}", start,
+                      hi if kind == 0 else None, hi if kind == 1 else None))
+    index = build(tmp_path, rules)
+    for product_id in range(1, 7):
+        for version in versions + ["0", "9.9"]:
+            assert index.affected(product_id, version) == brute_force(rules, product_id, version)
+
+def test_rejects_bad_files(tmp_path):
+    index = build(tmp_path, [(1, "CVE-1", None, "1.0", None)])
+    data = open(index.path, "rb").read()
+    index.close()
+
+    truncated = tmp_path / "truncated.idx"
+    truncated.write_bytes(data[:-1])
+    with pytest.raises(RuleIndexError):
+        RuleIndex(str(truncated))
+
+    old = tmp_path / "old.idx"
+    old.write_bytes(data[:4] + (FORMAT_VERSION - 1).to_bytes(4, "little") + data[8:])
+    with pytest.raises(RuleIndexError):
+        RuleIndex(str(old))
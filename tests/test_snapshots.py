@@ -0,0 +1,78 @@
+import json
+import os
+import threading
+
+import pytest
+
+import build_nvd_db
+from snapshots import MANIFEST, SnapshotManager, publish, versions
+
+@pytest.fixture
+def snapshots(tmp_path, monkeypatch):
+    monkeypatch.setattr(build_nvd_db, "DB_FILE", str(tmp_path / "nvd.db"))
+    nvd = build_nvd_db.setup_database()
+    loader = build_nvd_db.BulkLoader(nvd)
+    loader.write([("CVE-A", "test", "HIGH", 7.5, "2024-01-01")],
+                 [("CVE-A", "openssl", "openssl", "a", None, "1.1.1g", None)])
+    loader.finish()
+    nvd.close()
+    directory = str(tmp_path / "snapshots")
+    version = publish(str(tmp_path / "nvd.db"), directory)
+    return directory, version
+
+def test_manifest_describes_the_copy(snapshots):
+    directory, version = snapshots
+    with open(os.path.join(directory, version, MANIFEST)) as f:
+        manifest = json.load(f)
+    assert (manifest["cves"], manifest["products"], manifest["vulnerability_rules"]) == (1, 1, 1)
+    assert manifest["build_id"]
+
+def test_one_matcher_per_thread(snapshots):
+    directory, _ = snapshots
+    manager = SnapshotManager(directory)
+    inventory = {"h1": [{"name": "libssl3", "version": "1.1.1f", "manager": "deb"}]}
+    # Checked here: an assert failing in a worker thread would not fail the test
+    seen, findings = [], []
+
+    def work():
+        with manager.acquire() as snap:
+            seen.append((snap.matcher, snap.matcher))
+            findings.append(snap.matcher.match_inventories(inventory)["h1"])
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(findings) == 4
+    assert all(first is second for first, second in seen)
+    assert len({id(first) for first, _ in seen}) == 4
+    assert all([f["cve_id"] for f in found] == ["CVE-A"] for found in findings)
+
+    snapshot = manager.snapshot
+    manager.close()
+    assert snapshot.refs == 0
+    for matcher in snapshot.matchers:
+        with pytest.raises(Exception):
+            matcher.conn.execute("SELECT 1")
+
+def test_prune_keeps_open_versions(snapshots, tmp_path):
+    directory, first = snapshots
+    manager = SnapshotManager(directory)
+    snap = manager.acquire()
+    publish(str(tmp_path / "nvd.db"), directory, keep=0)
+    publish(str(tmp_path / "nvd.db"), directory, keep=0)
+    assert first in versions(directory)
+
+    # A thread that starts matching after the prune still opens its Matcher
+    found = []
+    thread = threading.Thread(target=lambda: found.append(snap.matcher.conn.execute("SELECT COUNT(*) FROM cves").fetchone()))
+    thread.start()
+    thread.join()
+    assert found == [(1,)]
+
+    snap.release()
+    manager.close()
+    publish(str(tmp_path / "nvd.db"), directory, keep=0)
+    assert first not in versions(directory)
+    assert len(versions(directory)) == 1
@@ -0,0 +1,73 @@
+import pytest
+
+from versions import package_key, upstream_key, version_key
+
+def ordered(*versions):
+    keys = [version_key(v) for v in versions]
+    return all(a < b for a, b in zip(keys, keys[1:]))
+
+def test_generic_ordering():
+    assert ordered("1.0.dev1", "1.0-beta", "1.0~rc1", "1.0", "1.0a", "1.0.1", "1.0.10")
+    assert ordered("1.9", "1.10", "1.100")
+    assert version_key("1.01") == version_key("1.1")
+
+def test_trailing_zeros_do_not_count():
+    assert version_key("1.0") == version_key("1.0.0") == version_key("1")
+    assert version_key("1.0.0-rc1") == version_key("1.0rc1")
+    assert version_key("2.0.0b1") == version_key("2.0b1")
+    assert ordered("0", "0.0.1", "0.1", "1.0", "1.0a", "1.0.0.1", "1.0.1")
+
+def test_openssl_letter_releases_sort_after():
+    assert ordered("1.1.1", "1.1.1a", "1.1.1f", "1.1.1g", "1.1.1za")
+    assert ordered("9.1", "9.1p1", "9.2")
+
+def test_short_pre_releases():
+    assert ordered("2.0.dev1", "2.0a1", "2.0b1", "2.0b2", "2.0rc1", "2.0", "2.0.post1")
+    assert version_key("2.0b1") == version_key("2.0-beta1") == version_key("2.0.b1")
+    assert version_key("3.1c1") == version_key("3.1rc1")
+
+@pytest.mark.parametrize("installed, bound", [
+    ("2.0b1", "2.0b1"),
+    ("2.0.0b1", "2.0.0b1"),
+    ("2.0rc2", "2.0rc2"),
+    ("1.0.post1", "1.0.post1"),
+    ("1.0-1", "1.0.post1"),
+    ("2.0.dev3", "2.0.dev3"),
+    ("2.0B1", "2.0b1"),
+])
+def test_pip_versions_match_nvd_spelling(installed, bound):
+    assert upstream_key(installed, "pip") == version_key(bound)
+
+@pytest.mark.parametrize("installed, manager, upstream", [
+    ("1:1.1.1f-1ubuntu2.16", "deb", "1.1.1f"),
+    ("2.4.52+dfsg-1", "deb", "2.4.52"),
+    ("1:1.2.11.dfsg-2ubuntu9", "deb", "1.2.11"),
+    ("1.2.13.dfsg-1", "deb", "1.2.13.0"),
+    ("5.4+really5.3-1", "deb", "5.3"),
+    ("1.2.3~ds1-2", "deb", "1.2.3"),
+    ("3.0.7-16.el9_2", "rpm", "3.0.7"),
+    ("1:2.9.13-2.el8", "rpm", "2.9.13"),
+    ("7.88.1", None, "7.88.1"),
+])
+def test_distro_decorations_are_stripped(installed, manager, upstream):
+    assert upstream_key(installed, manager) == version_key(upstream)
+
+@pytest.mark.parametrize("manager, older, newer", [
+    ("deb", "1.0~rc1-1", "1.0-1"),
+    ("deb", "1:0.9-1", "2:0.1-1"),
+    ("deb", "1.2.11.dfsg-2ubuntu9", "1.2.11.dfsg-2ubuntu9.1"),
+    ("deb", "1.0-1", "1.0+b1-1"),
+    ("rpm", "1.0~rc1-1.el9", "1.0-1.el9"),
+    ("rpm", "3.0.7-16.el9", "3.0.7-16.el9_2"),
+    ("rpm", "1.0-1", "1.0^git1-1"),
+    ("pip", "2.0.dev1", "2.0a1"),
+    ("pip", "2.0rc1", "2.0"),
+    ("pip", "2.0", "2.0.post1"),
+    ("pip", "2.0", "1!0.1"),
+])
+def test_package_key_follows_the_manager(manager, older, newer):
+    assert package_key(older, manager) < package_key(newer, manager)
+
+def test_package_key_equalities():
+    assert package_key("1.0", "pip") == package_key("1.0.0", "pip")
+    assert package_key("0:1.0-1", "deb") == package_key("1.0-1", "deb")